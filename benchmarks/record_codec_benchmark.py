@@ -0,0 +1,51 @@
+import pickle
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from domain.RaspberryInfo import RaspberryInfo
+from domain.WateringProgram import WateringProgram
+from utils import record_codec
+
+# run from the repository root: python -m benchmarks.record_codec_benchmark [iterations]
+
+
+def _sample_records() -> dict:
+    _now = datetime(2024, 5, 1, 8, 30, tzinfo=timezone(timedelta(hours=3)))
+
+    return {
+        "raspberry_info": RaspberryInfo("10000000abcdef01", "Balcony", "Bucharest", "Tomatoes").to_dict(),
+        "watering_programs": [
+            WateringProgram(f"program-{i}", f"Program {i}", 1.5, 0.25, _now + timedelta(days=i), 20.0, 60.0)
+            for i in range(10)
+        ],
+        "watering_programs_active_id": "program-3",
+        "is_watering_programs_active": True,
+        "moisture_sensor": {"absolute_dry": 21450, "absolute_wet": 9870},
+        "pump_capacity": 0.021,
+        "depth_sensor": {"tank_volume_ratio": 0.3333, "max_height": 24.5},
+        "last_watering_time": {"program_id": "program-3", "timestamp": _now},
+    }
+
+
+def _time_per_call_us(function, iterations) -> float:
+    return min(timeit.repeat(function, number=iterations, repeat=5)) / iterations * 1e6
+
+
+def main(iterations=2000):
+    print(f"{'record':<30}{'pickle B':>10}{'codec B':>10}"
+          f"{'pickle save':>14}{'codec save':>13}{'pickle load':>14}{'codec load':>13}   (us per record)")
+
+    for name, value in _sample_records().items():
+        _pickled = pickle.dumps(value)
+        _encoded = record_codec.encode(value)
+
+        print(f"{name:<30}{len(_pickled):>10}{len(_encoded):>10}"
+              f"{_time_per_call_us(lambda: pickle.dumps(value), iterations):>14.2f}"
+              f"{_time_per_call_us(lambda: record_codec.encode(value), iterations):>13.2f}"
+              f"{_time_per_call_us(lambda: pickle.loads(_pickled), iterations):>14.2f}"
+              f"{_time_per_call_us(lambda: record_codec.decode(_encoded), iterations):>13.2f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,4 +1,3 @@
-import threading
 import time
 
 from kivy.app import App
@@ -6,6 +5,7 @@ from kivy.lang import Builder
 from kivy.properties import BooleanProperty, StringProperty, Clock, NumericProperty
 from kivymd.uix.screen import MDScreen
 
+from utils.async_runtime import spawn
 from utils.local_storage_controller import LocalStorageController
 from utils.raspberry_controller import RaspberryController
 from utils.water_depth_measurement_controller import WaterDepthMeasurementController
@@ -38,8 +38,7 @@ class DepthCalibrationView(MDScreen):
         self._min_value = None
         self._max_value = None
         self._tank_volume = None
-        self._current_thread = None
-        self._cancel_event = None
+        self._current_task = None
 
         self._init_setup()
 
@@ -63,8 +62,7 @@ class DepthCalibrationView(MDScreen):
         self._max_value = None
         self._tank_volume = self._volume_options[self._selected_option]
 
-        self._current_thread = None
-        self._cancel_event = threading.Event()
+        self._current_task = None
 
     def calibrate_button_function(self, *args):
         if self._max_value is None:
@@ -73,12 +71,7 @@ class DepthCalibrationView(MDScreen):
             self.calibrating = True
             self.loading_text = "Measuring water depth..."
 
-            self._current_thread = threading.Thread(
-                target=self._get_max_value,
-                args=(self._on_height_measurement_finished,)
-            )
-
-            self._current_thread.start()
+            self._current_task = spawn(self._get_max_value(self._on_height_measurement_finished))
 
         elif self._finished_step_1 is False:
             self._on_max_value_computing_finished()
@@ -87,12 +80,7 @@ class DepthCalibrationView(MDScreen):
             self.calibrating = True
             self.loading_text = "Measuring water depth..."
 
-            self._current_thread = threading.Thread(
-                target=self._get_min_value,
-                args=(self._on_height_measurement_finished,)
-            )
-
-            self._current_thread.start()
+            self._current_task = spawn(self._get_min_value(self._on_height_measurement_finished))
 
         elif self._finished_step_2 is False:
             self._on_min_value_computing_finished()
@@ -107,24 +95,23 @@ class DepthCalibrationView(MDScreen):
 
             self._navigate_back()
 
-    def _get_min_value(self, on_thread_finished=None):
-        self._min_value = RaspberryController().water_depth_measurement_controller.measure_water_depth_cm()
-        if on_thread_finished is not None:
-            on_thread_finished()
+    async def _get_min_value(self, on_finished=None):
+        self._min_value = await RaspberryController().water_depth_measurement_controller.measure_water_depth_cm_async()
+        if on_finished is not None:
+            on_finished()
 
-    def _get_max_value(self, on_thread_finished=None):
-        self._max_value = RaspberryController().water_depth_measurement_controller.measure_water_depth_cm()
-        if on_thread_finished is not None:
-            on_thread_finished()
+    async def _get_max_value(self, on_finished=None):
+        self._max_value = await RaspberryController().water_depth_measurement_controller.measure_water_depth_cm_async()
+        if on_finished is not None:
+            on_finished()
 
     def _change_volume_option(self):
         self._selected_option = self.ids.volume_spinner.text
         self._tank_volume = self._volume_options[self._selected_option]
 
     def cancel(self, *args):
-        self._cancel_event.set()
-        if self._current_thread is not None:
-            self._current_thread.join()
+        if self._current_task is not None:
+            self._current_task.cancel()
         self._navigate_back()
 
     def _navigate_back(self):
@@ -1,10 +1,11 @@
-import threading
+import asyncio
 
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.properties import BooleanProperty, StringProperty, Clock
 from kivymd.uix.screen import MDScreen
 
+from utils.async_runtime import run_blocking, spawn
 from utils.local_storage_controller import LocalStorageController
 from utils.raspberry_controller import RaspberryController
 
@@ -26,8 +27,7 @@ class MoistureCalibrationView(MDScreen):
 
         self._step_time_s = 10
 
-        self._current_thread = None
-        self._cancel_event = threading.Event()
+        self._current_task = None
 
     def on_enter(self, *args):
         self.calibrating = False
@@ -39,8 +39,7 @@ class MoistureCalibrationView(MDScreen):
         self._min_value = None
         self._max_value = None
 
-        self._current_thread = None
-        self._cancel_event.clear()
+        self._current_task = None
 
     def on_leave(self, *args):
         self.on_enter(args)
@@ -48,66 +47,51 @@ class MoistureCalibrationView(MDScreen):
     def calibrate_button_function(self, *args):
         if self._min_value is None:
             self.calibrating = True
-            self._current_thread = threading.Thread(
-                target=self._get_min_value,
-                args=(self._on_min_value_thread_finished,)
-            )
-
-            self._current_thread.start()
+            self._current_task = spawn(self._get_min_value(self._on_min_value_finished))
 
         elif self._max_value is None:
             self.calibrating = True
-            self._current_thread = threading.Thread(
-                target=self._get_max_value,
-                args=(self._on_max_value_thread_finished,)
-            )
-
-            self._current_thread.start()
+            self._current_task = spawn(self._get_max_value(self._on_max_value_finished))
 
         else:
             RaspberryController().moisture_controller.update_absolute_values(self._min_value, self._max_value)
             self._navigate_back()
 
-    def _get_min_value(self, on_thread_finished=None):
+    async def _get_min_value(self, on_finished=None):
         _time = 0
 
         while _time < self._step_time_s:
             self.loading_text = f"Time left: {self._step_time_s - _time} seconds"
             _time += 1
 
-            self._cancel_event.wait(1)
-            if self._cancel_event.is_set():
-                return
+            await asyncio.sleep(1)
 
-            _sensor_value = RaspberryController().moisture_controller.get_moisture()
+            _sensor_value = await run_blocking(RaspberryController().moisture_controller.get_moisture)
             if self._min_value is None or _sensor_value < self._min_value:
                 self._min_value = _sensor_value
 
-        if on_thread_finished is not None:
-            on_thread_finished()
+        if on_finished is not None:
+            on_finished()
 
-    def _get_max_value(self, on_thread_finished=None):
+    async def _get_max_value(self, on_finished=None):
         _time = 0
 
         while _time < self._step_time_s:
             self.loading_text = f"Time left: {self._step_time_s - _time} seconds"
             _time += 1
 
-            self._cancel_event.wait(1)
-            if self._cancel_event.is_set():
-                return
+            await asyncio.sleep(1)
 
-            _sensor_value = RaspberryController().moisture_controller.get_moisture()
+            _sensor_value = await run_blocking(RaspberryController().moisture_controller.get_moisture)
             if self._max_value is None or _sensor_value > self._max_value:
                 self._max_value = _sensor_value
 
-        if on_thread_finished is not None:
-            on_thread_finished()
+        if on_finished is not None:
+            on_finished()
 
     def cancel(self, *args):
-        self._cancel_event.set()
-        if self._current_thread is not None:
-            self._current_thread.join()
+        if self._current_task is not None:
+            self._current_task.cancel()
         self._navigate_back()
 
     def _navigate_back(self):
@@ -115,13 +99,13 @@ class MoistureCalibrationView(MDScreen):
             App.get_running_app().root.ids.navigation_drawer.screen_manager.current = "calibrate"
         Clock.schedule_once(_aux, 0.1)
 
-    def _on_min_value_thread_finished(self):
+    def _on_min_value_finished(self):
         self.step_text = ("Step 2: Place the sensor in the water"
                           " and press the button below")
         self.calibrating = False
         self.loading_text = ""
 
-    def _on_max_value_thread_finished(self):
+    def _on_max_value_finished(self):
         self.step_text = "Calibration finished"
         self.calibrating = False
         self.loading_text = ""
@@ -1,10 +1,11 @@
-import threading
+import asyncio
 
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.properties import BooleanProperty, StringProperty, Clock
 from kivymd.uix.screen import MDScreen
 
+from utils.async_runtime import run_blocking, spawn
 from utils.local_storage_controller import LocalStorageController
 from utils.raspberry_controller import RaspberryController
 
@@ -26,8 +27,8 @@ class PumpCalibrationView(MDScreen):
 
         self._time_delta = 0
 
-        self._current_thread = None
-        self._cancel_event = threading.Event()
+        self._current_task = None
+        self._stop_event = asyncio.Event()
 
     def on_enter(self, *args):
         self.calibrating = False
@@ -39,8 +40,8 @@ class PumpCalibrationView(MDScreen):
 
         self._time_delta = 0
 
-        self._current_thread = None
-        self._cancel_event.clear()
+        self._current_task = None
+        self._stop_event.clear()
 
     def on_leave(self, *args):
         RaspberryController().pump_controller.stop_watering()
@@ -49,20 +50,13 @@ class PumpCalibrationView(MDScreen):
     def calibrate_button_function(self, *args):
         if self._time_delta == 0:
             self.calibrating = True
-            self._current_thread = threading.Thread(
-                target=self._compute_time_delta,
-                args=(self._on_calibration_thread_finished,)
-            )
-
-            self._current_thread.start()
+            self._current_task = spawn(self._compute_time_delta(self._on_calibration_finished))
 
             self.calibrate_button_text = "Stop"
 
         elif self.calibrating:
             self.calibrating = False
-            self._cancel_event.set()
-            if self._current_thread is not None:
-                self._current_thread.join()
+            self._stop_event.set()
 
         else:
             _pump_capacity = 60 / self._time_delta * self._WATER_QTY  # 60 seconds in a minute
@@ -71,26 +65,35 @@ class PumpCalibrationView(MDScreen):
 
             self._navigate_back()
 
-    def _compute_time_delta(self, on_thread_finished=None):
-        RaspberryController().pump_controller.start_watering()
+    async def _compute_time_delta(self, on_finished=None):
+        _pump_started = asyncio.ensure_future(run_blocking(RaspberryController().pump_controller.start_watering))
 
-        while not self._cancel_event.is_set():
-            self.loading_text = f"Time elapsed: {self._time_delta} seconds"
-            self._time_delta += 1
+        try:
+            # shielded, so a cancel does not lose track of the start still running in the pool
+            await asyncio.shield(_pump_started)
 
-            self._cancel_event.wait(1)
-            if self._cancel_event.is_set():
-                break
+            while not self._stop_event.is_set():
+                self.loading_text = f"Time elapsed: {self._time_delta} seconds"
+                self._time_delta += 1
 
-        RaspberryController().pump_controller.stop_watering()
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # also when the task is cancelled, the pump must not keep running. A pump that is still
+            # being started is stopped once the start is done, else it would start after being stopped
+            if _pump_started.done():
+                RaspberryController().pump_controller.stop_watering()
+            else:
+                _pump_started.add_done_callback(lambda future: RaspberryController().pump_controller.stop_watering())
 
-        if on_thread_finished is not None:
-            on_thread_finished()
+        if on_finished is not None:
+            on_finished()
 
     def cancel(self, *args):
-        self._cancel_event.set()
-        if self._current_thread is not None:
-            self._current_thread.join()
+        if self._current_task is not None:
+            self._current_task.cancel()
         self._navigate_back()
 
     def _navigate_back(self):
@@ -99,7 +102,7 @@ class PumpCalibrationView(MDScreen):
 
         Clock.schedule_once(_aux, 0.1)
 
-    def _on_calibration_thread_finished(self):
+    def _on_calibration_finished(self):
         self.step_text = "Calibration finished"
         self.calibrating = False
         self.loading_text = ""
@@ -0,0 +1,5 @@
+
+class RefreshTokenRejectedException(Exception):
+    def __init__(self, reason):
+        super().__init__(f"The refresh token was rejected: {reason}")
+        self.reason = reason
@@ -50,9 +50,9 @@ class GraphView(MDBoxLayout):
 
         fig, ax = plt.subplots()
 
-        moisture_info_list = RemoteRequests().get_moisture_info(self.start_datetime, self.end_datetime)
+        timestamps, values = self._get_moisture_points()
 
-        if moisture_info_list is None or len(moisture_info_list) == 0:
+        if len(timestamps) == 0:
             ax.plot(["No data"], [0])
             ax.grid()
             ax.set_xlabel('Time')
@@ -61,11 +61,6 @@ class GraphView(MDBoxLayout):
             graph_box.add_widget(FigureCanvasKivyAgg(plt.gcf()))
             return
 
-        moisture_info_list = sorted(moisture_info_list, key=lambda x: x["measurementTime"])
-        timestamps = [moisture_info["measurementTime"].astimezone(get_localzone()) for moisture_info in
-                      moisture_info_list]
-        values = [int(moisture_info["measurementValuePercent"]) for moisture_info in moisture_info_list]
-
         ax.grid()
         ax.set_ylabel('Moisture (%)')
 
@@ -99,6 +94,33 @@ class GraphView(MDBoxLayout):
 
         graph_box.add_widget(FigureCanvasKivyAgg(plt.gcf()))
 
+    def _get_moisture_points(self):
+        _rollups = RemoteRequests().get_moisture_rollups(self.start_datetime, self.end_datetime)
+        if _rollups is not None:
+            _rollups = sorted([rollup for rollup in _rollups if rollup["count"] > 0], key=lambda x: x["bucketStart"])
+            timestamps = [rollup["bucketStart"].astimezone(get_localzone()) for rollup in _rollups]
+            values = [int(rollup["sum"] / rollup["count"]) for rollup in _rollups]
+            return timestamps, values
+
+        _samples = RemoteRequests().get_moisture_samples(self.start_datetime, self.end_datetime)
+        if _samples is not None:
+            # already sorted by time in the sensor history
+            _timezone = get_localzone()
+            timestamps = [datetime.fromtimestamp(_timestamp_ms / 1000, tz=_timezone)
+                          for _timestamp_ms in _samples['ts'].tolist()]
+            values = _samples['value'].astype(int).tolist()
+            return timestamps, values
+
+        moisture_info_list = RemoteRequests().get_moisture_info(self.start_datetime, self.end_datetime)
+        if moisture_info_list is None:
+            return [], []
+
+        moisture_info_list = sorted(moisture_info_list, key=lambda x: x["measurementTime"])
+        timestamps = [moisture_info["measurementTime"].astimezone(get_localzone()) for moisture_info in
+                      moisture_info_list]
+        values = [int(moisture_info["measurementValuePercent"]) for moisture_info in moisture_info_list]
+        return timestamps, values
+
     def init_dropdown(self, *args):
         self.dropdown = DropDown()
 
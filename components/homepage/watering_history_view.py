@@ -26,12 +26,25 @@ class WateringHistoryView(MDBoxLayout):
 
         self._raspberry_id = getserial()
         self.refreshing = False
+        # True while the list shows a message instead of logs
+        self._showing_placeholder = False
 
         Clock.schedule_once(self._init_setup, 0.1)
 
     def _init_setup(self, *args):
         self._populate_list()
         EventLogger().set_gui_log_update_callback(self._populate_list_callback)
+        self.ids.rv.bind(on_scroll_stop=self._on_scroll_stop)
+
+    def _on_scroll_stop(self, rv, *args):
+        # the next page is only loaded once the bottom of the list is reached
+        if rv.scroll_y > 0 or self.refreshing:
+            return
+
+        _logs, success = EventLogger().load_older_log_messages()
+        if success and len(_logs) > len(rv.data):
+            # older pages only add to the end, so only those rows are formatted
+            rv.data.extend(self._to_recyclerview_item(log) for log in _logs[len(rv.data):])
 
     def _populate_list(self):
         rv = self.ids.rv
@@ -40,37 +53,33 @@ class WateringHistoryView(MDBoxLayout):
 
         if not success:
             rv.data = [{"text": "Error fetching logs"}]
+            self._showing_placeholder = True
             return
 
         if len(_logs) == 0:
             rv.data = [{"text": "No logs available"}]
+            self._showing_placeholder = True
             return
 
         self._add_logs_to_recyclerview(_logs)
 
-    def _populate_list_callback(self, logs):
+    def _populate_list_callback(self, inserted_logs):
         rv = self.ids.rv
 
-        if logs is None or len(logs) == 0:
-            rv.data = [{"text": "No logs available"}]
-            return
-
-        self._add_logs_to_recyclerview(logs)
+        _data = [] if self._showing_placeholder else list(rv.data)
+        self._showing_placeholder = False
+        for index, log in inserted_logs:
+            _data.insert(index, self._to_recyclerview_item(log))
+        rv.data = _data
 
     def _add_logs_to_recyclerview(self, logs):
-        rv = self.ids.rv
-
-        _data = []
+        self._showing_placeholder = False
+        self.ids.rv.data = [self._to_recyclerview_item(log) for log in logs]
 
-        for log in logs:
-            date = log.get_timestamp()
-            message = log.get_message()
-
-            formatted_date_time = date.strftime("%d-%m-%Y %H:%M")
-            text = f"{formatted_date_time}: {message}"
-            _data.append({"text": text})
-
-        rv.data = _data
+    @staticmethod
+    def _to_recyclerview_item(log):
+        formatted_date_time = log.get_timestamp().strftime("%d-%m-%Y %H:%M")
+        return {"text": f"{formatted_date_time}: {log.get_message()}"}
 
     def refresh_data(self, *args):
         def refresh_callback(interval):
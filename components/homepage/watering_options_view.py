@@ -1,4 +1,3 @@
-import threading
 from datetime import datetime
 
 from kivy.clock import Clock
@@ -9,6 +8,7 @@ from kivymd.uix.boxlayout import MDBoxLayout
 from domain.observer.Observer import Observer
 from domain.observer.ObserverNotificationType import ObserverNotificationType
 from utils.WateringProgramController import WateringProgramController
+from utils.async_runtime import run_blocking, spawn
 from utils.raspberry_controller import RaspberryController
 
 Builder.load_file("components/homepage/watering_options_view.kv")
@@ -97,8 +97,8 @@ class WateringOptionsView(MDBoxLayout):
             self.ids.water_now_label.text = "Could not start watering"
 
     def stop_watering(self):
-        def stop_thread():
-            res = self.raspberry_controller.manual_stop_watering()
+        async def _stop_watering():
+            res = await run_blocking(self.raspberry_controller.manual_stop_watering)
 
             if res:
                 self.ids.water_now_button.text = "Water now"
@@ -106,7 +106,7 @@ class WateringOptionsView(MDBoxLayout):
             else:
                 self.ids.water_now_label.text = "Could not stop watering"
 
-        threading.Thread(target=stop_thread, daemon=True).start()
+        spawn(_stop_watering())
 
     def bind_raspberry_controller_properties(self):
         self.raspberry_controller.set_callback_for_watering_updates(callback=self._update_watering_now_info)
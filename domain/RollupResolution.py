@@ -0,0 +1,24 @@
+from enum import Enum
+
+
+class RollupResolution(Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+    def get_duration_ms(self) -> int:
+        if self == RollupResolution.HOUR:
+            return 60 * 60 * 1000
+        return 24 * 60 * 60 * 1000
+
+    def get_bucket_start_ms(self, timestamp_ms) -> int:
+        # buckets are aligned to UTC, so the device and the app agree on their boundaries
+        _timestamp_ms = int(timestamp_ms)
+        return _timestamp_ms - _timestamp_ms % self.get_duration_ms()
+
+    @classmethod
+    def choose(cls, start_ms, end_ms, min_points=24):
+        """The coarsest resolution that still gives min_points buckets over the range, or None for raw measurements."""
+        for resolution in (cls.DAY, cls.HOUR):
+            if (end_ms - start_ms) // resolution.get_duration_ms() >= min_points:
+                return resolution
+        return None
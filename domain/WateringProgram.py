@@ -1,8 +1,10 @@
 from datetime import datetime
 
+from domain.WateringZone import WateringZone
+
 
 class WateringProgram:
-    def __init__(self, id="", name="", frequency_days=0.0, quantity_l=0.0, starting_date_time=None, min_moisture=0.0, max_moisture=0.0):
+    def __init__(self, id="", name="", frequency_days=0.0, quantity_l=0.0, starting_date_time=None, min_moisture=0.0, max_moisture=0.0, zone_id=WateringZone.DEFAULT_ZONE_ID):
         self.id = id
         self.name = name
         self.frequency_days = frequency_days
@@ -10,6 +12,7 @@ class WateringProgram:
         self.starting_date_time = starting_date_time if starting_date_time is not None else datetime.now()
         self.min_moisture = min_moisture
         self.max_moisture = max_moisture
+        self.zone_id = zone_id
 
     # def __str__(self):
     #     return f"WateringProgram(id={self.id}, name={self.name}, frequency_days={self.frequency_days}, quantity_l={self.quantity_l}, time_of_day_min={self.time_of_day_min}, min_moisture={self.min_moisture}, max_moisture={self.max_moisture})"
@@ -20,6 +23,11 @@ class WateringProgram:
     def __repr__(self):
         return str(self)
 
+    def __setstate__(self, state):
+        # programs pickled before zones existed water the default zone
+        state.setdefault("zone_id", WateringZone.DEFAULT_ZONE_ID)
+        self.__dict__.update(state)
+
     def getInfoDict(self):
         return {
             "id": self.id,
@@ -28,7 +36,8 @@ class WateringProgram:
             "quantityL": self.quantity_l,
             "startingDateTime": self.starting_date_time,
             "minMoisture": self.min_moisture,
-            "maxMoisture": self.max_moisture
+            "maxMoisture": self.max_moisture,
+            "zoneId": self.zone_id
         }
 
     def fromDict(self, _dict):
@@ -39,4 +48,6 @@ class WateringProgram:
         self.starting_date_time = _dict["startingDateTime"]
         self.min_moisture = _dict["minMoisture"]
         self.max_moisture = _dict["maxMoisture"]
+        # programs created before zones existed water the default zone
+        self.zone_id = _dict.get("zoneId", WateringZone.DEFAULT_ZONE_ID)
         return self
@@ -0,0 +1,31 @@
+class WateringZone:
+    """A pump (or valve) GPIO pin and the moisture sensor channel of the plants it waters."""
+
+    DEFAULT_ZONE_ID = "default"
+
+    def __init__(self, id=DEFAULT_ZONE_ID, name="Default zone", pump_pin=4, moisture_channel=1):
+        self.id = id
+        self.name = name
+        self.pump_pin = pump_pin
+        self.moisture_channel = moisture_channel
+
+    def __str__(self):
+        return f"{self.name}"
+
+    def __repr__(self):
+        return str(self)
+
+    def getInfoDict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "pumpPin": self.pump_pin,
+            "moistureChannel": self.moisture_channel
+        }
+
+    def fromDict(self, _dict):
+        self.id = _dict["id"]
+        self.name = _dict["name"]
+        self.pump_pin = _dict["pumpPin"]
+        self.moisture_channel = _dict["moistureChannel"]
+        return self
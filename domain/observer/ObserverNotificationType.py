@@ -5,3 +5,5 @@ class ObserverNotificationType(Enum):
     WATERING_PROGRAMS_DISABLED = "WATERING_PROGRAMS_DISABLED"
     NEXT_WATERING_TIME_CHANGED = "NEXT_WATERING_TIME_CHANGED"
     FIRESTORE_CLIENT_CHANGED = "FIRESTORE_CLIENT_CHANGED"
+    # same client and listeners, only the token changed
+    FIRESTORE_CREDENTIALS_REFRESHED = "FIRESTORE_CREDENTIALS_REFRESHED"
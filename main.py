@@ -1,3 +1,5 @@
+import asyncio
+
 from kivy.core.window import Window
 from kivy.lang import Builder
 from kivy.properties import ObjectProperty
@@ -12,6 +14,7 @@ from components.calibration.moisture_calibration_view import MoistureCalibration
 from components.calibration.pump_calibration_view import PumpCalibrationView
 from components.calibration.depth_calibration_view import DepthCalibrationView
 from utils.WateringProgramController import WateringProgramController
+from utils.async_runtime import run_blocking, set_event_loop, spawn
 from utils.event_logger import EventLogger
 from utils.firebase_controller import FirebaseController
 from utils.notification_login_controller import NotificationLoginController
@@ -33,6 +36,39 @@ class PlantBuddyApp(MDApp):
         self.theme_cls.primary_palette = "Green"
         self.theme_cls.primary_hue = "400"
 
+    def on_stop(self):
+        MoistureMeasurementController().stop_diagnostic_sampling()
+
+
+async def _login():
+    try:
+        # the login controller also retries logging in later, should the device end up logged out
+        _login_controller = NotificationLoginController()
+
+        # the login notification is only needed when there is no usable refresh token from before
+        if not await FirebaseController().login_with_stored_refresh_token_async():
+            await run_blocking(_login_controller.try_send_login_notification)
+    except Exception as e:
+        print("Failed to auto login: " + str(e))
+
+
+async def main():
+    # Kivy runs its event loop on this asyncio loop, so coroutines started from the GUI share its thread
+    set_event_loop(asyncio.get_running_loop())
+
+    FirebaseController().attach(RaspberryController())
+    FirebaseController().attach(WateringProgramController())
+    FirebaseController().attach(EventLogger())
+
+    # the app is shown right away, the login finishes in the background while it runs
+    spawn(_login())
+
+    MoistureMeasurementController().start_moisture_check_thread(12 * 60 * 60)  # 12 hours
+    # the local sensor history shown for diagnostics, never sent to Firestore
+    MoistureMeasurementController().start_diagnostic_sampling(5)
+
+    await PlantBuddyApp().async_run(async_lib='asyncio')
+
 
 if __name__ == '__main__':
     # try:
@@ -46,15 +82,4 @@ if __name__ == '__main__':
     # except Exception as e:
     #     print("Failed to auto login: " + str(e))
 
-    FirebaseController().attach(RaspberryController())
-    FirebaseController().attach(WateringProgramController())
-    FirebaseController().attach(EventLogger())
-
-    try:
-        NotificationLoginController().try_send_login_notification()
-    except Exception as e:
-        print("Failed to auto login: " + str(e))
-
-    MoistureMeasurementController().start_moisture_check_thread(12 * 60 * 60)  # 12 hours
-
-    PlantBuddyApp().run()
+    asyncio.run(main())
@@ -2,8 +2,8 @@ import threading
 import time
 import datetime
 
+import numpy as np
 from google.cloud.firestore_v1.watch import ChangeType
-from tzlocal import get_localzone
 
 from domain.WateringProgram import WateringProgram
 from domain.observer.Observer import Observer
@@ -16,6 +16,9 @@ from utils.get_rasp_uuid import getserial
 from utils.local_storage_controller import LocalStorageController
 from utils.raspberry_controller import RaspberryController
 from utils.remote_requests import RemoteRequests
+from utils.scheduler import Scheduler
+from utils.watering_queue import WateringQueue
+from utils.watering_zone_controller import WateringZoneController
 
 
 class WateringProgramController(Observer, Subject):
@@ -35,18 +38,19 @@ class WateringProgramController(Observer, Subject):
 
         self._watering_programs = {}
         self._active_watering_program_id = None
+        self._active_watering_program_ids = []
         self._is_watering_programs_active = None
 
         self.raspberry_id = getserial()
-        self._pump_controller = RaspberryController().pump_controller
-        self._moisture_controller = RaspberryController().moisture_controller
         self._raspberry_controller = RaspberryController()
 
-        self._watering_thread = None
-        self._moisture_check_thread = None
-
-        self._watering_thread_finished = threading.Event()
-        self._moisture_check_thread_finished = threading.Event()
+        # zone id -> WateringZoneController, built when a program first uses the zone
+        self._zone_controllers = {}
+        # program id -> (watering job, moisture check job)
+        self._program_jobs = {}
+        self._program_next_watering = {}
+        self._schedule_lock = threading.Lock()
+        self._moisture_check_interval_sec = 3600
 
         self._gui_update_callback = None
 
@@ -61,6 +65,7 @@ class WateringProgramController(Observer, Subject):
         self.get_watering_programs()
         self.get_is_watering_programs_active()
         self.get_active_watering_program_id()
+        self.get_active_watering_program_ids()
 
         RemoteRequests().add_listener_for_watering_programs_changes(
             self._update_values_on_receive_from_network
@@ -83,6 +88,15 @@ class WateringProgramController(Observer, Subject):
         self._active_watering_program_id = program_id
         self._schedule_watering()
 
+    def get_active_watering_program_ids(self):
+        self._active_watering_program_ids = RemoteRequests().get_active_watering_program_ids()
+        return self._active_watering_program_ids
+
+    def set_active_watering_program_ids(self, program_ids):
+        RemoteRequests().set_active_watering_program_ids(program_ids)
+        self._active_watering_program_ids = list(program_ids)
+        self._schedule_watering()
+
     def get_is_watering_programs_active(self):
         self._is_watering_programs_active = RemoteRequests().get_is_watering_programs_active()
         return self._is_watering_programs_active
@@ -96,165 +110,179 @@ class WateringProgramController(Observer, Subject):
         else:
             self.notify(ObserverNotificationType.NEXT_WATERING_TIME_CHANGED)
 
-    def _get_active_watering_program(self):
-        if self._active_watering_program_id is None or self._watering_programs is None:
-            return None
-        if self._active_watering_program_id not in self._watering_programs:
-            return None
-        return self._watering_programs[self._active_watering_program_id]
+    def _get_active_watering_programs(self) -> list[WateringProgram]:
+        """The program selected in activeProgramId followed by the ones in activeProgramIds."""
+        if self._watering_programs is None:
+            return []
+
+        _program_ids = []
+        if self._active_watering_program_id is not None:
+            _program_ids.append(self._active_watering_program_id)
+        for program_id in self._active_watering_program_ids or []:
+            if program_id not in _program_ids:
+                _program_ids.append(program_id)
+
+        return [self._watering_programs[program_id] for program_id in _program_ids
+                if program_id in self._watering_programs]
+
+    def _get_zone_controller(self, zone_id) -> WateringZoneController | None:
+        if zone_id not in self._zone_controllers:
+            for zone in LocalStorageController().get_watering_zones():
+                if zone.id == zone_id:
+                    self._zone_controllers[zone_id] = WateringZoneController(zone)
+                    break
+            else:
+                print(f"Unknown watering zone: {zone_id}")
+                return None
+        return self._zone_controllers[zone_id]
+
+    def get_zone_controllers(self) -> dict:
+        return dict(self._zone_controllers)
 
     def get_next_watering_time(self):
         return self._datetime_of_next_watering
 
-    def _compute_initial_delay_sec(self, program: WateringProgram):
-        if program.starting_date_time is None:
-            return -1, -1
+    def get_next_watering_times(self) -> dict:
+        """The next watering time of every scheduled program, by program id."""
+        return dict(self._program_next_watering)
 
+    def _compute_initial_delays_sec(self, programs: list[WateringProgram]):
+        """Seconds until the next watering of each program, -1 for the ones that can not be scheduled."""
         _current_time = get_current_datetime_tz()
-        _program_starting_date_time = program.starting_date_time.astimezone(get_localzone())
-
-        # if program starting time is in the future
-        if _program_starting_date_time >= _current_time:
-            _time_delta_seconds = (_program_starting_date_time - _current_time).total_seconds()
-            return _current_time, _time_delta_seconds
-
-        # if the starting time is in the past, we try to see the last watering time
-        _program_id, _last_watered_time = LocalStorageController().get_last_watering_time()
-
-        # if the last recorded watering time is not for the current program or it is None
-        # we compute the difference between the current date and the starting date of the program
-        # else we compute the time passed since the last watering
-        if _program_id is not None and _last_watered_time is not None and _program_id is program.id:
-            _time_delta_seconds = (_current_time - _last_watered_time).total_seconds()
-        else:
-            _time_delta_seconds = (_current_time - _program_starting_date_time).total_seconds()
-
-        # we compute how many seconds are between watering cycles
-        _interval_between_watering_seconds = self._compute_watering_interval_sec(program)
-
-        # we compute how many watering intervals fit in the time passed since the last watering
-        _intervals_in_time_delta = _time_delta_seconds // _interval_between_watering_seconds
-
-        # we compute how many seconds are in total in those intervals
-        _waiting_time = _intervals_in_time_delta * _interval_between_watering_seconds
-        if _waiting_time < _time_delta_seconds:
-            # if the sum of intervals does not cover the entire elapsed time, another cycle is
-            # about to start so we add another interval
-            _waiting_time += _interval_between_watering_seconds
-
-        # we compute how many seconds we need to wait until next watering cycle should occur
-        _time_until_next_watering = _waiting_time - _time_delta_seconds
-
-        return _current_time, _time_until_next_watering
+        _now = _current_time.timestamp()
+        _last_watering_times = LocalStorageController().get_last_watering_times()
+
+        _starting_times = np.array([
+            program.starting_date_time.timestamp() if program.starting_date_time is not None else np.nan
+            for program in programs
+        ], dtype=np.float64)
+        _intervals = np.array([self._compute_watering_interval_sec(program) for program in programs],
+                              dtype=np.float64)
+        _last_watered_times = np.array([
+            _last_watering_times[program.id].timestamp()
+            if _last_watering_times.get(program.id) is not None else np.nan
+            for program in programs
+        ], dtype=np.float64)
+
+        # the time passed since the last watering, or since the start for programs that did not water yet
+        _time_deltas = _now - np.where(np.isnan(_last_watered_times), _starting_times, _last_watered_times)
+
+        # the next watering is after the first whole number of intervals that covers the elapsed time
+        with np.errstate(divide='ignore', invalid='ignore'):
+            _waiting_times = np.ceil(_time_deltas / _intervals) * _intervals
+
+        # programs starting in the future wait for their starting time
+        _delays = np.where(_starting_times >= _now, _starting_times - _now, _waiting_times - _time_deltas)
+        _delays[np.isnan(_starting_times) | ~(_intervals > 0) | ~np.isfinite(_delays)] = -1
+
+        return _current_time, _delays
 
     def _compute_watering_interval_sec(self, program):
         return program.frequency_days * 24 * 60 * 60  # days * hours * minutes * seconds -> seconds
 
     def _schedule_watering(self):
-        if self._active_watering_program_id is None:
-            return
+        with self._schedule_lock:
+            self._cancel_running_tasks()
 
-        self._cancel_running_tasks()
-        active_program = self._get_active_watering_program()
-        if active_program is None:
-            return
+            _active_programs = self._get_active_watering_programs()
+            if len(_active_programs) == 0:
+                return
 
-        _processing_time, initial_delay_sec = self._compute_initial_delay_sec(active_program)
-        print("initial delay: ", initial_delay_sec)
+            _processing_time, _initial_delays_sec = self._compute_initial_delays_sec(_active_programs)
 
-        if initial_delay_sec < 0:
-            return
+            for program, initial_delay_sec in zip(_active_programs, _initial_delays_sec.tolist()):
+                print(f"initial delay of {program}: ", initial_delay_sec)
+                if initial_delay_sec < 0:
+                    continue
 
-        self._datetime_of_next_watering = _processing_time + datetime.timedelta(seconds=initial_delay_sec)
-        self.notify(ObserverNotificationType.NEXT_WATERING_TIME_CHANGED)
-        self._raspberry_controller.update_next_watering_time(self._datetime_of_next_watering)
+                _zone_controller = self._get_zone_controller(program.zone_id)
+                if _zone_controller is None:
+                    continue
 
-        self._watering_thread_finished.clear()
-        self._moisture_check_thread_finished.clear()
+                self._program_next_watering[program.id] = (
+                    _processing_time + datetime.timedelta(seconds=initial_delay_sec)
+                )
 
-        self._watering_thread = threading.Thread(
-            target=self._watering_task,
-            args=(active_program, initial_delay_sec,),
-            daemon=True
-        )
-        self._watering_thread.start()
+                # every program is an entry in the scheduler's queue, no program has a thread of its own
+                self._program_jobs[program.id] = (
+                    Scheduler().schedule_fixed_rate(
+                        self._watering_task,
+                        self._compute_watering_interval_sec(program),
+                        program,
+                        _zone_controller,
+                        initial_delay_sec=initial_delay_sec,
+                        name=f"watering_{program.id}"
+                    ),
+                    Scheduler().schedule_fixed_rate(
+                        self._moisture_check_task,
+                        self._moisture_check_interval_sec,
+                        program,
+                        _zone_controller,
+                        initial_delay_sec=self._moisture_check_interval_sec,
+                        name=f"program_moisture_check_{program.id}"
+                    )
+                )
 
-        self._moisture_check_thread = threading.Timer(
-            interval=0,
-            function=self._moisture_check_task,
-            args=(active_program, 3600,),
-        )
-        self._moisture_check_thread.daemon = True
-        self._moisture_check_thread.start()
+            self._update_next_watering_time()
+            if self._datetime_of_next_watering is not None:
+                self._raspberry_controller.update_next_watering_time(self._datetime_of_next_watering)
+
+    def _update_next_watering_time(self):
+        _next_watering_times = list(self._program_next_watering.values())
+        self._datetime_of_next_watering = min(_next_watering_times) if len(_next_watering_times) > 0 else None
+        self.notify(ObserverNotificationType.NEXT_WATERING_TIME_CHANGED)
 
     def _cancel_running_tasks(self):
-        if self._watering_thread is not None:
-            self._watering_thread_finished.set()
-            self._watering_thread.join()
+        _jobs = [job for program_jobs in self._program_jobs.values() for job in program_jobs]
+        WateringQueue().cancel_queued_jobs(self._program_jobs.keys())
+        self._program_jobs = {}
 
-        if self._moisture_check_thread is not None:
-            self._moisture_check_thread_finished.set()
-            self._moisture_check_thread.join()
+        # every job is stopped first, so waiting for one watering does not delay stopping the others
+        for job in _jobs:
+            job.cancel()
+        for job in _jobs:
+            job.cancel(wait=True)
 
-    def _watering_task(self, program, initial_delay_sec=0):
-        self._watering_thread_finished.wait(initial_delay_sec)
-        if self._watering_thread_finished.is_set():
-            return
+        # cleared only once no watering task runs anymore, one still running would write its entry back
+        self._program_next_watering = {}
+
+    def _watering_task(self, program, zone_controller):
+        _cycle_start_time = get_current_datetime_tz()
+        _interval_sec = self._compute_watering_interval_sec(program)
 
-        _watering_time_sec = 0
         if self._is_watering_programs_active:
-            current_soil_moisture = self._moisture_controller.get_moisture_percentage()
+            current_soil_moisture = zone_controller.get_moisture_percentage()
 
             if current_soil_moisture < program.min_moisture:
-                _start_time = get_current_datetime_tz()
-                self._raspberry_controller.water_for_liters(program.quantity_l)
-                _end_time = get_current_datetime_tz()
-                _watering_time_sec = (_end_time - _start_time).seconds
-
-        water_interval_sec = self._compute_watering_interval_sec(program)
-
-        while not self._watering_thread_finished.is_set():
-            _waiting_time = water_interval_sec - _watering_time_sec
-
-            self._datetime_of_next_watering = get_current_datetime_tz() + datetime.timedelta(seconds=_waiting_time)
-            self.notify(ObserverNotificationType.NEXT_WATERING_TIME_CHANGED)
-
-            self._watering_thread_finished.wait(_waiting_time)
-            if self._watering_thread_finished.is_set():
-                return
-
-            if self._is_watering_programs_active:
-                current_soil_moisture = self._moisture_controller.get_moisture_percentage()
-
-                if current_soil_moisture < program.min_moisture:
-                    _start_time = get_current_datetime_tz()
-                    self._raspberry_controller.water_for_liters(program.quantity_l)
-                    _end_time = get_current_datetime_tz()
-                    _watering_time_sec = (_end_time - _start_time).seconds
-                    LocalStorageController().set_last_watering_time(_start_time, program.id)
+                # the driest zones go first, a watering still waiting when the next cycle is due is dropped
+                WateringQueue().submit(
+                    zone_controller,
+                    program.quantity_l,
+                    program.id,
+                    priority=program.min_moisture - current_soil_moisture,
+                    deadline_sec=_interval_sec
+                )
 
-    def _moisture_check_task(self, program, sleep_time_sec=600):
-        while not self._moisture_check_thread_finished.is_set():
-            self._moisture_check_thread_finished.wait(sleep_time_sec)
-            if self._moisture_check_thread_finished.is_set():
-                return
+        self._program_next_watering[program.id] = _cycle_start_time + datetime.timedelta(seconds=_interval_sec)
+        self._update_next_watering_time()
 
-            if self._is_watering_programs_active:
-                current_soil_moisture = self._moisture_controller.get_moisture_percentage()
+    def _moisture_check_task(self, program, zone_controller):
+        if self._is_watering_programs_active:
+            current_soil_moisture = zone_controller.get_moisture_percentage()
 
-                if current_soil_moisture < program.min_moisture:
-                    # self._raspberry_controller.water_for_liters(program.quantity_l * 0.3)  # 30% of the quantity
-                    EventLogger().add_low_moisture_level_message(
-                        current_soil_moisture,
-                        program.min_moisture,
-                        get_current_datetime_tz()
-                    )
-                elif current_soil_moisture > program.max_moisture:
-                    EventLogger().add_high_moisture_level_message(
-                        current_soil_moisture,
-                        program.max_moisture,
-                        get_current_datetime_tz()
-                    )
+            if current_soil_moisture < program.min_moisture:
+                # self._raspberry_controller.water_for_liters(program.quantity_l * 0.3)  # 30% of the quantity
+                EventLogger().add_low_moisture_level_message(
+                    current_soil_moisture,
+                    program.min_moisture,
+                    get_current_datetime_tz()
+                )
+            elif current_soil_moisture > program.max_moisture:
+                EventLogger().add_high_moisture_level_message(
+                    current_soil_moisture,
+                    program.max_moisture,
+                    get_current_datetime_tz()
+                )
 
     def set_on_receive_from_network_callback(self, _update_values_on_receive_from_network):
         self._gui_update_callback = _update_values_on_receive_from_network
@@ -279,6 +307,7 @@ class WateringProgramController(Observer, Subject):
 
             new_programs = self._watering_programs.copy()
             new_active_program_id = None
+            new_active_program_ids = None
             new_is_watering_programs_active = None
 
             edited_active_program_properties = False
@@ -291,12 +320,18 @@ class WateringProgramController(Observer, Subject):
                 elif change_type == ChangeType.REMOVED:
                     new_programs.pop(doc_id, None)
 
-                if doc_id == self._active_watering_program_id:
+                if doc_id == self._active_watering_program_id or doc_id in self._active_watering_program_ids:
                     edited_active_program_properties = True
 
             if "activeProgramId" in doc_data:
                 new_active_program_id = str(doc_data["activeProgramId"])
 
+            if "activeProgramIds" in doc_data:
+                new_active_program_ids = [str(program_id) for program_id in doc_data["activeProgramIds"]]
+                if new_active_program_ids != self._active_watering_program_ids:
+                    self._active_watering_program_ids = new_active_program_ids
+                    edited_active_program_properties = True
+
             if "wateringProgramsEnabled" in doc_data:
                 new_is_watering_programs_active = doc_data["wateringProgramsEnabled"]
 
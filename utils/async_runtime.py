@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# blocking Firestore, HTTP and sensor calls made from coroutines run here, never on the event loop
+_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="io")
+
+_event_loop = None
+_background_tasks = set()
+_event_loop_lock = threading.Lock()
+
+
+def set_event_loop(loop):
+    """Remembers the loop the app runs on, so other threads can hand work to it."""
+    global _event_loop
+    with _event_loop_lock:
+        _event_loop = loop
+
+
+def get_event_loop():
+    return _event_loop
+
+
+async def run_blocking(function, *args, **kwargs):
+    """Awaits function(*args, **kwargs) run on the I/O pool."""
+    _loop = asyncio.get_running_loop()
+    return await _loop.run_in_executor(_io_executor, functools.partial(function, *args, **kwargs))
+
+
+def spawn(coroutine):
+    """Runs a coroutine as a task of the app loop, from the loop itself or from any other thread.
+
+    The task is referenced until it ends, so it can not be garbage collected while it waits, and
+    its exception is printed instead of being lost.
+    """
+    _loop = get_event_loop()
+    if _loop is None or _loop.is_closed():
+        print("No event loop to run the coroutine on")
+        coroutine.close()
+        return None
+
+    try:
+        _running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _running_loop = None
+
+    if _running_loop is _loop:
+        _task = _loop.create_task(coroutine)
+        _background_tasks.add(_task)
+        _task.add_done_callback(_on_task_done)
+        return _task
+
+    return asyncio.run_coroutine_threadsafe(_track(coroutine), _loop)
+
+
+def call_in_loop(callback, *args):
+    """Calls callback(*args) on the app loop, or right away if the app has no loop."""
+    _loop = get_event_loop()
+    if _loop is None or _loop.is_closed():
+        callback(*args)
+        return
+    _loop.call_soon_threadsafe(callback, *args)
+
+
+async def _track(coroutine):
+    _task = asyncio.current_task()
+    _background_tasks.add(_task)
+    _task.add_done_callback(_on_task_done)
+    return await coroutine
+
+
+def _on_task_done(task):
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+    _exception = task.exception()
+    if _exception is not None:
+        print(f"Error in background task: {_exception}")
@@ -3,11 +3,11 @@ import os
 import threading
 from typing import Tuple, Any
 
-import requests
 from dotenv import load_dotenv
 from websocket import WebSocketApp
 
 from utils.firebase_controller import FirebaseController
+from utils.http_client import HttpClient
 import rel
 
 from utils.remote_requests import RemoteRequests
@@ -48,10 +48,10 @@ class BackendController:
             "data": json.dumps(data)
         }
 
-        requests.post(f"{self._backend_url}/api/send-notification", json=message)
+        HttpClient().post("send_notification", f"{self._backend_url}/api/send-notification", json=message)
 
     def get_qr_data(self, rasp_id) -> tuple[str, str, str]:
-        res = requests.post(f"{self._backend_url}/api/auth/request-qr-info/{rasp_id}")
+        res = HttpClient().post("request_qr_info", f"{self._backend_url}/api/auth/request-qr-info/{rasp_id}")
 
         if res.ok:
             res = res.json()
@@ -83,7 +83,7 @@ class BackendController:
             self._ws.send(json.dumps(data))
 
     def request_login_id(self, rasp_id) -> Tuple[str, str]:
-        res = requests.post(f"{self._backend_url}/api/auth/request-login/{rasp_id}")
+        res = HttpClient().post("request_login", f"{self._backend_url}/api/auth/request-login/{rasp_id}")
 
         if res.ok:
             res = res.json()
@@ -104,6 +104,6 @@ class BackendController:
             "data": json.dumps(_data)
         }
 
-        res = requests.post(f"{self._backend_url}/api/send-notification", json=_message)
+        res = HttpClient().post("send_notification", f"{self._backend_url}/api/send-notification", json=_message)
 
         print(f"Login notification send result: {res.text}")
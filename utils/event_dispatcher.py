@@ -0,0 +1,118 @@
+import atexit
+import queue
+import threading
+import time
+
+
+class EventDispatcher:
+    """Persists events and passes them on to sinks from a single background thread.
+
+    dispatch() only puts the event in a bounded queue, so the caller never waits for storage or
+    the network. The worker takes everything that is queued, up to max_batch_size events, stores
+    each one with persist_function(event) -> bool and then calls every sink once with the list of
+    events that were stored. A full queue drops the new event instead of blocking the caller.
+    """
+
+    def __init__(self, persist_function, max_queue_size=1000, max_batch_size=20):
+        self._persist_function = persist_function
+        self._max_batch_size = max_batch_size
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._sinks = []
+        self._sinks_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._dispatched_events = 0
+        self._dropped_events = 0
+        self._failed_events = 0
+        self._batches = 0
+
+        self._worker_thread = threading.Thread(target=self._worker, daemon=True)
+        self._worker_thread.start()
+
+        atexit.register(self.flush)
+
+    def add_sink(self, sink):
+        """sink(events) is called from the worker thread with the stored events of a batch."""
+        with self._sinks_lock:
+            self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self._sinks_lock:
+            if sink in self._sinks:
+                self._sinks.remove(sink)
+
+    def dispatch(self, event) -> bool:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            print("Event queue is full, dropping event")
+            with self._stats_lock:
+                self._dropped_events += 1
+            return False
+
+        with self._stats_lock:
+            self._dispatched_events += 1
+        return True
+
+    def flush(self, timeout_sec=5.0) -> bool:
+        """Waits until every queued event was handled, returns False if the timeout ran out first."""
+        _deadline = time.monotonic() + timeout_sec
+        while self._queue.unfinished_tasks > 0:
+            if time.monotonic() >= _deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "dispatched": self._dispatched_events,
+                "dropped": self._dropped_events,
+                "failed": self._failed_events,
+                "batches": self._batches,
+                "pending": self._queue.qsize(),
+            }
+
+    def _worker(self):
+        while True:
+            _batch = [self._queue.get()]
+            while len(_batch) < self._max_batch_size:
+                try:
+                    _batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._handle_batch(_batch)
+            finally:
+                for _ in _batch:
+                    self._queue.task_done()
+
+    def _handle_batch(self, batch):
+        _stored = []
+        for _event in batch:
+            try:
+                _persisted = self._persist_function(_event)
+            except Exception as e:
+                print(f"Error while persisting event: {e}")
+                _persisted = False
+
+            if _persisted:
+                _stored.append(_event)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._failed_events += len(batch) - len(_stored)
+
+        if len(_stored) == 0:
+            return
+
+        with self._sinks_lock:
+            _sinks = list(self._sinks)
+
+        for _sink in _sinks:
+            try:
+                _sink(_stored)
+            except Exception as e:
+                print(f"Error in event sink: {e}")
@@ -1,21 +1,20 @@
-import json
 import threading
-from datetime import datetime
 
 from domain.logging.HighMoistureLevelMessage import HighMoistureLevelMessage
-from domain.logging.LogMessage import LogMessage
 from domain.logging.LowMoistureLevelMessage import LowMoistureLevelMessage
 from domain.logging.LowWaterLevelMessage import LowWaterLevelMessage
 from domain.logging.ManualWateringCycleMessage import ManualWateringCycleMessage
-from domain.logging.MessageType import MessageType
 from domain.logging.MoistureMeasurementMessage import MoistureMeasurementMessage
 from domain.logging.NoWaterMessage import NoWaterMessage
 from domain.observer.Observer import Observer
 from domain.observer.ObserverNotificationType import ObserverNotificationType
+from utils.async_runtime import call_in_loop
 from utils.backend_controller import BackendController
 from utils.firebase_controller import FirebaseController
 from domain.logging.AutoWateringCycleMessage import AutoWateringCycleMessage
 from utils.get_rasp_uuid import getserial
+from utils.event_dispatcher import EventDispatcher
+from utils.log_index import LogIndex
 from utils.remote_requests import RemoteRequests
 
 
@@ -36,12 +35,22 @@ class EventLogger(Observer):
 
         self._raspberry_id = getserial()
 
-        self._log_messages = []
+        self._log_index = LogIndex()
+        self._log_index_lock = threading.Lock()
+        self._log_messages = self._log_index.get_log_messages()
+        self._log_messages_cursor = None
+        self._log_page_size = 50
         self._notifiable_messages = {}
 
         self._gui_log_update_callback = None
 
+        # storing, showing and notifying happen on the dispatcher's thread, off the watering path
+        self._event_dispatcher = EventDispatcher(self._persist_log_message)
+        self._event_dispatcher.add_sink(self._show_log_messages)
+        self._event_dispatcher.add_sink(self._send_notifications)
+
     def perform_initial_setup(self):
+        RemoteRequests().migrate_log_messages()
         RemoteRequests().add_listener_for_log_messages_changes(
             self._update_logs_on_receive_from_network
         )
@@ -53,23 +62,34 @@ class EventLogger(Observer):
         self._load_initial_data()
 
     def load_log_messages(self):
-        log_messages = RemoteRequests().get_log_messages()
-        self._log_messages = []
+        """Loads the newest page of log messages; load_older_log_messages appends the following pages."""
+        _log_messages, self._log_messages_cursor = RemoteRequests().get_log_messages_page(self._log_page_size)
+        with self._log_index_lock:
+            self._log_index.reset(_log_messages)
+        self._log_messages = self._log_index.get_log_messages()
+        return self._log_messages, True
 
-        try:
-            for log_message_key, log_message_value in log_messages.items():
-                self._log_messages.append(
-                    LogMessage(
-                        message=log_message_value,
-                        level=MessageType.ANY,
-                        timestamp=datetime.strptime(str(log_message_key)[:-6], "%Y-%m-%d %H:%M:%S.%f")
-                    )
-                )
-
-            self._log_messages.sort(key=lambda x: x.get_timestamp(), reverse=True)
-        except Exception as e:
-            print(f"Failed to parse log messages: {e}")
+    def get_loaded_log_messages(self):
+        return self._log_messages
+
+    def load_older_log_messages(self):
+        if self._log_messages_cursor is None:
+            return self._log_messages, True
 
+        _older_log_messages, _next_cursor = RemoteRequests().get_log_messages_page(
+            self._log_page_size,
+            cursor=self._log_messages_cursor
+        )
+        while len(_older_log_messages) < self._log_page_size and RemoteRequests().fetch_older_log_messages():
+            # the local log ran out, so older days are fetched from Firestore and read from the same place
+            _older_log_messages, _next_cursor = RemoteRequests().get_log_messages_page(
+                self._log_page_size,
+                cursor=self._log_messages_cursor
+            )
+
+        self._log_messages_cursor = _next_cursor
+        with self._log_index_lock:
+            self._log_index.insert_all(_older_log_messages)
         return self._log_messages, True
 
     def _load_notifiable_messages(self):
@@ -97,18 +117,46 @@ class EventLogger(Observer):
 
     def _add_log_message(self, log_message):
         print("Adding log message: ", log_message.get_message())
+        self._event_dispatcher.dispatch(log_message)
+
+    def _persist_log_message(self, log_message) -> bool:
+        return RemoteRequests().add_log_message(log_message)
+
+    def _show_log_messages(self, log_messages):
+        _inserted = []
+        with self._log_index_lock:
+            for log_message in log_messages:
+                _index = self._log_index.insert(log_message)
+                if _index is not None:
+                    # an earlier delta shifts the rows after it, so indexes are taken in insertion order
+                    _inserted.append((_index, log_message))
+
+            self._send_log_delta_to_gui(_inserted)
+
+    def _send_log_delta_to_gui(self, inserted):
+        """Hands a delta to the GUI thread. Called holding _log_index_lock, so deltas keep their order."""
+        if len(inserted) > 0 and self._gui_log_update_callback is not None:
+            # widgets may only be changed from the thread running the app
+            call_in_loop(self._gui_log_update_callback, inserted)
+
+    def _send_notifications(self, log_messages):
+        _notifiable = [
+            log_message for log_message in log_messages
+            if self._notifiable_messages.get(log_message.get_level().value) is True
+        ]
+        if len(_notifiable) == 0:
+            print("Dont send notification")
+            return
 
-        if RemoteRequests().add_log_message(log_message):
-            print("Added log message: ", log_message.get_message())
-            self._log_messages.append(log_message)
+        # one notification per batch, so a burst of events costs a single request
+        print("Sending notification")
+        BackendController().send_notification(
+            self._raspberry_id,
+            "\n".join(log_message.get_message() for log_message in _notifiable)
+        )
 
-            if self._notifiable_messages.get(log_message.get_level().value) is True:
-                print("Sending notification")
-                BackendController().send_notification(self._raspberry_id, log_message.get_message())
-            else:
-                print(f"Dont send notification: {log_message.get_level().value}")
-        else:
-            print("Did not add log message")
+    def get_event_dispatcher_stats(self) -> dict:
+        return self._event_dispatcher.get_stats()
 
     def add_auto_watering_cycle_message(self, start_time, duration, water_amount):
         self._add_log_message(AutoWateringCycleMessage(start_time, duration, water_amount))
@@ -141,23 +189,17 @@ class EventLogger(Observer):
             changed_doc = change.document
             doc_data = changed_doc.to_dict()
 
-            if "messages" in doc_data.keys():
-                logs = []
-
-                for message_key, message_value in doc_data["messages"].items():
-                    logs.append(
-                        LogMessage(
-                            message=message_value,
-                            level=MessageType.ANY,
-                            timestamp=datetime.strptime(message_key[:-6], "%Y-%m-%d %H:%M:%S.%f")
-                        )
-                    )
+            if doc_data is None or "messages" not in doc_data.keys():
+                continue
 
-                logs.sort(key=lambda x: x.get_timestamp(), reverse=True)
-                self._log_messages = logs
+            # only keys not seen before are parsed, stored and passed on
+            with self._log_index_lock:
+                _new_log_messages, _inserted = self._log_index.merge(doc_data["messages"])
+                # queued before the lock is released, so no delta of the dispatcher can get in between
+                self._send_log_delta_to_gui(_inserted)
 
-                if self._gui_log_update_callback is not None:
-                    self._gui_log_update_callback(self._log_messages)
+            if len(_new_log_messages) > 0:
+                RemoteRequests().merge_log_messages(_new_log_messages)
 
     def _update_notifiables_on_receive_from_network(
         self,
@@ -176,10 +218,13 @@ class EventLogger(Observer):
                 print(f"New notifiable messages: {self._notifiable_messages}")
 
     def set_gui_log_update_callback(self, _populate_list_callback):
+        """The callback receives the (index, LogMessage) insertions made to the loaded list, in order."""
         self._gui_log_update_callback = _populate_list_callback
 
     def on_notification_from_subject(self, notification_type: ObserverNotificationType) -> None:
         if notification_type == ObserverNotificationType.FIRESTORE_CLIENT_CHANGED:
             self.perform_initial_setup()
+        elif notification_type == ObserverNotificationType.FIRESTORE_CREDENTIALS_REFRESHED:
+            pass
         else:
             print(f"Unknown notification type: {notification_type}")
@@ -1,16 +1,22 @@
 import json
 import os
 import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from typing import List, Any
 
 # import firebase_admin
 import keyring
 from dotenv import load_dotenv
-from google.cloud.firestore_v1 import FieldFilter
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1 import FieldFilter, FieldPath
 from requests import HTTPError
 
 from components.exceptions.FirebaseUninitializedException import FirebaseUninitializedException
+from components.exceptions.RefreshTokenRejectedException import RefreshTokenRejectedException
 from domain.RaspberryInfo import RaspberryInfo
+from domain.RollupResolution import RollupResolution
 from domain.WateringProgram import WateringProgram
 
 import requests
@@ -21,6 +27,18 @@ from domain.observer.ObserverNotificationType import ObserverNotificationType
 from domain.observer.Observer import Observer
 from domain.observer.Subject import Subject
 from utils.get_rasp_uuid import getserial
+from utils.async_runtime import run_blocking
+from utils.http_client import HttpClient
+from utils.local_storage_controller import LocalStorageController
+from utils.scheduler import Scheduler
+
+_PROCESS_START = time.monotonic()
+
+# 1: commands and telemetry share watering_info, pings go through general_purpose_ws
+# 2: commands (pings included) go to device_commands and telemetry to device_telemetry
+PROTOCOL_VERSION = 2
+# written by a phone to device_commands to announce the protocol it speaks
+PHONE_PROTOCOL_VERSION_FIELD = "phoneProtocolVersion"
 
 
 class FirebaseController(Subject):
@@ -31,6 +49,9 @@ class FirebaseController(Subject):
     _instance = None
     _lock = threading.Lock()
 
+    # the answers of the token service that mean the refresh token will never work again
+    _REFRESH_TOKEN_REJECTED_REASONS = ("INVALID_REFRESH_TOKEN", "TOKEN_EXPIRED", "USER_DISABLED", "USER_NOT_FOUND")
+
     def __new__(cls):
         with cls._lock:
             if not cls._instance:
@@ -47,26 +68,58 @@ class FirebaseController(Subject):
         self._ownerInfoCollectionName = "owner_info"
         self._raspberryInfoCollectionName = "raspberry_info"
         self._moistureInfoCollectionName = "humidity_readings"
+        self._moistureRollupsCollectionName = "humidity_rollups"
         self._wateringNowCollectionName = "watering_info"
         self._wateringProgramsCollectionName = "watering_programs"
         self._wateringProgramsCollectionNestedCollectionName = "programs"
         self._globalWateringProgramsCollectionName = "global_watering_programs"
         self._logsCollectionName = "logs"
+        # log messages are kept in one document per UTC day, logs/{raspberry_id}/days/{YYYY-MM-DD}
+        self._logShardsCollectionName = "days"
         self._wsCollectionName = "general_purpose_ws"
+        self._deviceCommandsCollectionName = "device_commands"
+        self._deviceTelemetryCollectionName = "device_telemetry"
+        # protocol 1 phones keep being served through watering_info until the phone announces protocol 2
+        self._legacy_protocol_enabled = LocalStorageController().get_phone_protocol_version() < PROTOCOL_VERSION
 
         self.watering_now_callback = None
         self.watering_programs_callback = None
 
         self.watering_now_listener = None
+        self._device_commands_listener = None
+        # fields of the listened documents as of their latest snapshot, including the ones written from here
+        self._listened_documents_state = {
+            self._wateringNowCollectionName: {},
+            self._deviceCommandsCollectionName: {}
+        }
+        self._listened_documents_state_lock = threading.Lock()
+        self._own_write_times = deque(maxlen=32)
+        # held from a commit until its time is remembered, and by the listener while it checks for echoes
+        self._own_writes_lock = threading.RLock()
+        self._suppressed_echo_count = 0
         self.watering_programs_fields_listener = None
         self.watering_programs_collection_listener = None
         self._log_messages_changes_listener = None
+        self._log_messages_changes_callback = None
+        self._log_shard_rollover_job = None
         self._notification_changes_listener = None
         self._ping_listener = None
 
         self._observers = []
 
         self._refresh_token_time_delay_sec = 60
+        self._token_refresh_job = None
+        # a failed refresh is retried after this long, doubled on every failure up to the maximum
+        self._token_refresh_initial_retry_sec = 5
+        self._token_refresh_max_retry_sec = 5 * 60
+        self._token_refresh_retry_sec = self._token_refresh_initial_retry_sec
+        self._credentials = None
+
+        # the refresh token is kept in the system keyring, so a reboot does not need a new login. Without
+        # a keyring backend, as on a headless Pi, it goes to a file only this user can read
+        self._keyring_service_name = "plant_buddy_firebase"
+        self._refresh_token_file = "refresh_token"
+        self._time_to_first_listener_sec = None
 
     def _is_raspberry_registered(self, serial) -> bool:
         if self.db is None:
@@ -117,9 +170,109 @@ class FirebaseController(Subject):
             raise FirebaseUninitializedException()
 
         self.watering_now_callback = callback
+        with self._listened_documents_state_lock:
+            for state in self._listened_documents_state.values():
+                state.clear()
+
+        # advertises the protocol, so a phone knows where to send commands
+        self._set_document(self.db.collection(self._deviceTelemetryCollectionName).document(serial),
+                           {"protocolVersion": PROTOCOL_VERSION}, merge=True)
+
+        doc_ref = self.db.collection(self._deviceCommandsCollectionName).document(serial)
+        self._device_commands_listener = doc_ref.on_snapshot(self._on_device_commands_snapshot)
+
+        if self._legacy_protocol_enabled:
+            doc_ref = self.db.collection(self._wateringNowCollectionName).document(serial)
+            self.watering_now_listener = doc_ref.on_snapshot(self._on_watering_now_snapshot)
+
+    def set_legacy_protocol_enabled(self, enabled: bool):
+        """Whether protocol 1 phones are still served. Disabling it also drops the protocol 1 listeners,
+        enabling it takes effect for listeners added afterwards."""
+        self._legacy_protocol_enabled = enabled
+        if enabled:
+            return
 
-        doc_ref = self.db.collection(self._wateringNowCollectionName).document(serial)
-        self.watering_now_listener = doc_ref.on_snapshot(callback)
+        if self.watering_now_listener is not None:
+            self.watering_now_listener.unsubscribe()
+            self.watering_now_listener = None
+        if self._ping_listener is not None:
+            self._ping_listener.unsubscribe()
+            self._ping_listener = None
+
+    def _on_phone_protocol_version(self, version):
+        LocalStorageController().set_phone_protocol_version(version)
+        if version >= PROTOCOL_VERSION and self._legacy_protocol_enabled:
+            # from now on telemetry is written once and watering_info stops fanning it out
+            print(f"Phone speaks protocol {version}, no longer serving protocol 1")
+            self.set_legacy_protocol_enabled(False)
+
+    def _on_watering_now_snapshot(self, doc_snapshot, changes, read_time):
+        """Passes only the fields changed by someone else to the watering now callback."""
+        for change in changes:
+            _changed_fields = self._get_changed_fields(change.document)
+            if _changed_fields is not None and self.watering_now_callback is not None:
+                self.watering_now_callback(_changed_fields)
+
+    def _on_device_commands_snapshot(self, doc_snapshot, changes, read_time):
+        for change in changes:
+            _changed_fields = self._get_changed_fields(change.document)
+            if _changed_fields is None:
+                continue
+
+            _phone_protocol_version = _changed_fields.pop(PHONE_PROTOCOL_VERSION_FIELD, None)
+            if isinstance(_phone_protocol_version, int):
+                self._on_phone_protocol_version(_phone_protocol_version)
+
+            if self.watering_now_callback is not None and len(_changed_fields) > 0:
+                self.watering_now_callback(_changed_fields)
+            self._consume_device_commands(change.document)
+
+    def _get_changed_fields(self, document) -> dict | None:
+        _data = document.to_dict() or {}
+        with self._listened_documents_state_lock:
+            _state = self._listened_documents_state[document.reference.parent.id]
+            _changed_fields = {
+                key: value for key, value in _data.items()
+                if key not in _state or _state[key] != value
+            }
+            # the state follows the snapshots, so it only holds writes that were committed
+            _state.clear()
+            _state.update(_data)
+
+        # our own writes come back with the commit time they were given. An echo can arrive before
+        # its commit returned, so the check waits for commits in progress
+        with self._own_writes_lock:
+            _own_write = document.update_time in self._own_write_times
+        if _own_write:
+            self._suppressed_echo_count += 1
+            return None
+
+        # a phone sending the same command again changes no value, but is still a new command
+        if len(_changed_fields) == 0:
+            return _data if len(_data) > 0 else None
+        return _changed_fields
+
+    def _consume_device_commands(self, document):
+        # emptying the inbox lets the phone send the same command again. The write is skipped if a
+        # new command came in meanwhile: the handled fields stay in the state, so they are not handled
+        # twice, and are removed together with the new command
+        _fields = list(document.to_dict() or {})
+        try:
+            self._commit_own_writes(lambda: [document.reference.update(
+                {key: firestore.DELETE_FIELD for key in _fields},
+                option=self.db.write_option(last_update_time=document.update_time)
+            )])
+        except Exception as e:
+            print(f"Device commands changed before being consumed: {e}")
+            return
+
+        with self._listened_documents_state_lock:
+            _state = self._listened_documents_state[self._deviceCommandsCollectionName]
+            for key in _fields:
+                _state.pop(key, None)
+
+    def get_suppressed_echo_count(self) -> int:
+        return self._suppressed_echo_count
 
     def get_moisture_info_for_rasp_id(self, rpi_id, start_datetime, end_datetime) -> list[Any] | None:
         if self.db is None:
@@ -138,23 +291,126 @@ class FirebaseController(Subject):
 
         return moisture_info_list
 
-    def update_watering_info(self, serial, command, liters_sent, watering_time):
+    def get_moisture_info_page_for_rasp_id(self, rpi_id, after_datetime, end_datetime, limit=500,
+                                           cursor=None) -> tuple[list[dict], tuple | None]:
+        """Up to limit measurements with after_datetime < measurementTime <= end_datetime, oldest first.
+
+        Also returns the cursor of the page, the (measurementTime, document id) of its last measurement.
+        Passing it back continues after that document, also when the next one has the same time.
+        """
         if self.db is None:
             raise FirebaseUninitializedException()
 
-        doc_ref = self.db.collection(self._wateringNowCollectionName).document(serial)
+        query = (self.db.collection(self._moistureInfoCollectionName)
+                 .where(filter=FieldFilter('raspberryId', '==', rpi_id))
+                 .where(filter=FieldFilter('measurementTime', '>', after_datetime))
+                 .where(filter=FieldFilter('measurementTime', '<=', end_datetime))
+                 .order_by('measurementTime')
+                 .order_by(FieldPath.document_id())
+                 .limit(limit)
+                 )
+        if cursor is not None:
+            query = query.start_after({'measurementTime': cursor[0], FieldPath.document_id(): cursor[1]})
+
+        _docs = list(query.stream())
+        if len(_docs) == 0:
+            return [], None
+        return [doc.to_dict() for doc in _docs], (_docs[-1].get('measurementTime'), _docs[-1].id)
+
+    def get_moisture_rollups_for_rasp_id(self, rpi_id, resolution: RollupResolution, start_datetime, end_datetime) -> list[dict]:
+        if self.db is None:
+            raise FirebaseUninitializedException()
+
+        _bucket_start = datetime.fromtimestamp(
+            resolution.get_bucket_start_ms(start_datetime.timestamp() * 1000) / 1000, tz=timezone.utc)
+
+        query = (self.db.collection(self._moistureRollupsCollectionName)
+                 .where(filter=FieldFilter('raspberryId', '==', rpi_id))
+                 .where(filter=FieldFilter('resolution', '==', resolution.value))
+                 .where(filter=FieldFilter('bucketStart', '>=', _bucket_start))
+                 .where(filter=FieldFilter('bucketStart', '<=', end_datetime))
+                 )
+
+        return [doc.to_dict() for doc in query.stream()]
+
+    def _add_to_moisture_rollup(self, batch, _raspberry_id, resolution: RollupResolution, moisture_perc, timestamp):
+        _bucket_start_ms = resolution.get_bucket_start_ms(timestamp.timestamp() * 1000)
+        doc_ref = (self.db.collection(self._moistureRollupsCollectionName)
+                   .document(f"{_raspberry_id}_{resolution.value}_{_bucket_start_ms}"))
+
+        batch.set(doc_ref, {
+            "raspberryId": _raspberry_id,
+            "resolution": resolution.value,
+            "bucketStart": datetime.fromtimestamp(_bucket_start_ms / 1000, tz=timezone.utc),
+            "min": firestore.Minimum(moisture_perc),
+            "max": firestore.Maximum(moisture_perc),
+            "sum": firestore.Increment(moisture_perc),
+            "count": firestore.Increment(1)
+        }, merge=True)
+
+    def create_write_batch(self):
+        if self.db is None:
+            raise FirebaseUninitializedException()
+
+        return self.db.batch()
+
+    # the write methods below commit on their own, or only add their writes to batch when one is given
+
+    def commit_write_batch(self, batch):
+        self._commit_own_writes(batch.commit)
+
+    def _set_document(self, doc_ref, data, batch=None, merge=False):
+        if batch is None:
+            self._commit_own_writes(lambda: [doc_ref.set(data, merge=merge)])
+        else:
+            batch.set(doc_ref, data, merge=merge)
+
+    def _update_document(self, doc_ref, data, batch=None, timeout=None):
+        if batch is None:
+            self._commit_own_writes(lambda: [doc_ref.update(data, timeout=timeout)])
+        else:
+            batch.update(doc_ref, data)
+
+    def _write_telemetry(self, serial, data, batch=None, timeout=None):
+        """Writes to the telemetry document and, for protocol 1 phones, to watering_info, in one commit."""
+        _batch = batch if batch is not None else self.db.batch()
+
+        self._set_document(self.db.collection(self._deviceTelemetryCollectionName).document(serial), data, _batch,
+                           merge=True)
+        if self._legacy_protocol_enabled:
+            self._set_document(self.db.collection(self._wateringNowCollectionName).document(serial), data, _batch,
+                               merge=True)
+
+        if batch is None:
+            self._commit_own_writes(lambda: _batch.commit(timeout=timeout))
+
+    def get_telemetry_document_count(self) -> int:
+        return 2 if self._legacy_protocol_enabled else 1
+
+    def _commit_own_writes(self, commit):
+        """Runs commit() and remembers the times of its writes before a listener may check them."""
+        with self._own_writes_lock:
+            self._remember_own_writes(commit())
+
+    def _remember_own_writes(self, write_results):
+        for write_result in write_results:
+            self._own_write_times.append(write_result.update_time)
+
+    def update_watering_info(self, serial, command, liters_sent, watering_time, batch=None, timeout=None):
+        if self.db is None:
+            raise FirebaseUninitializedException()
 
         if command != '':
-            doc_ref.update({
+            self._write_telemetry(serial, {
                 'command': command,
                 'watering_duration': watering_time,
                 'water_volume': liters_sent
-            })
+            }, batch, timeout)
         else:
-            doc_ref.update({
+            self._write_telemetry(serial, {
                 'watering_duration': watering_time,
                 'water_volume': liters_sent
-            })
+            }, batch, timeout)
 
         return True
 
@@ -201,12 +457,32 @@ class FirebaseController(Subject):
         except Exception as e:
             raise Exception(f"Error getting active watering program id: {e}")
 
-    def set_active_watering_program_id(self, raspberry_id, program_id):
+    def set_active_watering_program_id(self, raspberry_id, program_id, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
         doc_ref = self.db.collection(self._wateringProgramsCollectionName).document(raspberry_id)
-        doc_ref.update({"activeProgramId": program_id})
+        self._update_document(doc_ref, {"activeProgramId": program_id}, batch)
+
+    def get_active_watering_program_ids(self, raspberry_id) -> list[str]:
+        """Programs that run besides the one in activeProgramId, each on its own zone."""
+        if self.db is None:
+            raise FirebaseUninitializedException()
+
+        doc_ref = self.db.collection(self._wateringProgramsCollectionName).document(raspberry_id)
+        doc = doc_ref.get()
+
+        _doc_data = doc.to_dict()
+        if _doc_data is None:
+            return []
+        return list(_doc_data.get("activeProgramIds", []))
+
+    def set_active_watering_program_ids(self, raspberry_id, program_ids, batch=None):
+        if self.db is None:
+            raise FirebaseUninitializedException()
+
+        doc_ref = self.db.collection(self._wateringProgramsCollectionName).document(raspberry_id)
+        self._update_document(doc_ref, {"activeProgramIds": list(program_ids)}, batch)
 
     def get_is_watering_programs_active(self, raspberry_id) -> bool:
         if self.db is None:
@@ -219,12 +495,12 @@ class FirebaseController(Subject):
         except Exception as e:
             raise Exception(f"Error getting is watering programs active: {e}")
 
-    def set_is_watering_programs_active(self, raspberry_id, is_active):
+    def set_is_watering_programs_active(self, raspberry_id, is_active, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
         doc_ref = self.db.collection(self._wateringProgramsCollectionName).document(raspberry_id)
-        doc_ref.update({"wateringProgramsEnabled": is_active})
+        self._update_document(doc_ref, {"wateringProgramsEnabled": is_active}, batch)
 
     def add_listener_for_watering_programs_changes(self, raspberry_id, _update_values_on_receive_from_network):
         if self.db is None:
@@ -244,8 +520,36 @@ class FirebaseController(Subject):
         if self.db is None:
             raise FirebaseUninitializedException()
 
-        doc_ref = self.db.collection(self._logsCollectionName).document(raspberry_id)
-        self._log_messages_changes_listener = doc_ref.on_snapshot(_update_values_on_receive_from_network)
+        # only today's shard is listened to, so a snapshot never carries more than one day of messages
+        self._log_messages_changes_callback = _update_values_on_receive_from_network
+        self._listen_to_current_log_shard(raspberry_id)
+
+    def _listen_to_current_log_shard(self, raspberry_id):
+        if self._log_messages_changes_listener is not None:
+            self._log_messages_changes_listener.unsubscribe()
+
+        _now = datetime.now(timezone.utc)
+        doc_ref = self._get_log_shard_ref(raspberry_id, self._get_log_shard_day(_now))
+        self._log_messages_changes_listener = doc_ref.on_snapshot(self._log_messages_changes_callback)
+
+        if self._log_shard_rollover_job is not None:
+            self._log_shard_rollover_job.cancel()
+        _next_day = (_now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        self._log_shard_rollover_job = Scheduler().schedule_once(
+            self._roll_over_log_shard_listener,
+            (_next_day - _now).total_seconds() + 1,
+            raspberry_id,
+            name="log_shard_rollover"
+        )
+
+    def _roll_over_log_shard_listener(self, raspberry_id):
+        if self.db is None or self._log_messages_changes_callback is None:
+            return
+
+        try:
+            self._listen_to_current_log_shard(raspberry_id)
+        except Exception as e:
+            print(f"Error while moving the log messages listener to the new day: {e}")
 
     def add_listener_for_notification_changes(self, raspberry_id, _update_values_on_receive_from_network):
         if self.db is None:
@@ -302,18 +606,82 @@ class FirebaseController(Subject):
         return True
 
     # Event logger methods
+    @staticmethod
+    def _get_log_shard_day(timestamp) -> str:
+        if not isinstance(timestamp, datetime):
+            try:
+                timestamp = datetime.fromisoformat(str(timestamp))
+            except ValueError:
+                # sorts after every real day, so it is read last
+                return "0000-00-00"
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc)
+        return timestamp.strftime("%Y-%m-%d")
+
+    def _get_log_shard_ref(self, raspberry_id, day):
+        return (self.db.collection(self._logsCollectionName).document(raspberry_id)
+                .collection(self._logShardsCollectionName).document(day))
+
     def get_log_messages(self, raspberry_id) -> dict:
+        """Messages of the newest week of shards."""
+        return self.get_log_messages_page(raspberry_id)[0]
+
+    def get_log_messages_page(self, raspberry_id, limit_days=7, before_day=None) -> tuple[dict, str | None]:
+        """Messages of up to limit_days day shards older than before_day, newest first.
+
+        Returns the messages map and the cursor of the next page, None after the oldest shard.
+        """
         if self.db is None:
             raise FirebaseUninitializedException()
 
         try:
-            log_messages_ref = self.db.collection(self._logsCollectionName).document(raspberry_id).get()
-            log_messages = log_messages_ref.get("messages")
-            return log_messages
+            query = (self.db.collection(self._logsCollectionName).document(raspberry_id)
+                     .collection(self._logShardsCollectionName)
+                     .order_by('day', direction=firestore.Query.DESCENDING))
+            if before_day is not None:
+                query = query.start_after({'day': before_day})
+
+            _shards = [doc.to_dict() for doc in query.limit(limit_days).stream()]
         except Exception as e:
             raise Exception(f"Error getting log messages: {e}")
 
-    def add_log_message(self, raspberry_id, log_message) -> bool:
+        log_messages = {}
+        for shard in _shards:
+            log_messages.update(shard.get("messages", {}))
+
+        _next_cursor = _shards[-1]["day"] if len(_shards) == limit_days else None
+        return log_messages, _next_cursor
+
+    def migrate_log_messages_to_shards(self, raspberry_id) -> int:
+        """Moves the messages map of logs/{raspberry_id} into day shards, once. Returns the number of messages moved."""
+        if self.db is None:
+            raise FirebaseUninitializedException()
+
+        doc_ref = self.db.collection(self._logsCollectionName).document(raspberry_id)
+        _data = doc_ref.get().to_dict() or {}
+        _messages = _data.get("messages")
+        if not _messages:
+            return 0
+
+        _shards = {}
+        for key, message in _messages.items():
+            _shards.setdefault(self._get_log_shard_day(key), {})[key] = message
+
+        # every shard is merged, so a migration interrupted halfway can simply run again
+        _days = sorted(_shards)
+        _shards_per_batch = 400
+        for i in range(0, len(_days), _shards_per_batch):
+            _batch = self.db.batch()
+            for day in _days[i:i + _shards_per_batch]:
+                _batch.set(self._get_log_shard_ref(raspberry_id, day), {"day": day, "messages": _shards[day]}, merge=True)
+            if i + _shards_per_batch >= len(_days):
+                _batch.update(doc_ref, {"messages": firestore.DELETE_FIELD, "logFormatVersion": 2})
+            self.commit_write_batch(_batch)
+
+        print(f"Moved {len(_messages)} log messages into {len(_days)} day shards")
+        return len(_messages)
+
+    def add_log_message(self, raspberry_id, log_message, batch=None) -> bool:
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -322,13 +690,14 @@ class FirebaseController(Subject):
                 str(log_message.get_timestamp()): log_message.get_message()
             }
 
-            log_messages_ref = self.db.collection(self._logsCollectionName).document(raspberry_id)
-            log_messages_ref.set({"messages": data}, merge=True)
+            _day = self._get_log_shard_day(log_message.get_timestamp())
+            log_messages_ref = self._get_log_shard_ref(raspberry_id, _day)
+            self._set_document(log_messages_ref, {"day": _day, "messages": data}, batch, merge=True)
             return True
         except Exception as e:
             raise Exception(f"Error adding log message: {e}")
 
-    def update_raspberry_notifiable_message(self, raspberry_id, message_type, value):
+    def update_raspberry_notifiable_message(self, raspberry_id, message_type, value, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -337,7 +706,7 @@ class FirebaseController(Subject):
         }
 
         doc_ref = self.db.collection(self._raspberryInfoCollectionName).document(raspberry_id)
-        doc_ref.set({"notifiable_messages": data}, merge=True)
+        self._set_document(doc_ref, {"notifiable_messages": data}, batch, merge=True)
 
     def get_notifiable_messages(self, raspberry_id):
         try:
@@ -348,7 +717,7 @@ class FirebaseController(Subject):
         except Exception as e:
             raise Exception(f"Error getting notifiable messages: {e}")
 
-    def update_moisture_info(self, _raspberry_id, param):
+    def update_moisture_info(self, _raspberry_id, param, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -357,12 +726,12 @@ class FirebaseController(Subject):
                 "soilMoisture": param
             }
 
-            self.db.collection(self._wateringNowCollectionName).document(_raspberry_id).set(data, merge=True)
+            self._write_telemetry(_raspberry_id, data, batch)
             return True
         except Exception as e:
             raise Exception(f"Error updating moisture info: {e}")
 
-    def update_next_watering_time(self, _raspberry_id, next_watering_time):
+    def update_next_watering_time(self, _raspberry_id, next_watering_time, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -371,12 +740,12 @@ class FirebaseController(Subject):
                 "nextWateringTime": next_watering_time
             }
 
-            self.db.collection(self._wateringNowCollectionName).document(_raspberry_id).set(data, merge=True)
+            self._write_telemetry(_raspberry_id, data, batch)
             return True
         except Exception as e:
             raise Exception(f"Error updating next watering time: {e}")
 
-    def update_water_tank_volume_info(self, _raspberry_id, param):
+    def update_water_tank_volume_info(self, _raspberry_id, param, batch=None):
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -385,12 +754,12 @@ class FirebaseController(Subject):
                 "waterTankVolume": param
             }
 
-            self.db.collection(self._wateringNowCollectionName).document(_raspberry_id).set(data, merge=True)
+            self._write_telemetry(_raspberry_id, data, batch)
             return True
         except Exception as e:
             raise Exception(f"Error updating water volume info: {e}")
 
-    def add_moisture_percentage_measurement(self, _raspberry_id, moisture_perc, timestamp) -> [bool, any]:
+    def add_moisture_percentage_measurement(self, _raspberry_id, moisture_perc, timestamp, batch=None) -> [bool, any]:
         if self.db is None:
             raise FirebaseUninitializedException()
 
@@ -401,33 +770,59 @@ class FirebaseController(Subject):
                 "measurementValuePercent": moisture_perc
             }
 
-            self.db.collection(self._moistureInfoCollectionName).add(data)
+            # the reading and its hourly and daily rollups are committed together. The reading's id is
+            # derived from its time and create() fails if it exists, so a replayed write cannot count twice
+            _measurement_id = f"{_raspberry_id}_{int(timestamp.timestamp() * 1000)}"
+            _batch = batch if batch is not None else self.db.batch()
+            _batch.create(self.db.collection(self._moistureInfoCollectionName).document(_measurement_id), data)
+            for resolution in RollupResolution:
+                self._add_to_moisture_rollup(_batch, _raspberry_id, resolution, moisture_perc, timestamp)
+            if batch is None:
+                self.commit_write_batch(_batch)
             return True, data
 
+        except AlreadyExists:
+            return True, data
         except Exception as e:
             raise Exception(f"Error adding moisture percentage measurement: {e}")
 
     def unsubscribe_watering_now_listener(self):
-        self.watering_now_listener.unsubscribe()
+        if self._device_commands_listener is not None:
+            self._device_commands_listener.unsubscribe()
+            self._device_commands_listener = None
+
+        if self.watering_now_listener is not None:
+            self.watering_now_listener.unsubscribe()
+            self.watering_now_listener = None
 
     def add_ping_listener(self, _on_ping_from_phone_callback):
-        if self.db is None:
+        # protocol 2 pings arrive with the other device commands
+        if self.db is None or not self._legacy_protocol_enabled:
             return
 
         doc_ref = self.db.collection(self._wsCollectionName).document(getserial())
         doc_ref.set({"message": ""})
         self._ping_listener = doc_ref.on_snapshot(_on_ping_from_phone_callback)
 
-    def answer_to_ping(self):
+    def answer_to_ping(self, ping=None):
+        """Answers a protocol 2 ping (its value is echoed in the telemetry), or a protocol 1 PING when None."""
         if self.db is None:
             return
 
+        if ping is not None:
+            self._set_document(self.db.collection(self._deviceTelemetryCollectionName).document(getserial()),
+                               {"pong": ping}, merge=True)
+            return
+
         self.db.collection(self._wsCollectionName).document(getserial()).set({"message": "PONG"})
 
     def _remove_all_listeners(self):
         if self.watering_now_listener is not None:
             self.watering_now_listener.unsubscribe()
 
+        if self._device_commands_listener is not None:
+            self._device_commands_listener.unsubscribe()
+
         if self.watering_programs_fields_listener is not None:
             self.watering_programs_fields_listener.unsubscribe()
 
@@ -437,6 +832,10 @@ class FirebaseController(Subject):
         if self._log_messages_changes_listener is not None:
             self._log_messages_changes_listener.unsubscribe()
 
+        if self._log_shard_rollover_job is not None:
+            self._log_shard_rollover_job.cancel()
+            self._log_shard_rollover_job = None
+
         if self._notification_changes_listener is not None:
             self._notification_changes_listener.unsubscribe()
 
@@ -458,7 +857,7 @@ class FirebaseController(Subject):
         request_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithCustomToken?key={self.__api_key}"
         headers = {"Content-Type": "application/json; charset=UTF-8"}
         data = json.dumps({"token": token, "returnSecureToken": True})
-        response = requests.post(request_url, headers=headers, data=data)
+        response = HttpClient().post("sign_in_with_custom_token", request_url, headers=headers, data=data)
 
         try:
             response.raise_for_status()
@@ -476,12 +875,110 @@ class FirebaseController(Subject):
         if self._authenticate_firestore_client_with_tokens(_token, _refresh_token):
             self.__token = _token
             self.__refresh_token = _refresh_token
+            self._store_refresh_token(_refresh_token)
             self._schedule_token_refresh(_expires_in - self._refresh_token_time_delay_sec)
 
             return True
         else:
             return False
 
+    def login_with_stored_refresh_token(self) -> bool:
+        """Logs in with the refresh token kept from the last login, in a single token request.
+
+        Returns False when there is no usable token and the login flow has to run; a token the
+        server rejected is forgotten, one that could not be checked because of the network is kept.
+        """
+        _stored_refresh_token = self._load_refresh_token()
+        if _stored_refresh_token is None:
+            return False
+
+        load_dotenv()
+        self.__api_key = os.getenv("PROJECT_WEB_API_KEY")
+        self.__project_id = os.getenv("PROJECT_ID")
+
+        try:
+            _token, _refresh_token, _expires_in = self._get_new_tokens(_stored_refresh_token)
+        except RefreshTokenRejectedException as e:
+            print(f"Stored refresh token can not be used anymore: {e}")
+            self.forget_stored_refresh_token()
+            return False
+        except Exception as e:
+            # an outage of the token service must not cost the device its login
+            print(f"Could not refresh the token, keeping the stored refresh token: {e}")
+            return False
+
+        if not self._authenticate_firestore_client_with_tokens(_token, _refresh_token):
+            return False
+
+        self.__token = _token
+        self.__refresh_token = _refresh_token
+        self._store_refresh_token(_refresh_token)
+        self._schedule_token_refresh(_expires_in - self._refresh_token_time_delay_sec)
+        return True
+
+    async def login_with_stored_refresh_token_async(self) -> bool:
+        return await run_blocking(self.login_with_stored_refresh_token)
+
+    def _load_refresh_token(self) -> str | None:
+        try:
+            return keyring.get_password(self._keyring_service_name, getserial())
+        except keyring.errors.NoKeyringError:
+            return self._load_refresh_token_file()
+        except Exception as e:
+            print(f"Error reading the refresh token from the keyring: {e}")
+            return None
+
+    def _store_refresh_token(self, refresh_token):
+        try:
+            keyring.set_password(self._keyring_service_name, getserial(), refresh_token)
+        except keyring.errors.NoKeyringError:
+            print(f"No keyring backend available, keeping the refresh token in {self._refresh_token_file}")
+            self._store_refresh_token_file(refresh_token)
+        except Exception as e:
+            print(f"Error saving the refresh token to the keyring, the next start will need a new login: {e}")
+
+    def forget_stored_refresh_token(self):
+        try:
+            keyring.delete_password(self._keyring_service_name, getserial())
+        except (keyring.errors.PasswordDeleteError, keyring.errors.NoKeyringError):
+            pass
+        except Exception as e:
+            print(f"Error removing the refresh token from the keyring: {e}")
+
+        try:
+            os.remove(self._refresh_token_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error removing the refresh token file: {e}")
+
+    def _load_refresh_token_file(self) -> str | None:
+        try:
+            with open(self._refresh_token_file, 'r') as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading the refresh token file: {e}")
+            return None
+
+    def _store_refresh_token_file(self, refresh_token):
+        # created with owner-only permissions and renamed into place, so it is never readable by others
+        _temp_path = self._refresh_token_file + '.tmp'
+        try:
+            _fd = os.open(_temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(_fd, 'w') as file:
+                file.write(refresh_token)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(_temp_path, self._refresh_token_file)
+        except Exception as e:
+            print(f"Error saving the refresh token file, the next start will need a new login: {e}")
+
+    def get_time_to_first_listener_sec(self) -> float | None:
+        """Seconds from startup until the listeners were first started, None before that."""
+        return self._time_to_first_listener_sec
+
     # should deprecate
     # def anonymous_login(self):
     #     load_dotenv()
@@ -527,15 +1024,13 @@ class FirebaseController(Subject):
             "grant_type": "refresh_token",
             "refresh_token": refresh_token
         }
-        response = requests.post(request_url, headers=headers, data=data)
+        response = HttpClient().post("refresh_token", request_url, headers=headers, data=data)
 
-        try:
-            response.raise_for_status()
-        except (HTTPError, Exception):
-            content = response.json()
-            error = f"error: {content['error']['message']}"
-
-            raise Exception(error)
+        if not response.ok:
+            _reason = self._get_token_error_reason(response)
+            if response.status_code == 400 and _reason in self._REFRESH_TOKEN_REJECTED_REASONS:
+                raise RefreshTokenRejectedException(_reason)
+            raise HTTPError(f"Token request failed with status {response.status_code}: {_reason}", response=response)
 
         json_response = response.json()
         _token = json_response["id_token"]
@@ -544,6 +1039,14 @@ class FirebaseController(Subject):
 
         return _token, _refresh_token, _expires_in
 
+    @staticmethod
+    def _get_token_error_reason(response) -> str | None:
+        try:
+            # e.g. "TOKEN_EXPIRED" or "INVALID_REFRESH_TOKEN : <details>"
+            return response.json()["error"]["message"].split(" ")[0]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
     def _authenticate_firestore_client_with_tokens(self, token, refresh_token) -> bool:
         try:
             _credentials = google.oauth2.credentials.Credentials(token,
@@ -555,34 +1058,71 @@ class FirebaseController(Subject):
 
             self._remove_all_listeners()
             self._instance.db = firestore.Client(self.__project_id, _credentials)
+            self._credentials = _credentials
+            # the observers start their listeners while being notified
             self.notify(ObserverNotificationType.FIRESTORE_CLIENT_CHANGED)
 
+            if self._time_to_first_listener_sec is None:
+                self._time_to_first_listener_sec = time.monotonic() - _PROCESS_START
+                print(f"Listeners started {self._time_to_first_listener_sec:.2f}s after startup")
+
             return True
 
         except Exception as e:
             print(f"Error authenticating firestore client with tokens: {e}")
             self._instance.db = None
+            self._credentials = None
             return False
 
+    def _swap_firestore_client_tokens(self, token, refresh_token) -> bool:
+        """Puts the new token in the credentials of the current client, keeping it and its listeners.
+
+        The token is read from the credentials for every request and whenever a listener stream
+        reconnects, so nothing has to be rebuilt. Falls back to a new client when there is none.
+        """
+        if self.db is None or self._credentials is None:
+            return self._authenticate_firestore_client_with_tokens(token, refresh_token)
+
+        # the refresh token in the credentials is never used, tokens are refreshed by _get_new_tokens
+        self._credentials.token = token
+        self.notify(ObserverNotificationType.FIRESTORE_CREDENTIALS_REFRESHED)
+        return True
+
     def _schedule_token_refresh(self, delay):
-        _refresh_thread = threading.Timer(delay, self._auto_refresh_firestore_client)
-        _refresh_thread.daemon = True
-        _refresh_thread.start()
+        # a login schedules a new refresh, the one of the previous session must not run as well
+        if self._token_refresh_job is not None:
+            self._token_refresh_job.cancel()
+        self._token_refresh_job = Scheduler().schedule_once(
+            self._auto_refresh_firestore_client,
+            delay,
+            name="token_refresh"
+        )
 
     def _auto_refresh_firestore_client(self):
         try:
             _token, _refresh_token, _expires_in = self._get_new_tokens(self.__refresh_token)
 
-            if self._authenticate_firestore_client_with_tokens(_token, _refresh_token):
+            if self._swap_firestore_client_tokens(_token, _refresh_token):
                 self.__token = _token
+                if _refresh_token != self.__refresh_token:
+                    self._store_refresh_token(_refresh_token)
                 self.__refresh_token = _refresh_token
+                self._token_refresh_retry_sec = self._token_refresh_initial_retry_sec
                 self._schedule_token_refresh(_expires_in - self._refresh_token_time_delay_sec)
 
                 print("Token refreshed")
+                return
+
+            print("Error attempting to refresh token: the Firestore client did not take the new token")
 
         except Exception as e:
             print(f"Error attempting to refresh token: {e}")
 
+        # without a retry the client keeps the expired token until the next login
+        print(f"Retrying the token refresh in {self._token_refresh_retry_sec} seconds")
+        self._schedule_token_refresh(self._token_refresh_retry_sec)
+        self._token_refresh_retry_sec = min(self._token_refresh_retry_sec * 2, self._token_refresh_max_retry_sec)
+
     def is_logged_in(self):
         return self.db is not None
 
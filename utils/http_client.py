@@ -0,0 +1,159 @@
+import bisect
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class HttpClient:
+    """Shared HTTP client for the backend and the Firebase auth endpoints.
+
+    Requests go through one pooled keep-alive session, so repeated calls to a host reuse its
+    connection instead of doing a new TCP and TLS handshake. Every request is made for a named
+    endpoint, which sets its timeouts and whether it may be retried. Failures are retried a bounded
+    number of times with jittered exponential backoff. Endpoints where sending a request twice is
+    harmless retry any connection error, timeout or overloaded-server response; the others only
+    retry failures that show the server did not handle the request.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    # (connect, read) timeouts in seconds and whether a request that may have arrived can be repeated
+    _DEFAULT_ENDPOINT = {"timeout": (3.05, 15.0), "idempotent": False}
+    _ENDPOINTS = {
+        "send_notification": {"timeout": (3.05, 10.0), "idempotent": False},
+        "request_qr_info": {"timeout": (3.05, 10.0), "idempotent": True},
+        "request_login": {"timeout": (3.05, 10.0), "idempotent": True},
+        "sign_in_with_custom_token": {"timeout": (3.05, 10.0), "idempotent": True},
+        "refresh_token": {"timeout": (3.05, 10.0), "idempotent": True},
+    }
+
+    _RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # answers that the request was turned away before being handled, so it can be sent again
+    _NOT_HANDLED_STATUS_CODES = (429, 503)
+
+    # upper bounds in ms of the latency histogram buckets, the last bucket has no bound
+    _LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __new__(cls):
+        with cls._lock:
+            if not cls._instance:
+                cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, '_initialized', None):
+            return
+        self._initialized = True
+
+        self._max_retries = 3
+        self._initial_backoff_sec = 0.5
+        self._max_backoff_sec = 8.0
+
+        self._session = requests.Session()
+        _adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self._session.mount("https://", _adapter)
+        self._session.mount("http://", _adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def post(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "POST", url, **kwargs)
+
+    def get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        return self.request(endpoint, "GET", url, **kwargs)
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Returns the response of the last attempt, or raises the error of the last attempt."""
+        _config = self._ENDPOINTS.get(endpoint, self._DEFAULT_ENDPOINT)
+        kwargs.setdefault("timeout", _config["timeout"])
+
+        _attempt = 0
+        while True:
+            _started = time.monotonic()
+            try:
+                _response = self._session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(endpoint, time.monotonic() - _started, failed=True)
+                if _attempt >= self._max_retries or not self._is_retryable_error(e, _config["idempotent"]):
+                    raise
+            else:
+                self._record(endpoint, time.monotonic() - _started, failed=not _response.ok)
+                if _attempt >= self._max_retries or not self._is_retryable_status(_response.status_code,
+                                                                                  _config["idempotent"]):
+                    return _response
+
+            _attempt += 1
+            self._record_retry(endpoint)
+            _backoff_sec = min(self._initial_backoff_sec * 2 ** (_attempt - 1), self._max_backoff_sec)
+            time.sleep(_backoff_sec * random.uniform(0.5, 1.0))
+
+    @classmethod
+    def _is_retryable_status(cls, status_code, idempotent) -> bool:
+        # a 500 or 502 may come after the server already did the work, e.g. sent the notification
+        if idempotent:
+            return status_code in cls._RETRY_STATUS_CODES
+        return status_code in cls._NOT_HANDLED_STATUS_CODES
+
+    @staticmethod
+    def _is_retryable_error(error, idempotent) -> bool:
+        if idempotent:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+        # a dropped connection or a read timeout may come after the server got the request, only a
+        # request that never got a connection is sure not to have been handled
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        _reason = getattr(error.args[0], "reason", None) if len(error.args) > 0 else None
+        return isinstance(error, requests.exceptions.ConnectionError) and isinstance(_reason, NewConnectionError)
+
+    def _get_endpoint_stats(self, endpoint) -> dict:
+        _stats = self._stats.get(endpoint)
+        if _stats is None:
+            _stats = {
+                "requests": 0,
+                "failures": 0,
+                "retries": 0,
+                "total_latency_ms": 0.0,
+                "histogram": [0] * (len(self._LATENCY_BUCKETS_MS) + 1),
+            }
+            self._stats[endpoint] = _stats
+        return _stats
+
+    def _record(self, endpoint, latency_sec, failed):
+        _latency_ms = latency_sec * 1000
+        with self._stats_lock:
+            _stats = self._get_endpoint_stats(endpoint)
+            _stats["requests"] += 1
+            _stats["total_latency_ms"] += _latency_ms
+            _stats["histogram"][bisect.bisect_left(self._LATENCY_BUCKETS_MS, _latency_ms)] += 1
+            if failed:
+                _stats["failures"] += 1
+
+    def _record_retry(self, endpoint):
+        with self._stats_lock:
+            self._get_endpoint_stats(endpoint)["retries"] += 1
+
+    def get_latency_histograms(self) -> dict:
+        """Per endpoint: request, failure and retry counts, average latency and the latency histogram."""
+        _labels = [f"<={bound}ms" for bound in self._LATENCY_BUCKETS_MS] + [f">{self._LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._stats_lock:
+            return {
+                endpoint: {
+                    "requests": _stats["requests"],
+                    "failures": _stats["failures"],
+                    "retries": _stats["retries"],
+                    "avg_latency_ms": _stats["total_latency_ms"] / _stats["requests"] if _stats["requests"] > 0 else 0.0,
+                    "histogram": dict(zip(_labels, _stats["histogram"])),
+                }
+                for endpoint, _stats in self._stats.items()
+            }
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {}
@@ -1,11 +1,22 @@
+import atexit
+import copy
 import datetime
-import os
-import pickle
 import threading
+import time
 
 from tzlocal import get_localzone
 
 from domain.RaspberryInfo import RaspberryInfo
+from domain.RollupResolution import RollupResolution
+from domain.WateringZone import WateringZone
+from domain.logging.LogMessage import LogMessage
+from domain.logging.MessageType import MessageType
+from utils.pickle_storage_backend import PickleStorageBackend
+from utils.sensor_ring_buffer import SensorRingBuffer
+from utils.sqlite_storage_backend import SqliteStorageBackend
+from utils.storage_backend import StorageBackend
+
+_MISSING = object()
 
 
 class LocalStorageController:
@@ -23,170 +34,438 @@ class LocalStorageController:
             return
         self._initialized = True
 
-        self._raspberry_info_file = 'raspberry_info'
-        self._moisture_info_file = 'moisture_info'
-        self._watering_programs_file = 'watering_programs'
-        self._watering_programs_active_id_file = 'watering_programs_active_id'
-        self._is_watering_programs_active_file = 'is_watering_programs_active'
-        self._log_messages_file = 'log_messages'
+        self._raspberry_info_key = 'raspberry_info'
+        self._watering_programs_key = 'watering_programs'
+        self._watering_programs_active_id_key = 'watering_programs_active_id'
+        self._watering_programs_active_ids_key = 'watering_programs_active_ids'
+        self._watering_zones_key = 'watering_zones'
+        self._is_watering_programs_active_key = 'is_watering_programs_active'
+        self._log_messages_key = 'log_messages'
+
+        self._moisture_sensor_key = 'moisture_sensor'
+        self._pump_capacity_key = 'pump_capacity'
+        self._supply_capacity_key = 'supply_capacity'
+        self._depth_sensor_key = 'depth_sensor'
+
+        self._last_watering_time_key = 'last_watering_time'
+        self._last_watering_times_key = 'last_watering_times'
+        self._moisture_sync_key = 'moisture_sync'
+        self._phone_protocol_version_key = 'phone_protocol_version'
+
+        self._log_retention_max_entries = 5000
+        self._log_retention_max_age_days = 90
+        self._log_prune_interval_sec = 60 * 60
+        self._last_log_prune_time = 0
+
+        self._database_file = 'plant_buddy.db'
+        self._sensor_history_file = 'sensor_history.ring'
+
+        self._backend = self._create_backend()
+        self._sensor_history = SensorRingBuffer(
+            self._sensor_history_file,
+            origin_ms=self._to_epoch_ms(datetime.datetime.now(get_localzone()))
+        )
+
+        # write-through cache of decoded settings, shared by every caller in the process;
+        # cached values are returned as-is and must be treated as read-only
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._cache_version = 0
+        self._cache_key_versions = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # writes are staged here and committed together by the flusher thread
+        self._write_coalesce_window_sec = 2.0
+        self._dirty_values = {}
+        self._pending_log_entries = []
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._flusher_thread = threading.Thread(target=self._flusher_worker, daemon=True)
+        self._flusher_thread.start()
+        atexit.register(self.flush)
+
+    def _setting_keys(self):
+        return [
+            self._raspberry_info_key,
+            self._watering_programs_key,
+            self._watering_programs_active_id_key,
+            self._watering_programs_active_ids_key,
+            self._watering_zones_key,
+            self._is_watering_programs_active_key,
+            self._moisture_sensor_key,
+            self._pump_capacity_key,
+            self._supply_capacity_key,
+            self._depth_sensor_key,
+            self._last_watering_time_key,
+            self._last_watering_times_key,
+            self._moisture_sync_key,
+            self._phone_protocol_version_key,
+        ]
+
+    def _create_backend(self) -> StorageBackend:
+        _legacy_backend = PickleStorageBackend(log_messages_key=self._log_messages_key)
+
+        try:
+            _backend = SqliteStorageBackend(self._database_file)
+        except Exception as e:
+            print(f'Error while opening the local database, using per-key files: {e}')
+            return _legacy_backend
+
+        if _legacy_backend.has_data(self._setting_keys() + [self._log_messages_key]):
+            self._migrate_backend(_legacy_backend, _backend)
+
+        return _backend
 
-        self._moisture_sensor_file = 'moisture_sensor'
-        self._pump_capacity_file = 'pump_capacity'
-        self._depth_sensor_file = 'depth_sensor'
+    def _migrate_backend(self, legacy_backend: PickleStorageBackend, backend: SqliteStorageBackend):
+        print('Migrating local storage from pickle files to the local database')
 
-        self._last_watering_time_file = 'last_watering_time'
+        try:
+            _settings = {}
+            for key in self._setting_keys():
+                _value = legacy_backend.get_value(key)
+                if _value is not None:
+                    _settings[key] = _value
+            backend.write_batch(_settings, [], self._to_log_entries(legacy_backend.get_log_messages()))
+            backend.append_measurements(legacy_backend.get_measurements())
+
+            legacy_backend.remove_files(self._setting_keys() + [self._log_messages_key])
+        except Exception as e:
+            print(f'Error while migrating local storage, pickle files were kept: {e}')
+        finally:
+            legacy_backend.close()
 
     def clear_all(self):
-        self._delete_file(self._raspberry_info_file)
-        self._delete_file(self._moisture_info_file)
-        self._delete_file(self._watering_programs_file)
-        self._delete_file(self._watering_programs_active_id_file)
-        self._delete_file(self._is_watering_programs_active_file)
-        self._delete_file(self._log_messages_file)
-        self._delete_file(self._last_watering_time_file)
-
-    def _delete_file(self, file_name):
-        if file_name in os.listdir():
-            os.remove(file_name)
+        self._delete_value(self._raspberry_info_key)
+        self._backend.clear_measurements()
+        self._delete_value(self._moisture_sync_key)
+        self._delete_value(self._watering_programs_key)
+        self._delete_value(self._watering_programs_active_id_key)
+        self._delete_value(self._watering_programs_active_ids_key)
+        self._delete_value(self._is_watering_programs_active_key)
+        self._delete_value(self._last_watering_time_key)
+        self._delete_value(self._last_watering_times_key)
+        self.flush()
+        self._backend.replace_log_messages([])
+        self._sensor_history.clear(origin_ms=self._to_epoch_ms(datetime.datetime.now(get_localzone())))
+
+    def set_write_coalesce_window(self, window_sec: float):
+        """Sets how long staged writes wait for more writes before being committed. 0 commits immediately."""
+        self._write_coalesce_window_sec = max(0.0, window_sec)
+        if self._write_coalesce_window_sec == 0:
+            self.flush()
+
+    def _flusher_worker(self):
+        while True:
+            self._flush_requested.wait()
+            if self._write_coalesce_window_sec > 0:
+                time.sleep(self._write_coalesce_window_sec)
+            self.flush()
+
+    def _request_flush(self):
+        if self._write_coalesce_window_sec == 0:
+            self.flush()
+        else:
+            self._flush_requested.set()
+
+    def flush(self) -> bool:
+        """Synchronously commits every staged write, e.g. before starting the pump."""
+        with self._flush_lock:
+            with self._cache_lock:
+                self._flush_requested.clear()
+                if len(self._dirty_values) == 0 and len(self._pending_log_entries) == 0:
+                    return True
+
+                _dirty_values = self._dirty_values
+                _pending_log_entries = self._pending_log_entries
+                self._dirty_values = {}
+                self._pending_log_entries = []
+
+            _values = {key: value for key, value in _dirty_values.items() if value is not _MISSING}
+            _deleted_keys = [key for key, value in _dirty_values.items() if value is _MISSING]
+
+            try:
+                self._backend.write_batch(_values, _deleted_keys, _pending_log_entries)
+                if len(_pending_log_entries) > 0:
+                    self._prune_log_messages_if_due()
+                return True
+            except Exception as e:
+                print(f'Error while committing local storage writes, will retry: {e}')
+
+                with self._cache_lock:
+                    # newer writes staged meanwhile take precedence over the failed batch
+                    for key, value in _dirty_values.items():
+                        self._dirty_values.setdefault(key, value)
+                    self._pending_log_entries = _pending_log_entries + self._pending_log_entries
+                    self._flush_requested.set()
+                return False
+
+    def _get_value(self, key, default=None):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache_hits += 1
+                _value = self._cache[key]
+                return default if _value is _MISSING else _value
+            self._cache_misses += 1
 
-    def get_raspberry_info(self) -> RaspberryInfo | None:
         try:
-            with open(self._raspberry_info_file, 'rb') as file:
-                _raspberry_dict = pickle.load(file)
-                if _raspberry_dict is None or len(_raspberry_dict) == 0:
-                    return None
-
-                try:
-                    _rasp_info = RaspberryInfo().from_dict(_raspberry_dict)
-                    return _rasp_info
-                except Exception as e:
-                    print(f'Error while loading RaspberryInfo from file: {e}')
-                    return None
-        except FileNotFoundError:
+            _value = self._backend.get_value(key, _MISSING)
+        except Exception as e:
+            print(f'Error while loading {key} from local storage: {e}')
+            return default
+
+        with self._cache_lock:
+            # a concurrent write wins over the value read from the backend
+            self._cache.setdefault(key, _value)
+
+        return default if _value is _MISSING else _value
+
+    def _set_value(self, key, value) -> bool:
+        try:
+            # the caller keeps its own object, so later mutations of it must not leak into the cache
+            _value = copy.deepcopy(value)
+        except Exception as e:
+            print(f'Error while saving {key} to local storage: {e}')
+            return False
+
+        self._stage_value(key, _value)
+        return True
+
+    def _delete_value(self, key):
+        self._stage_value(key, _MISSING)
+
+    def _stage_value(self, key, value):
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache_version += 1
+            self._cache_key_versions[key] = self._cache_version
+            self._dirty_values[key] = value
+
+        self._request_flush()
+
+    def get_cache_version(self, key=None) -> int:
+        with self._cache_lock:
+            if key is None:
+                return self._cache_version
+            return self._cache_key_versions.get(key, 0)
+
+    def get_cache_stats(self) -> dict:
+        with self._cache_lock:
+            _lookups = self._cache_hits + self._cache_misses
+            return {
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "hit_ratio": self._cache_hits / _lookups if _lookups > 0 else 0.0,
+                "entries": len(self._cache),
+                "version": self._cache_version,
+            }
+
+    def reset_cache_stats(self):
+        with self._cache_lock:
+            self._cache_hits = 0
+            self._cache_misses = 0
+
+    def get_raspberry_info(self) -> RaspberryInfo | None:
+        _raspberry_dict = self._get_value(self._raspberry_info_key)
+        if _raspberry_dict is None or len(_raspberry_dict) == 0:
             return None
+
+        try:
+            _rasp_info = RaspberryInfo().from_dict(_raspberry_dict)
+            return _rasp_info
         except Exception as e:
             print(f'Error while loading RaspberryInfo from file: {e}')
             return None
 
     def save_raspberry_info(self, raspberry_info: RaspberryInfo):
-        try:
-            with open(self._raspberry_info_file, 'wb') as file:
-                pickle.dump(raspberry_info.to_dict(), file)
-        except FileNotFoundError:
-            print(f'File not found: {self._raspberry_info_file}')
-            pass
-        except Exception as e:
-            print(f'Error while saving RaspberryInfo to file: {e}')
-            pass
+        self._set_value(self._raspberry_info_key, raspberry_info.to_dict())
 
     def get_moisture_info(self, start_date=None, end_date=None) -> list[dict]:
         try:
-            with open(self._moisture_info_file, 'rb') as file:
-                _moisture_info = pickle.load(file)
-
-                if start_date is None:
-                    start_date = datetime.datetime.min
-                if end_date is None:
-                    end_date = datetime.datetime.now()
-
-                start_date = start_date.astimezone(get_localzone())
-                end_date = end_date.astimezone(get_localzone())
+            if end_date is None:
+                end_date = datetime.datetime.now(get_localzone())
 
-                _moisture_info_filtered = [measurement for measurement in _moisture_info
-                                  if start_date <= measurement["measurementTime"] <= end_date]
+            _start_ms = self._to_epoch_ms(start_date) if start_date is not None else None
+            _end_ms = self._to_epoch_ms(end_date)
 
-                return _moisture_info_filtered
-        except FileNotFoundError as e:
-            print(f'File not found: {self._moisture_info_file} and error is {e}')
+            return [
+                {
+                    "raspberryId": _raspberry_id,
+                    "measurementTime": self._from_epoch_ms(_timestamp_ms),
+                    "measurementValuePercent": _value
+                }
+                for _timestamp_ms, _value, _raspberry_id in self._backend.get_measurements(_start_ms, _end_ms)
+            ]
+        except Exception as e:
+            print(f'Error while loading moisture info: {e}')
             return []
 
-    def save_moisture_info(self, moisture_info: list[dict]):
-        try:
-            with open(self._moisture_info_file, 'wb') as file:
-                pickle.dump(moisture_info, file)
-        except FileNotFoundError:
-            print(f'File not found: {self._moisture_info_file}')
-            pass
-
-    def update_moisture_info_list(self, moisture_info: list[dict]):
+    def update_moisture_info_list(self, moisture_info: list[dict]) -> bool:
         try:
-            _current_moisture_info = self.get_moisture_info()
-            _current_moisture_info.extend(moisture_info)
-            _current_moisture_info = sorted(_current_moisture_info, key=lambda x: x["measurementTime"], reverse=True)
-            _current_moisture_info = _current_moisture_info[:100]
-            self.save_moisture_info(_current_moisture_info)
+            self._backend.append_measurements([
+                (
+                    self._to_epoch_ms(measurement["measurementTime"]),
+                    measurement["measurementValuePercent"],
+                    measurement.get("raspberryId", "")
+                )
+                for measurement in sorted(moisture_info, key=lambda x: x["measurementTime"])
+            ])
+            return True
         except Exception as e:
             print(f'Error while updating moisture info: {e}')
-            pass
+            return False
+
+    def get_moisture_sync_range(self):
+        """(synced_from, synced_until): every remote measurement between the two is stored locally."""
+        data = self._get_value(self._moisture_sync_key)
+        if data is None or "synced_from_ms" not in data or "synced_until_ms" not in data:
+            return None, None
+        return self._from_epoch_ms(data["synced_from_ms"]), self._from_epoch_ms(data["synced_until_ms"])
+
+    def set_moisture_sync_range(self, synced_from, synced_until):
+        data = {
+            "synced_from_ms": self._to_epoch_ms(synced_from),
+            "synced_until_ms": self._to_epoch_ms(synced_until)
+        }
+        return self._set_value(self._moisture_sync_key, data)
+
+    @staticmethod
+    def _to_epoch_ms(date_time) -> int:
+        return int(date_time.timestamp() * 1000)
+
+    @staticmethod
+    def _from_epoch_ms(timestamp_ms) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(timestamp_ms / 1000, tz=get_localzone())
 
     def get_watering_programs(self):
-        try:
-            with open(self._watering_programs_file, 'rb') as file:
-                _watering_programs = pickle.load(file)
-                return _watering_programs
-        except FileNotFoundError:
-            return []
+        return self._get_value(self._watering_programs_key, [])
 
     def save_watering_programs(self, watering_programs):
-        try:
-            with open(self._watering_programs_file, 'wb') as file:
-                pickle.dump(watering_programs, file)
-        except FileNotFoundError:
-            print(f'File not found: {self._watering_programs_file}')
-            pass
+        self._set_value(self._watering_programs_key, watering_programs)
 
     def get_active_watering_program_id(self):
-        try:
-            with open(self._watering_programs_active_id_file, 'rb') as file:
-                _active_id = pickle.load(file)
-                return _active_id
-        except FileNotFoundError:
-            return None
+        return self._get_value(self._watering_programs_active_id_key)
 
     def save_active_watering_program_id(self, active_id):
-        try:
-            with open(self._watering_programs_active_id_file, 'wb') as file:
-                pickle.dump(active_id, file)
-        except FileNotFoundError:
-            print(f'File not found: {self._watering_programs_active_id_file}')
-            pass
+        self._set_value(self._watering_programs_active_id_key, active_id)
+
+    def get_active_watering_program_ids(self):
+        return self._get_value(self._watering_programs_active_ids_key, [])
+
+    def save_active_watering_program_ids(self, active_ids):
+        self._set_value(self._watering_programs_active_ids_key, list(active_ids))
+
+    def get_watering_zones(self) -> list[WateringZone]:
+        _zones = self._get_value(self._watering_zones_key)
+        if not _zones:
+            return [WateringZone()]
+        return [WateringZone().fromDict(zone) for zone in _zones]
+
+    def save_watering_zones(self, zones: list[WateringZone]):
+        self._set_value(self._watering_zones_key, [zone.getInfoDict() for zone in zones])
 
     def get_is_watering_programs_active(self):
-        try:
-            with open(self._is_watering_programs_active_file, 'rb') as file:
-                _is_active = pickle.load(file)
-                return _is_active
-        except FileNotFoundError:
-            return False
+        return self._get_value(self._is_watering_programs_active_key, False)
 
     def save_is_watering_programs_active(self, is_active):
-        try:
-            with open(self._is_watering_programs_active_file, 'wb') as file:
-                pickle.dump(is_active, file)
-        except FileNotFoundError:
-            print(f'File not found: {self._is_watering_programs_active_file}')
-            pass
+        self._set_value(self._is_watering_programs_active_key, is_active)
 
     def get_log_messages(self) -> dict:
+        self.flush()
         try:
-            with open(self._log_messages_file, 'rb') as file:
-                _log_messages = pickle.load(file)
-                return _log_messages
-        except FileNotFoundError:
+            return self._backend.get_log_messages()
+        except Exception as e:
+            print(f'Error while loading log messages: {e}')
             return {}
 
     def save_log_messages(self, log_messages):
+        """Merges the messages into the local log; the retention budget decides what is kept."""
+        self.flush()
+        try:
+            self._backend.add_log_messages(self._to_log_entries(log_messages))
+            self._prune_log_messages_if_due()
+        except Exception as e:
+            print(f'Error while saving log messages: {e}')
+
+    def get_log_messages_page(self, limit=50, message_type: MessageType = None, start_date=None, end_date=None,
+                              cursor=None, newer=False) -> tuple[list[LogMessage], tuple | None]:
+        """One page of log messages, newest first (or oldest first with newer), and the cursor of the next page.
+
+        Pass the returned cursor back to continue after the last message of this page; it is None when the
+        page is empty.
+        """
+        self.flush()
+        try:
+            _rows = self._backend.get_log_page(
+                limit,
+                level=message_type.value if message_type is not None and message_type != MessageType.ANY else None,
+                start_ms=self._to_epoch_ms(start_date) if start_date is not None else None,
+                end_ms=self._to_epoch_ms(end_date) if end_date is not None else None,
+                cursor=cursor,
+                newer=newer
+            )
+        except Exception as e:
+            print(f'Error while loading log messages: {e}')
+            return [], cursor
+
+        _log_messages = [
+            LogMessage(message=_message, level=self._to_message_type(_level), timestamp=self._from_epoch_ms(_timestamp_ms))
+            for _key, _timestamp_ms, _message, _level in _rows
+        ]
+        _next_cursor = (_rows[-1][1], _rows[-1][0]) if len(_rows) > 0 else None
+        return _log_messages, _next_cursor
+
+    @staticmethod
+    def _to_message_type(level) -> MessageType:
+        try:
+            return MessageType(level)
+        except ValueError:
+            return MessageType.ANY
+
+    def _prune_log_messages_if_due(self):
+        if time.time() - self._last_log_prune_time < self._log_prune_interval_sec:
+            return
+        self._last_log_prune_time = time.time()
+
+        _min_timestamp = datetime.datetime.now(get_localzone()) - datetime.timedelta(days=self._log_retention_max_age_days)
         try:
-            with open(self._log_messages_file, 'wb') as file:
-                pickle.dump(log_messages, file)
-        except FileNotFoundError:
-            print(f'File not found: {self._log_messages_file}')
-            pass
+            _deleted = self._backend.prune_log_messages(self._log_retention_max_entries, self._to_epoch_ms(_min_timestamp))
+            if _deleted > 0:
+                print(f'Removed {_deleted} old log messages from local storage')
+        except Exception as e:
+            print(f'Error while pruning log messages: {e}')
+
+    def set_log_retention(self, max_entries: int, max_age_days: int):
+        self._log_retention_max_entries = max_entries
+        self._log_retention_max_age_days = max_age_days
+        self._last_log_prune_time = 0
 
     def add_log_message(self, log_message):
-        _log_messages = self.get_log_messages()
-        _log_messages[log_message.get_timestamp()] = log_message.get_message()
-        self.save_log_messages(_log_messages)
+        try:
+            _log_entry = self._to_log_entry(log_message.get_timestamp(), log_message.get_message(), log_message.get_level())
+        except Exception as e:
+            print(f'Error while adding log message: {e}')
+            return
+
+        with self._cache_lock:
+            self._pending_log_entries.append(_log_entry)
+        self._request_flush()
+
+    def _to_log_entries(self, log_messages) -> list[tuple]:
+        if log_messages is None:
+            return []
+        return [self._to_log_entry(key, message) for key, message in log_messages.items()]
+
+    def _to_log_entry(self, timestamp, message, level=MessageType.ANY) -> tuple:
+        # log keys are str(datetime), the same keys used in the Firestore messages map
+        if isinstance(timestamp, datetime.datetime):
+            return str(timestamp), self._to_epoch_ms(timestamp), message, level.value
+
+        try:
+            _timestamp_ms = self._to_epoch_ms(datetime.datetime.fromisoformat(str(timestamp)))
+        except ValueError:
+            _timestamp_ms = 0
+        return str(timestamp), _timestamp_ms, message, level.value
 
     def update_raspberry_notifiable_message(self, message_type, value):
         _raspberry_info = self.get_raspberry_info()
@@ -213,120 +492,132 @@ class LocalStorageController:
         return _raspberry_info.notifiableMessages, True
 
     def add_moisture_percentage_measurement(self, measurement):
-        _moisture_info = self.get_moisture_info()
-        _moisture_info.append(measurement)
-        self.update_moisture_info_list(_moisture_info)
-        return True
+        try:
+            _timestamp_ms = self._to_epoch_ms(measurement["measurementTime"])
+            self._sensor_history.append(
+                SensorRingBuffer.SENSOR_MOISTURE,
+                measurement["measurementValuePercent"],
+                _timestamp_ms
+            )
+            return self._backend.append_measurement(
+                _timestamp_ms,
+                measurement["measurementValuePercent"],
+                measurement.get("raspberryId", "")
+            )
+        except Exception as e:
+            print(f'Error while adding moisture measurement: {e}')
+            return False
 
-    def set_moisture_sensor_absolute_values(self, absolute_dry, absolute_wet) -> bool:
+    def get_moisture_rollups(self, resolution: RollupResolution, start_date, end_date) -> list[dict]:
         try:
-            with (open(self._moisture_sensor_file, 'wb') as file):
-                _moisture_absolute_values = {
-                    "absolute_dry": absolute_dry,
-                    "absolute_wet": absolute_wet
-                }
-                pickle.dump(_moisture_absolute_values, file)
+            _rows = self._backend.get_rollups(resolution, self._to_epoch_ms(start_date), self._to_epoch_ms(end_date))
+        except Exception as e:
+            print(f'Error while getting moisture rollups: {e}')
+            return []
 
-                return True
-        except FileNotFoundError:
-            print(f'File not found: {self._log_messages_file}')
+        return [
+            {
+                "resolution": resolution.value,
+                "bucketStart": self._from_epoch_ms(_bucket_start_ms),
+                "min": _min,
+                "max": _max,
+                "sum": _sum,
+                "count": _count
+            }
+            for _bucket_start_ms, _min, _max, _sum, _count in _rows
+        ]
+
+    def get_sensor_history(self) -> SensorRingBuffer:
+        return self._sensor_history
+
+    def add_sensor_sample(self, sensor_id, value, timestamp) -> bool:
+        try:
+            return self._sensor_history.append(sensor_id, value, self._to_epoch_ms(timestamp))
+        except Exception as e:
+            print(f'Error while adding sensor sample: {e}')
             return False
 
+    def get_sensor_samples(self, sensor_id, start_date, end_date):
+        """Samples from the sensor history, or None when the history does not reach back to start_date."""
+        _start_ms = self._to_epoch_ms(start_date)
+        if not self._sensor_history.covers(_start_ms):
+            return None
+        return self._sensor_history.get_range(_start_ms, self._to_epoch_ms(end_date), sensor_id)
+
+    def set_moisture_sensor_absolute_values(self, absolute_dry, absolute_wet) -> bool:
+        _moisture_absolute_values = {
+            "absolute_dry": absolute_dry,
+            "absolute_wet": absolute_wet
+        }
+        return self._set_value(self._moisture_sensor_key, _moisture_absolute_values)
+
     def get_moisture_sensor_absolute_values(self):
-        try:
-            with (open(self._moisture_sensor_file, 'rb') as file):
-                _moisture_absolute_values = pickle.load(file)
-                if (_moisture_absolute_values is None
-                        or "absolute_dry" not in _moisture_absolute_values
-                        or "absolute_wet" not in _moisture_absolute_values):
-                    return None, None
-
-                return _moisture_absolute_values["absolute_dry"], _moisture_absolute_values["absolute_wet"]
-        except FileNotFoundError:
-            return None, None
-        except Exception as e:
-            print(f'Error while loading moisture sensor absolute values: {e}')
+        _moisture_absolute_values = self._get_value(self._moisture_sensor_key)
+        if (_moisture_absolute_values is None
+                or "absolute_dry" not in _moisture_absolute_values
+                or "absolute_wet" not in _moisture_absolute_values):
             return None, None
 
+        return _moisture_absolute_values["absolute_dry"], _moisture_absolute_values["absolute_wet"]
+
     def set_pump_capacity(self, _pump_capacity):
-        try:
-            with (open(self._pump_capacity_file, 'wb') as file):
-                pickle.dump(_pump_capacity, file)
-                return True
-        except FileNotFoundError:
-            print(f'File not found: {self._log_messages_file}')
-            return False
+        return self._set_value(self._pump_capacity_key, _pump_capacity)
 
     def get_pump_capacity(self):
-        try:
-            with (open(self._pump_capacity_file, 'rb') as file):
-                _pump_capacity = pickle.load(file)
-                if not isinstance(_pump_capacity, float) or _pump_capacity < 0:
-                    return None
-                return _pump_capacity
-        except FileNotFoundError:
+        _pump_capacity = self._get_value(self._pump_capacity_key)
+        if not isinstance(_pump_capacity, float) or _pump_capacity < 0:
             return None
-        except Exception as e:
-            print(f'Error while loading pump capacity: {e}')
+        return _pump_capacity
+
+    def set_supply_capacity(self, _supply_capacity):
+        return self._set_value(self._supply_capacity_key, _supply_capacity)
+
+    def get_supply_capacity(self):
+        """Liters per second the water supply can feed to all pumps together."""
+        _supply_capacity = self._get_value(self._supply_capacity_key)
+        if not isinstance(_supply_capacity, float) or _supply_capacity <= 0:
             return None
+        return _supply_capacity
 
-    def set_last_watering_time(self, timestamp, program_id):
-        try:
-            with open(self._last_watering_time_file, 'rb') as file:
-                data = {
-                    "program_id": program_id,
-                    "timestamp": timestamp
-                }
-                pickle.dump(data, file)
-                return True
-        except FileNotFoundError:
-            return False
-        except Exception as e:
-            print(f'Error while loading last watering times: {e}')
-            return False
+    def set_phone_protocol_version(self, version):
+        return self._set_value(self._phone_protocol_version_key, version)
 
-    def get_last_watering_time(self):
-        try:
-            with open(self._last_watering_time_file, 'rb') as file:
-                data = pickle.load(file)
-                if data is None or "program_id" not in data or "timestamp" not in data:
-                    return None, None
-                return data["program_id"], data["timestamp"]
-        except FileNotFoundError:
-            return None, None
-        except Exception as e:
-            print(f'Error while loading last watering times: {e}')
-            return None, None
+    def get_phone_protocol_version(self) -> int:
+        """The protocol the phone last announced, 1 for phones that never announced one."""
+        _version = self._get_value(self._phone_protocol_version_key)
+        if not isinstance(_version, int):
+            return 1
+        return _version
 
-    def set_depth_sensor_parameters(self, tank_volume_ratio, max_height):
-        try:
-            with (open(self._depth_sensor_file, 'wb') as file):
-                _depth_sensor_parameters = {
-                    "tank_volume_ratio": tank_volume_ratio,
-                    "max_height": max_height
-                }
-                pickle.dump(_depth_sensor_parameters, file)
+    def set_last_watering_time(self, timestamp, program_id):
+        data = dict(self.get_last_watering_times())
+        data[program_id] = timestamp
+        return self._set_value(self._last_watering_times_key, data)
+
+    def get_last_watering_times(self) -> dict:
+        """The last watering time of every program, by program id."""
+        data = self._get_value(self._last_watering_times_key)
+        if data is not None:
+            return data
+
+        # before zones only the program watered last was kept
+        data = self._get_value(self._last_watering_time_key)
+        if data is None or "program_id" not in data or "timestamp" not in data:
+            return {}
+        return {data["program_id"]: data["timestamp"]}
 
-                return True
-        except FileNotFoundError:
-            print(f'File not found: {self._log_messages_file}')
-            return False
-        except Exception as e:
-            print(f'Error while saving depth sensor parameters: {e}')
-            return False
+    def set_depth_sensor_parameters(self, tank_volume_ratio, max_height):
+        _depth_sensor_parameters = {
+            "tank_volume_ratio": tank_volume_ratio,
+            "max_height": max_height
+        }
+        return self._set_value(self._depth_sensor_key, _depth_sensor_parameters)
 
     def get_depth_sensor_parameters(self):
-        try:
-            with (open(self._depth_sensor_file, 'rb') as file):
-                _depth_sensor_parameters = pickle.load(file)
-                if (_depth_sensor_parameters is None
-                        or "tank_volume_ratio" not in _depth_sensor_parameters
-                        or "max_height" not in _depth_sensor_parameters):
-                    return None, None
-
-                return _depth_sensor_parameters["tank_volume_ratio"], _depth_sensor_parameters["max_height"]
-        except FileNotFoundError:
-            return None, None
-        except Exception as e:
-            print(f'Error while loading depth sensor parameters: {e}')
+        _depth_sensor_parameters = self._get_value(self._depth_sensor_key)
+        if (_depth_sensor_parameters is None
+                or "tank_volume_ratio" not in _depth_sensor_parameters
+                or "max_height" not in _depth_sensor_parameters):
             return None, None
+
+        return _depth_sensor_parameters["tank_volume_ratio"], _depth_sensor_parameters["max_height"]
@@ -0,0 +1,76 @@
+import bisect
+from datetime import datetime
+
+from domain.logging.LogMessage import LogMessage
+from domain.logging.MessageType import MessageType
+
+
+class LogIndex:
+    """Log messages sorted newest first, kept sorted as entries come in.
+
+    Entries are ordered by (-timestamp_ms, message), which also identifies them, so the same message
+    loaded from local storage and received in a snapshot is only kept once. Snapshots do not carry the
+    level, so the locally stored copy is kept whichever arrives first. Snapshot keys already seen are
+    skipped without being parsed.
+    """
+
+    def __init__(self):
+        self._sort_keys = []
+        self._log_messages = []
+        self._known_keys = set()
+
+    def get_log_messages(self) -> list[LogMessage]:
+        return self._log_messages
+
+    def reset(self, log_messages: list[LogMessage]):
+        self._sort_keys = []
+        self._log_messages = []
+        self._known_keys = set()
+        self.insert_all(log_messages)
+
+    def insert_all(self, log_messages: list[LogMessage]) -> list[tuple[int, LogMessage]]:
+        _inserted = []
+        for log_message in log_messages:
+            _index = self.insert(log_message)
+            if _index is not None:
+                _inserted.append((_index, log_message))
+        return _inserted
+
+    def insert(self, log_message: LogMessage) -> int | None:
+        """Returns the index the message was inserted at, or None if it was already there."""
+        _sort_key = (-int(log_message.get_timestamp().timestamp() * 1000), log_message.get_message())
+        _index = bisect.bisect_left(self._sort_keys, _sort_key)
+        if _index < len(self._sort_keys) and self._sort_keys[_index] == _sort_key:
+            # a copy from a snapshot is replaced by the stored one, which has the real level; the row
+            # shown for it does not change
+            if self._log_messages[_index].get_level() == MessageType.ANY and log_message.get_level() != MessageType.ANY:
+                self._log_messages[_index] = log_message
+            return None
+
+        self._sort_keys.insert(_index, _sort_key)
+        self._log_messages.insert(_index, log_message)
+        return _index
+
+    def merge(self, log_messages: dict) -> tuple[dict, list[tuple[int, LogMessage]]]:
+        """Adds the entries of a Firestore messages map whose keys were not seen before.
+
+        Returns the new part of the map and the (index, LogMessage) insertions, in the order they were
+        made, so applying them one after the other to a copy of the old list gives the new one.
+        """
+        _new_keys = log_messages.keys() - self._known_keys
+        if len(_new_keys) == 0:
+            return {}, []
+        self._known_keys.update(_new_keys)
+
+        _new_log_messages = {}
+        _parsed = []
+        for key in _new_keys:
+            _new_log_messages[key] = log_messages[key]
+            try:
+                # the keys are str(datetime), a fixed format fromisoformat parses in C
+                _parsed.append(LogMessage(log_messages[key], MessageType.ANY, datetime.fromisoformat(key)))
+            except ValueError:
+                print(f'Skipping log message with an invalid timestamp: {key}')
+
+        _parsed.sort(key=lambda log_message: log_message.get_timestamp().timestamp(), reverse=True)
+        return _new_log_messages, self.insert_all(_parsed)
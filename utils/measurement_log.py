@@ -0,0 +1,301 @@
+import bisect
+import os
+import struct
+import threading
+import zlib
+
+
+class MeasurementLog:
+    """Append-only, segmented log of timestamped measurements.
+
+    Every record is stored as a length-prefixed frame (payload length, crc32, payload)
+    so a torn write at the end of the last segment can be detected and cut off on open.
+    The payload holds the epoch-ms timestamp, the measured value and the raspberry id.
+
+    Records must be appended in non-decreasing timestamp order, which lets a sparse
+    in-memory index (the first record of each segment plus every Nth record) locate
+    the start of a time range without scanning the whole history.
+    """
+
+    _FRAME_HEADER = struct.Struct('<II')  # payload length, crc32
+    _RECORD_FIXED = struct.Struct('<qd')  # timestamp ms, value
+    _INDEX_ENTRY = struct.Struct('<qQ')  # timestamp ms, offset in segment
+
+    _SEGMENT_SUFFIX = '.seg'
+    _INDEX_SUFFIX = '.idx'
+
+    def __init__(self, directory, segment_max_bytes=256 * 1024, index_interval=64):
+        self._directory = directory
+        self._segment_max_bytes = segment_max_bytes
+        self._index_interval = index_interval
+
+        self._lock = threading.Lock()
+
+        # sparse index, kept sorted by timestamp: parallel lists of ts and (segment, offset)
+        self._index_timestamps = []
+        self._index_positions = []
+
+        self._segments = []
+        self._active_file = None
+        self._active_size = 0
+        self._records_since_index = 0
+        self._last_timestamp_ms = None
+        self._count = 0
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._open()
+
+    def _segment_path(self, segment_no):
+        return os.path.join(self._directory, f'{segment_no:08d}{self._SEGMENT_SUFFIX}')
+
+    def _index_path(self, segment_no):
+        return os.path.join(self._directory, f'{segment_no:08d}{self._INDEX_SUFFIX}')
+
+    def _open(self):
+        self._segments = sorted(
+            int(name[:-len(self._SEGMENT_SUFFIX)])
+            for name in os.listdir(self._directory)
+            if name.endswith(self._SEGMENT_SUFFIX)
+        )
+
+        for segment_no in self._segments:
+            self._load_segment(segment_no, is_last=segment_no == self._segments[-1])
+
+        if len(self._segments) == 0:
+            self._segments.append(1)
+
+        _active_segment = self._segments[-1]
+        self._active_file = open(self._segment_path(_active_segment), 'ab')
+        self._active_size = self._active_file.tell()
+
+    def _load_segment(self, segment_no, is_last):
+        _segment_size = os.path.getsize(self._segment_path(segment_no))
+        _index_entries = self._read_index_file(segment_no)
+
+        if len(_index_entries) > 0 and _index_entries[-1][1] < _segment_size:
+            # only the records after the last index point need to be walked
+            _, _tail_count, _last_ts, _valid_size = self._scan_segment(segment_no, _index_entries[-1][1])
+            _count = (len(_index_entries) - 1) * self._index_interval + _tail_count
+        else:
+            # missing or stale index file, rebuild it from the segment itself
+            _index_entries, _count, _last_ts, _valid_size = self._scan_segment(segment_no, 0)
+            self._rewrite_index_file(segment_no, _index_entries)
+
+        if is_last:
+            if _valid_size < _segment_size:
+                print(f'Truncating torn write in measurement log segment {segment_no}')
+                with open(self._segment_path(segment_no), 'r+b') as file:
+                    file.truncate(_valid_size)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            if len(_index_entries) > 0:
+                self._records_since_index = _count - (len(_index_entries) - 1) * self._index_interval
+
+        for _timestamp_ms, _offset in _index_entries:
+            self._index_timestamps.append(_timestamp_ms)
+            self._index_positions.append((segment_no, _offset))
+
+        if _last_ts is not None:
+            self._last_timestamp_ms = _last_ts
+        self._count += _count
+
+    def _read_index_file(self, segment_no):
+        try:
+            with open(self._index_path(segment_no), 'rb') as file:
+                _data = file.read()
+        except FileNotFoundError:
+            return []
+
+        _usable = len(_data) - len(_data) % self._INDEX_ENTRY.size
+        return [self._INDEX_ENTRY.unpack_from(_data, _pos)
+                for _pos in range(0, _usable, self._INDEX_ENTRY.size)]
+
+    def _rewrite_index_file(self, segment_no, index_entries):
+        with open(self._index_path(segment_no), 'wb') as file:
+            for _timestamp_ms, _offset in index_entries:
+                file.write(self._INDEX_ENTRY.pack(_timestamp_ms, _offset))
+
+    def _scan_segment(self, segment_no, start_offset):
+        """Walks the frames of a segment starting at a frame boundary.
+
+        Returns the index entries that should exist for the walked frames, the number of
+        valid frames, the last timestamp seen and the offset right after the last valid frame.
+        """
+        with open(self._segment_path(segment_no), 'rb') as file:
+            file.seek(start_offset)
+            _data = file.read()
+
+        _index_entries = []
+        _count = 0
+        _last_ts = None
+        _pos = 0
+
+        while _pos + self._FRAME_HEADER.size <= len(_data):
+            _length, _crc = self._FRAME_HEADER.unpack_from(_data, _pos)
+            _payload_start = _pos + self._FRAME_HEADER.size
+            _payload = _data[_payload_start:_payload_start + _length]
+
+            if _length < self._RECORD_FIXED.size or len(_payload) < _length or zlib.crc32(_payload) != _crc:
+                break
+
+            _last_ts, _ = self._RECORD_FIXED.unpack_from(_payload, 0)
+            if _count % self._index_interval == 0:
+                _index_entries.append((_last_ts, start_offset + _pos))
+
+            _count += 1
+            _pos = _payload_start + _length
+
+        return _index_entries, _count, _last_ts, start_offset + _pos
+
+    def __len__(self):
+        return self._count
+
+    def get_last_timestamp_ms(self):
+        return self._last_timestamp_ms
+
+    def append(self, timestamp_ms, value, raspberry_id=''):
+        """Appends one record and fsyncs it. Returns False if the record is older than the tail."""
+        return self.append_all([(timestamp_ms, value, raspberry_id)]) == 1
+
+    def append_all(self, records) -> int:
+        """Appends (timestamp_ms, value, raspberry_id) records with a single fsync.
+
+        Records older than the tail are skipped. Returns how many were appended.
+        """
+        _appended = 0
+        _index_entries = []
+        with self._lock:
+            for timestamp_ms, value, raspberry_id in records:
+                if self._last_timestamp_ms is not None and timestamp_ms < self._last_timestamp_ms:
+                    continue
+                _index_entry = self._write_record(timestamp_ms, value, raspberry_id)
+                if _index_entry is not None:
+                    _index_entries.append(_index_entry)
+                _appended += 1
+
+            if _appended > 0:
+                self._active_file.flush()
+                os.fsync(self._active_file.fileno())
+
+            # indexed only once the records are on disk, so the index never points past them
+            for _timestamp_ms, _segment_no, _offset in _index_entries:
+                self._add_index_entry(_timestamp_ms, _segment_no, _offset)
+        return _appended
+
+    def _write_record(self, timestamp_ms, value, raspberry_id):
+        _payload = self._RECORD_FIXED.pack(int(timestamp_ms), float(value)) + raspberry_id.encode('utf-8')
+        _frame = self._FRAME_HEADER.pack(len(_payload), zlib.crc32(_payload)) + _payload
+
+        if self._active_size > 0 and self._active_size + len(_frame) > self._segment_max_bytes:
+            self._roll_segment()
+
+        _offset = self._active_size
+        self._active_file.write(_frame)
+        self._active_size += len(_frame)
+
+        _index_entry = None
+        if _offset == 0 or self._records_since_index >= self._index_interval:
+            _index_entry = (int(timestamp_ms), self._segments[-1], _offset)
+            self._records_since_index = 0
+
+        self._records_since_index += 1
+        self._last_timestamp_ms = int(timestamp_ms)
+        self._count += 1
+        return _index_entry
+
+    def _roll_segment(self):
+        self._active_file.flush()
+        os.fsync(self._active_file.fileno())
+        self._active_file.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._active_file = open(self._segment_path(self._segments[-1]), 'ab')
+        self._active_size = 0
+
+    def _add_index_entry(self, timestamp_ms, segment_no, offset):
+        # the index file is only a hint that can be rebuilt, so it is not fsynced
+        with open(self._index_path(segment_no), 'ab') as file:
+            file.write(self._INDEX_ENTRY.pack(timestamp_ms, offset))
+
+        self._index_timestamps.append(timestamp_ms)
+        self._index_positions.append((segment_no, offset))
+
+    def read_range(self, start_ms=None, end_ms=None):
+        """Returns (timestamp_ms, value, raspberry_id) tuples with start_ms <= timestamp <= end_ms."""
+        with self._lock:
+            if self._count == 0:
+                return []
+
+            if start_ms is None or len(self._index_timestamps) == 0:
+                _index_pos = 0
+            else:
+                # the last index point strictly before start_ms; equal timestamps may precede it
+                _index_pos = max(bisect.bisect_left(self._index_timestamps, start_ms) - 1, 0)
+
+            if len(self._index_positions) > 0:
+                _segment_no, _offset = self._index_positions[_index_pos]
+            else:
+                _segment_no, _offset = self._segments[0], 0
+
+            _segments_to_read = [segment for segment in self._segments if segment >= _segment_no]
+            _active_size = self._active_size
+
+        _result = []
+        for _segment in _segments_to_read:
+            if not self._read_segment_range(_segment, _offset, start_ms, end_ms, _result,
+                                            _active_size if _segment == _segments_to_read[-1] else None):
+                break
+            _offset = 0
+
+        return _result
+
+    def _read_segment_range(self, segment_no, offset, start_ms, end_ms, result, size_limit):
+        try:
+            with open(self._segment_path(segment_no), 'rb') as file:
+                file.seek(offset)
+                _data = file.read() if size_limit is None else file.read(max(size_limit - offset, 0))
+        except FileNotFoundError:
+            return True
+
+        _pos = 0
+        while _pos + self._FRAME_HEADER.size <= len(_data):
+            _length, _ = self._FRAME_HEADER.unpack_from(_data, _pos)
+            _payload_start = _pos + self._FRAME_HEADER.size
+            if _payload_start + _length > len(_data):
+                break
+
+            _timestamp_ms, _value = self._RECORD_FIXED.unpack_from(_data, _payload_start)
+            _pos = _payload_start + _length
+
+            if end_ms is not None and _timestamp_ms > end_ms:
+                return False
+            if start_ms is not None and _timestamp_ms < start_ms:
+                continue
+
+            _raspberry_id = _data[_payload_start + self._RECORD_FIXED.size:_pos].decode('utf-8')
+            result.append((_timestamp_ms, _value, _raspberry_id))
+
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._active_file.close()
+
+            for name in os.listdir(self._directory):
+                if name.endswith(self._SEGMENT_SUFFIX) or name.endswith(self._INDEX_SUFFIX):
+                    os.remove(os.path.join(self._directory, name))
+
+            self._index_timestamps = []
+            self._index_positions = []
+            self._segments = [1]
+            self._active_file = open(self._segment_path(1), 'ab')
+            self._active_size = 0
+            self._records_since_index = 0
+            self._last_timestamp_ms = None
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
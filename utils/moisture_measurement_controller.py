@@ -1,12 +1,17 @@
 import threading
 from datetime import datetime
 
+from utils.async_runtime import run_blocking
 from utils.datetime_utils import get_current_datetime_tz
 from utils.event_logger import EventLogger
 from utils.firebase_controller import FirebaseController
 from utils.get_rasp_uuid import getserial
+from utils.local_storage_controller import LocalStorageController
 from utils.moisture_controller import MoistureController
 from utils.remote_requests import RemoteRequests
+from utils.scheduler import Scheduler
+from utils.sensor_ring_buffer import SensorRingBuffer
+from utils.water_depth_measurement_controller import WaterDepthMeasurementController
 
 
 class MoistureMeasurementController:
@@ -29,12 +34,17 @@ class MoistureMeasurementController:
 
         self._moisture_controller = MoistureController(channel=1)
 
-        self._moisture_check_thread = None
-        self._moisture_check_thread_finished = threading.Event()
+        self._moisture_check_job = None
+
+        self._diagnostic_sampling_interval_sec = None
+        self._diagnostic_sampling_job = None
 
     def get_current_moisture_percentage(self):
         return self._moisture_controller.get_moisture_percentage()
 
+    async def get_current_moisture_percentage_async(self):
+        return await run_blocking(self._moisture_controller.get_moisture_percentage)
+
     def get_moisture_check_interval_sec(self):
         return self._moisture_check_interval_sec
 
@@ -43,18 +53,16 @@ class MoistureMeasurementController:
 
         self._moisture_check_interval_sec = interval_sec
 
-        self._moisture_check_thread = threading.Thread(
-            target=self._moisture_check_thread_function,
-            daemon=True
+        self._moisture_check_job = Scheduler().schedule_fixed_rate(
+            self._moisture_check_thread_function,
+            self._moisture_check_interval_sec,
+            name="moisture_check"
         )
 
-        self._moisture_check_thread.start()
-
     def _stop_moisture_check_thread(self):
-        self._moisture_check_thread_finished.set()
-        if self._moisture_check_thread is not None:
-            self._moisture_check_thread.join()
-        self._moisture_check_thread_finished.clear()
+        if self._moisture_check_job is not None:
+            self._moisture_check_job.cancel(wait=True)
+            self._moisture_check_job = None
 
     def _moisture_check_thread_function(self):
         _moisture_perc = self._moisture_controller.get_moisture_percentage()
@@ -63,13 +71,34 @@ class MoistureMeasurementController:
         RemoteRequests().add_moisture_percentage_measurement(_moisture_perc, _measurement_time)
         EventLogger().add_moisture_measurement_message(_moisture_perc, _measurement_time)
 
-        while not self._moisture_check_thread_finished.is_set():
-            self._moisture_check_thread_finished.wait(self._moisture_check_interval_sec)
-            if self._moisture_check_thread_finished.is_set():
-                return
+    def start_diagnostic_sampling(self, interval_sec=5):
+        """Records moisture and water tank level into the local sensor history every few seconds."""
+        self.stop_diagnostic_sampling()
 
-            _moisture_perc = self._moisture_controller.get_moisture_percentage()
-            _measurement_time = get_current_datetime_tz()
+        self._diagnostic_sampling_interval_sec = interval_sec
+
+        self._diagnostic_sampling_job = Scheduler().schedule_fixed_rate(
+            self._sample_sensors_for_diagnostics,
+            self._diagnostic_sampling_interval_sec,
+            name="diagnostic_sampling"
+        )
 
-            RemoteRequests().add_moisture_percentage_measurement(_moisture_perc, _measurement_time)
-            EventLogger().add_moisture_measurement_message(_moisture_perc, _measurement_time)
+    def stop_diagnostic_sampling(self):
+        if self._diagnostic_sampling_job is not None:
+            self._diagnostic_sampling_job.cancel(wait=True)
+            self._diagnostic_sampling_job = None
+
+    def _sample_sensors_for_diagnostics(self):
+        try:
+            LocalStorageController().add_sensor_sample(
+                SensorRingBuffer.SENSOR_MOISTURE,
+                self._moisture_controller.get_moisture_percentage(),
+                get_current_datetime_tz()
+            )
+            LocalStorageController().add_sensor_sample(
+                SensorRingBuffer.SENSOR_WATER_TANK,
+                WaterDepthMeasurementController().get_current_water_volume(),
+                get_current_datetime_tz()
+            )
+        except Exception as e:
+            print(f'Error while sampling sensors: {e}')
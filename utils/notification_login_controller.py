@@ -8,6 +8,7 @@ from utils.firebase_controller import FirebaseController
 from utils.get_rasp_uuid import getserial
 from utils.raspberry_controller import RaspberryController
 from utils.remote_requests import RemoteRequests
+from utils.scheduler import Scheduler
 
 
 class NotificationLoginController:
@@ -33,8 +34,7 @@ class NotificationLoginController:
         self._login_page_on_try_login_callback = None
 
         self._retry_login_notification_delay_seconds = 60 * 60 * 1  # 1 hour
-        self._retry_login_notification_event = threading.Event()
-        self._retry_login_notification_thread = None
+        self._retry_login_notification_job = None
 
         self._start_retry_login_notification_thread()
 
@@ -132,25 +132,20 @@ class NotificationLoginController:
         self._connect_to_ws(self._ws_code)
 
     def _stop_retry_login_notification_thread(self):
-        self._retry_login_notification_event.set()
-        if self._retry_login_notification_thread is not None:
-            self._retry_login_notification_thread.join()
-        self._retry_login_notification_event.clear()
+        if self._retry_login_notification_job is not None:
+            self._retry_login_notification_job.cancel(wait=True)
+            self._retry_login_notification_job = None
 
     def _start_retry_login_notification_thread(self):
         self._stop_retry_login_notification_thread()
-        self._retry_login_notification_thread = threading.Thread(
-            target=self._retry_login_notification,
-            daemon=True
+        self._retry_login_notification_job = Scheduler().schedule_fixed_delay(
+            self._retry_login_notification,
+            self._retry_login_notification_delay_seconds,
+            initial_delay_sec=self._retry_login_notification_delay_seconds,
+            name="retry_login_notification"
         )
-        self._retry_login_notification_thread.start()
 
     def _retry_login_notification(self):
-        while not self._retry_login_notification_event.is_set():
-            self._retry_login_notification_event.wait(self._retry_login_notification_delay_seconds)
-            if self._retry_login_notification_event.is_set():
-                return
-
-            if not FirebaseController().is_logged_in():
-                self._is_logged_in.clear()
-                self.try_send_login_notification()
+        if not FirebaseController().is_logged_in():
+            self._is_logged_in.clear()
+            self.try_send_login_notification()
@@ -0,0 +1,246 @@
+import os
+import shutil
+from datetime import datetime
+
+from utils import record_codec
+from utils.measurement_log import MeasurementLog
+from utils.storage_backend import StorageBackend
+
+
+class PickleStorageBackend(StorageBackend):
+    """The original on-disk layout: one file per key in the working directory.
+
+    Files are written as record_codec records; files still holding a pickle are read with the
+    restricted legacy loader and rewritten as records on first read.
+
+    Measurements go to the append-only MeasurementLog and log messages are kept as a single
+    pickled dict, as they always were, so their level is not kept and pages are filtered in memory.
+    Kept so existing devices can be migrated on first boot.
+    """
+
+    def __init__(self, directory='.', moisture_log_directory='moisture_log', log_messages_key='log_messages'):
+        self._directory = directory
+        self._moisture_log_directory = moisture_log_directory
+        self._log_messages_key = log_messages_key
+        self._legacy_moisture_info_file = 'moisture_info'
+        self._moisture_log = None
+
+    def _path(self, key):
+        return os.path.join(self._directory, key)
+
+    def _get_moisture_log(self) -> MeasurementLog:
+        if self._moisture_log is None:
+            self._recover_merged_moisture_log()
+            self._moisture_log = MeasurementLog(os.path.join(self._directory, self._moisture_log_directory))
+            self._migrate_moisture_info_file()
+        return self._moisture_log
+
+    def _migrate_moisture_info_file(self):
+        if not os.path.exists(self._path(self._legacy_moisture_info_file)):
+            return
+
+        try:
+            with open(self._path(self._legacy_moisture_info_file), 'rb') as file:
+                # streamed, so only the compact tuples are held and not every measurement dict
+                _measurements = [
+                    (
+                        int(measurement["measurementTime"].timestamp() * 1000),
+                        measurement["measurementValuePercent"],
+                        measurement.get("raspberryId", "")
+                    )
+                    for measurement in record_codec.iter_decode(file.read())
+                ]
+
+            # sorted and written with a single fsync
+            self.append_measurements(_measurements)
+
+            os.remove(self._path(self._legacy_moisture_info_file))
+        except Exception as e:
+            print(f'Error while migrating moisture info file: {e}')
+
+    def has_data(self, keys) -> bool:
+        return (any(os.path.exists(self._path(key)) for key in keys)
+                or os.path.exists(self._path(self._legacy_moisture_info_file))
+                or os.path.isdir(os.path.join(self._directory, self._moisture_log_directory)))
+
+    def get_value(self, key, default=None):
+        try:
+            with open(self._path(key), 'rb') as file:
+                _data = file.read()
+        except FileNotFoundError:
+            return default
+
+        _value = record_codec.decode(_data)
+        if not record_codec.is_record(_data):
+            self.set_value(key, _value)
+        return _value
+
+    def set_value(self, key, value) -> None:
+        with open(self._path(key), 'wb') as file:
+            file.write(record_codec.encode(value))
+
+    def write_batch(self, values: dict, deleted_keys: list, log_entries: list[tuple]) -> None:
+        _values = dict(values)
+        if len(log_entries) > 0:
+            _log_messages = self.get_value(self._log_messages_key, {})
+            for _key, _timestamp_ms, _message, _level in log_entries:
+                _log_messages[_key] = _message
+            _values[self._log_messages_key] = _log_messages
+
+        # every file is written to a temporary name and renamed over the old one, so a crash
+        # leaves either the old or the new version; the directory is synced once for all renames
+        for key, value in _values.items():
+            _temp_path = self._path(key) + '.tmp'
+            with open(_temp_path, 'wb') as file:
+                file.write(record_codec.encode(value))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(_temp_path, self._path(key))
+
+        for key in deleted_keys:
+            self.delete_value(key)
+
+        _directory_fd = os.open(self._directory, os.O_RDONLY)
+        try:
+            os.fsync(_directory_fd)
+        finally:
+            os.close(_directory_fd)
+
+    def delete_value(self, key) -> None:
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def append_measurement(self, timestamp_ms, value, raspberry_id) -> bool:
+        _moisture_log = self._get_moisture_log()
+
+        # the log is append-only, anything not newer than its tail is already stored
+        _last_timestamp_ms = _moisture_log.get_last_timestamp_ms()
+        if _last_timestamp_ms is not None and timestamp_ms <= _last_timestamp_ms:
+            return False
+
+        return _moisture_log.append(timestamp_ms, value, raspberry_id)
+
+    def append_measurements(self, measurements: list[tuple]) -> None:
+        _moisture_log = self._get_moisture_log()
+        _measurements = self._drop_duplicate_measurements(measurements)
+        if len(_measurements) == 0:
+            return
+
+        # fetched measurements are often already stored, only the missing ones are added
+        _stored = {(timestamp_ms, raspberry_id) for timestamp_ms, _, raspberry_id
+                   in _moisture_log.read_range(_measurements[0][0], _measurements[-1][0])}
+        _measurements = [measurement for measurement in _measurements
+                         if (measurement[0], measurement[2]) not in _stored]
+        if len(_measurements) == 0:
+            return
+
+        _last_timestamp_ms = _moisture_log.get_last_timestamp_ms()
+        if _last_timestamp_ms is None or _measurements[0][0] > _last_timestamp_ms:
+            _moisture_log.append_all(_measurements)
+            return
+
+        # a backfill older than the tail can not be appended, the log is rewritten with it merged in
+        self._merge_measurements(_measurements)
+
+    @staticmethod
+    def _drop_duplicate_measurements(measurements):
+        _records = {}
+        for timestamp_ms, value, raspberry_id in measurements:
+            _records.setdefault((timestamp_ms, raspberry_id), (timestamp_ms, value, raspberry_id))
+        return sorted(_records.values())
+
+    def _merge_measurements(self, measurements):
+        _directory = os.path.join(self._directory, self._moisture_log_directory)
+        _merged_directory = _directory + '.merged'
+        _old_directory = _directory + '.old'
+
+        # the stored record wins over a fetched one with the same timestamp and raspberry id
+        _records = self._drop_duplicate_measurements(self._moisture_log.read_range() + measurements)
+
+        shutil.rmtree(_merged_directory, ignore_errors=True)
+        _merged_log = MeasurementLog(_merged_directory)
+        _merged_log.append_all(_records)
+        _merged_log.close()
+
+        # the complete merged log is swapped in with renames, _recover_merged_moisture_log finishes an
+        # interrupted swap
+        self._moisture_log.close()
+        shutil.rmtree(_old_directory, ignore_errors=True)
+        os.rename(_directory, _old_directory)
+        os.rename(_merged_directory, _directory)
+        shutil.rmtree(_old_directory)
+        self._moisture_log = MeasurementLog(_directory)
+
+    def _recover_merged_moisture_log(self):
+        _directory = os.path.join(self._directory, self._moisture_log_directory)
+        if not os.path.isdir(_directory) and os.path.isdir(_directory + '.merged'):
+            os.rename(_directory + '.merged', _directory)
+
+    def get_measurements(self, start_ms=None, end_ms=None) -> list[tuple]:
+        return self._get_moisture_log().read_range(start_ms, end_ms)
+
+    def add_log_messages(self, entries: list[tuple]) -> None:
+        _log_messages = self.get_value(self._log_messages_key, {})
+        for _key, _timestamp_ms, _message, _level in entries:
+            _log_messages[_key] = _message
+        self.set_value(self._log_messages_key, _log_messages)
+
+    def replace_log_messages(self, entries: list[tuple]) -> None:
+        self.set_value(self._log_messages_key, {_key: _message for _key, _timestamp_ms, _message, _level in entries})
+
+    def get_log_messages(self) -> dict:
+        return {str(key): value for key, value in self.get_value(self._log_messages_key, {}).items()}
+
+    def _get_log_rows(self) -> list[tuple]:
+        _rows = []
+        for key, message in self.get_log_messages().items():
+            try:
+                _timestamp_ms = int(datetime.fromisoformat(key).timestamp() * 1000)
+            except ValueError:
+                _timestamp_ms = 0
+            _rows.append((key, _timestamp_ms, message, 'ANY'))
+        return sorted(_rows, key=lambda row: (row[1], row[0]))
+
+    def get_log_page(self, limit, level=None, start_ms=None, end_ms=None, cursor=None, newer=False) -> list[tuple]:
+        if level is not None and level != 'ANY':
+            return []
+
+        _rows = [
+            row for row in self._get_log_rows()
+            if (start_ms is None or row[1] >= start_ms) and (end_ms is None or row[1] <= end_ms)
+        ]
+
+        if newer:
+            _page = [row for row in _rows if cursor is None or (row[1], row[0]) > tuple(cursor)]
+        else:
+            _page = [row for row in reversed(_rows) if cursor is None or (row[1], row[0]) < tuple(cursor)]
+        return _page[:limit]
+
+    def prune_log_messages(self, max_entries, min_timestamp_ms) -> int:
+        _rows = self._get_log_rows()
+        _kept = [row for row in _rows if row[1] >= min_timestamp_ms][-max_entries:] if max_entries > 0 else []
+        if len(_kept) < len(_rows):
+            self.replace_log_messages(_kept)
+        return len(_rows) - len(_kept)
+
+    def clear_measurements(self) -> None:
+        self.delete_value(self._legacy_moisture_info_file)
+        self._get_moisture_log().clear()
+
+    def remove_files(self, keys) -> None:
+        for key in keys:
+            self.delete_value(key)
+
+        self.delete_value(self._legacy_moisture_info_file)
+
+        _moisture_log_path = os.path.join(self._directory, self._moisture_log_directory)
+        if os.path.isdir(_moisture_log_path):
+            self._get_moisture_log().close()
+            for name in os.listdir(_moisture_log_path):
+                os.remove(os.path.join(_moisture_log_path, name))
+            os.rmdir(_moisture_log_path)
+            self._moisture_log = None
+
+    def close(self) -> None:
+        if self._moisture_log is not None:
+            self._moisture_log.close()
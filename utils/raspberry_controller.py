@@ -6,6 +6,7 @@ from domain.RaspberryInfo import RaspberryInfoBuilder, RaspberryInfo
 from domain.logging.MessageType import MessageType
 from domain.observer.ObserverNotificationType import ObserverNotificationType
 from domain.observer.Observer import Observer
+from utils.async_runtime import run_blocking
 from utils.datetime_utils import get_current_datetime_tz
 from utils.event_logger import EventLogger
 from utils.firebase_controller import FirebaseController
@@ -14,6 +15,7 @@ from utils.local_storage_controller import LocalStorageController
 from utils.moisture_controller import MoistureController
 from utils.pump_controller import PumpController
 from utils.remote_requests import RemoteRequests
+from utils.scheduler import Scheduler
 from utils.water_depth_measurement_controller import WaterDepthMeasurementController
 
 
@@ -44,8 +46,7 @@ class RaspberryController(Observer):
         self.watering_time = 0  # seconds
         self.liters_sent = 0  # liters
         self.watering_time_start = 0  # time
-        self._send_watering_updates_thread = None
-        self._send_watering_updates_event = threading.Event()
+        self._send_watering_updates_job = None
         self._while_watering_callback_function = None
 
         self.raspberry_id = getserial()
@@ -71,6 +72,9 @@ class RaspberryController(Observer):
     def get_moisture_percentage(self):
         return self.moisture_controller.get_moisture_percentage()
 
+    async def get_moisture_percentage_async(self):
+        return await run_blocking(self.moisture_controller.get_moisture_percentage)
+
     def check_need_for_watering(self):
         if self.get_moisture_percentage() < self._watering_program.get_min_moisture():
             self.pump_controller.start_watering_for_liters(self._watering_program.get_liters_needed())
@@ -108,6 +112,9 @@ class RaspberryController(Observer):
             self._send_stop_watering_message()
             return False
 
+        # persist any staged settings before the pump draws power
+        LocalStorageController().flush()
+
         if self.pump_controller.start_watering():
             self.start_sending_watering_updates()
             self._watering_manually = True
@@ -141,6 +148,8 @@ class RaspberryController(Observer):
             self._log_no_water_in_tank()
             return False
 
+        LocalStorageController().flush()
+
         self.start_sending_watering_updates()
         self.pump_controller.start_watering_for_liters(liters)
         self.stop_sending_watering_updates()
@@ -154,56 +163,55 @@ class RaspberryController(Observer):
     def start_listening_for_watering_now(self):
         RemoteRequests().add_watering_now_listener(callback=self._watering_now_callback_for_incoming_messages)
 
-    def _watering_now_callback_for_incoming_messages(self, doc_snapshot, changes, read_time):
-        for change in changes:
-            changed_doc = change.document
-            updated_data = changed_doc.to_dict()
-
-            print("Watering callback updated data: ", updated_data)
-
-            # check for moisture request
-            if "soilMoisture" in updated_data.keys():
-                if "REQUEST" in str(updated_data["soilMoisture"]):
-                    print("Sending moisture info")
-                    self._send_moisture_info()
-
-            if "waterTankVolume" in updated_data.keys():
-                if "REQUEST" in str(updated_data["waterTankVolume"]):
-                    print("Sending water volume info")
-                    self._send_water_tank_volume_info()
-
-            # check for watering now command
-            if "command" in updated_data.keys():
-                print("Is watering:", self.pump_controller.is_watering)
-                if updated_data["command"] == "start_watering" and not self.pump_controller.is_watering:
-                    RemoteRequests().update_watering_info('processing', 0.0, 0)
-                    self.start_watering()
-
-                elif updated_data["command"] == "stop_watering" and self.pump_controller.is_watering:
-                    self.manual_stop_watering()
-                    if self._while_watering_callback_function is not None:
-                        self._while_watering_callback_function(
-                            is_watering=self.pump_controller.is_watering,
-                            watering_time=round(self.watering_time),
-                            liters_sent=round(self.liters_sent, 2)
-                        )
-
-                    # if not self.pump_controller.is_watering:
-                    #     return
-                    #
-                    # self.pump_controller.stop_watering()
-                    # self.stop_sending_watering_updates()
-                    #
-                    # if self._while_watering_callback_function is not None:
-                    #     self._while_watering_callback_function(
-                    #         is_watering=self.pump_controller.is_watering,
-                    #         watering_time=round(self.watering_time),
-                    #         liters_sent=round(self.liters_sent, 2)
-                    #     )
-                    #
-                    # self._log_manual_watering_cycle()
-                else:
-                    print("Current data: null")
+    def _watering_now_callback_for_incoming_messages(self, updated_data):
+        print("Watering callback updated data: ", updated_data)
+
+        if "ping" in updated_data.keys():
+            FirebaseController().answer_to_ping(updated_data["ping"])
+
+        # check for moisture request
+        if "soilMoisture" in updated_data.keys():
+            if "REQUEST" in str(updated_data["soilMoisture"]):
+                print("Sending moisture info")
+                self._send_moisture_info()
+
+        if "waterTankVolume" in updated_data.keys():
+            if "REQUEST" in str(updated_data["waterTankVolume"]):
+                print("Sending water volume info")
+                self._send_water_tank_volume_info()
+
+        # check for watering now command
+        if "command" in updated_data.keys():
+            print("Is watering:", self.pump_controller.is_watering)
+            if updated_data["command"] == "start_watering" and not self.pump_controller.is_watering:
+                RemoteRequests().update_watering_info('processing', 0.0, 0)
+                self.start_watering()
+
+            elif updated_data["command"] == "stop_watering" and self.pump_controller.is_watering:
+                self.manual_stop_watering()
+                if self._while_watering_callback_function is not None:
+                    self._while_watering_callback_function(
+                        is_watering=self.pump_controller.is_watering,
+                        watering_time=round(self.watering_time),
+                        liters_sent=round(self.liters_sent, 2)
+                    )
+
+                # if not self.pump_controller.is_watering:
+                #     return
+                #
+                # self.pump_controller.stop_watering()
+                # self.stop_sending_watering_updates()
+                #
+                # if self._while_watering_callback_function is not None:
+                #     self._while_watering_callback_function(
+                #         is_watering=self.pump_controller.is_watering,
+                #         watering_time=round(self.watering_time),
+                #         liters_sent=round(self.liters_sent, 2)
+                #     )
+                #
+                # self._log_manual_watering_cycle()
+            else:
+                print("Current data: null")
 
     def stop_listening_for_watering_now(self):
         RemoteRequests().unsubscribe_watering_now_listener()
@@ -211,30 +219,25 @@ class RaspberryController(Observer):
     def start_sending_watering_updates(self):
         self._watering_cycle_start_time = get_current_datetime_tz()
 
-        self._send_watering_updates_event.clear()
-        self._send_watering_updates_thread = threading.Thread(target=self._send_watering_updates_worker, daemon=True)
-        self._send_watering_updates_thread.start()
+        self.watering_time_start = time.time()
+        _interval_sec = self._send_watering_updates_interval_ms / 1000.0
+        self._send_watering_updates_job = Scheduler().schedule_fixed_rate(
+            self._send_watering_update_function,
+            _interval_sec,
+            initial_delay_sec=_interval_sec,
+            name="send_watering_updates"
+        )
 
     def stop_sending_watering_updates(self):
         self.watering_time = time.time() - self.watering_time_start  # seconds
         self.liters_sent = self.watering_time * self.pump_controller.pump_capacity  # seconds * liters/second -> liters
 
-        self._send_watering_updates_event.set()
-        if self._send_watering_updates_thread is not None and self._send_watering_updates_thread.is_alive():
-            self._send_watering_updates_thread.join()
+        if self._send_watering_updates_job is not None:
+            self._send_watering_updates_job.cancel(wait=True)
+            self._send_watering_updates_job = None
 
         self._update_info_for_watering_callback()
 
-    def _send_watering_updates_worker(self):
-        self.watering_time_start = time.time()
-        TIMEOUT = self._send_watering_updates_interval_ms / 1000.0
-
-        while not self._send_watering_updates_event.is_set():
-            self._send_watering_updates_event.wait(TIMEOUT)
-            if self._send_watering_updates_event.is_set():
-                return
-            self._send_watering_update_function()
-
     def _send_watering_update_function(self):
         self.watering_time = time.time() - self.watering_time_start  # seconds
         self.liters_sent = self.watering_time * self.pump_controller.pump_capacity  # seconds * liters/second -> liters
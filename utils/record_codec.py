@@ -0,0 +1,380 @@
+"""Compact binary encoding for the values kept in local storage.
+
+A record is a 4-byte header (magic "PBR" and the format version) followed by one tagged value.
+Scalars, strings, datetimes, lists and dicts are written as a type tag plus struct-packed fields,
+strings and containers with a length prefix. Datetimes in a ZoneInfo zone also keep its key, so
+they come back in the same zone with its DST rules instead of a fixed offset. Domain objects get a fixed-field layout with their
+own schema version, so a field added to them later can still read records written before.
+
+Anything that does not start with the magic is taken to be a legacy pickle. Those are loaded with
+an unpickler that only resolves the classes local storage ever contained.
+"""
+import io
+import pickle
+import struct
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from domain.WateringProgram import WateringProgram
+from domain.WateringZone import WateringZone
+
+MAGIC = b'PBR'
+# 2: datetimes in a ZoneInfo zone are written with the zone key
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<3sB')
+_LENGTH = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_DATETIME = struct.Struct('<qh')
+_SCHEMA_VERSION = struct.Struct('<H')
+_WATERING_PROGRAM_FIELDS = struct.Struct('<dddd')
+
+_TAG_NONE = 0
+_TAG_FALSE = 1
+_TAG_TRUE = 2
+_TAG_INT = 3
+_TAG_FLOAT = 4
+_TAG_STR = 5
+_TAG_DATETIME = 6
+_TAG_LIST = 7
+_TAG_DICT = 8
+_TAG_WATERING_PROGRAM = 9
+_TAG_ZONED_DATETIME = 10
+
+_WATERING_PROGRAM_SCHEMA_VERSION = 2
+
+_NAIVE_OFFSET = -32768
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_TIMEZONES = {}
+_ZONES = {}
+
+_LEGACY_PICKLE_CLASSES = {
+    ('datetime', 'datetime'),
+    ('datetime', 'date'),
+    ('datetime', 'time'),
+    ('datetime', 'timedelta'),
+    ('datetime', 'timezone'),
+    ('domain.WateringProgram', 'WateringProgram'),
+    ('google.api_core.datetime_helpers', 'DatetimeWithNanoseconds'),
+    ('zoneinfo', 'ZoneInfo'),
+}
+
+
+class RecordFormatError(Exception):
+    pass
+
+
+def encode(value) -> bytes:
+    _buffer = bytearray(_HEADER.pack(MAGIC, FORMAT_VERSION))
+    _write_value(_buffer, value)
+    return bytes(_buffer)
+
+
+def is_record(data) -> bool:
+    return len(data) >= _HEADER.size and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decode(data):
+    """Decodes a record, or a legacy pickle if data is not a record."""
+    if not is_record(data):
+        return _load_legacy_pickle(data)
+
+    _data = bytes(data)
+    try:
+        _value, _offset = _read_value(_data, _read_header(_data))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise RecordFormatError(f'Record is truncated or corrupt: {e}')
+
+    if _offset != len(_data):
+        raise RecordFormatError(f'{len(_data) - _offset} trailing bytes after record')
+    return _value
+
+
+def iter_decode(data):
+    """Yields the items of a record holding a list one at a time, without building the whole list."""
+    if not is_record(data):
+        yield from _load_legacy_pickle(data)
+        return
+
+    # read in place instead of copied, the view is released when the generator is closed
+    with memoryview(data) as _data:
+        _offset = _read_header(_data)
+        if _data[_offset] != _TAG_LIST:
+            raise RecordFormatError(f'Expected a list record, found tag {_data[_offset]}')
+
+        try:
+            _count, = _LENGTH.unpack_from(_data, _offset + 1)
+            _offset += 1 + _LENGTH.size
+            for _ in range(_count):
+                _item, _offset = _read_value(_data, _offset)
+                yield _item
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise RecordFormatError(f'Record is truncated or corrupt: {e}')
+
+
+def _write_value(buffer, value):
+    _writer = _WRITERS.get(type(value))
+    if _writer is None:
+        # subclasses, e.g. the DatetimeWithNanoseconds values returned by Firestore
+        for value_type, writer in _WRITERS.items():
+            if isinstance(value, value_type):
+                _writer = writer
+                break
+        else:
+            raise RecordFormatError(f'Cannot encode values of type {type(value).__name__}')
+    _writer(buffer, value)
+
+
+def _write_none(buffer, value):
+    buffer.append(_TAG_NONE)
+
+
+def _write_bool(buffer, value):
+    buffer.append(_TAG_TRUE if value else _TAG_FALSE)
+
+
+def _write_int(buffer, value):
+    buffer.append(_TAG_INT)
+    buffer += _INT.pack(value)
+
+
+def _write_float(buffer, value):
+    buffer.append(_TAG_FLOAT)
+    buffer += _FLOAT.pack(value)
+
+
+def _write_str(buffer, value):
+    buffer.append(_TAG_STR)
+    _write_str_field(buffer, value)
+
+
+def _write_str_field(buffer, value):
+    _encoded = value.encode('utf-8')
+    buffer += _LENGTH.pack(len(_encoded))
+    buffer += _encoded
+
+
+def _write_datetime(buffer, value):
+    # microseconds since the epoch plus the UTC offset in minutes, so aware datetimes keep their offset
+    _zone_key = value.tzinfo.key if isinstance(value.tzinfo, ZoneInfo) else None
+    buffer.append(_TAG_DATETIME if _zone_key is None else _TAG_ZONED_DATETIME)
+    _offset = value.utcoffset()
+    if _offset is None:
+        _utc_value = value.replace(tzinfo=timezone.utc)
+        _offset_minutes = _NAIVE_OFFSET
+    else:
+        _utc_value = value
+        _offset_minutes = int(_offset.total_seconds() // 60)
+
+    _delta = _utc_value - _EPOCH
+    _epoch_us = (_delta.days * 86400 + _delta.seconds) * 1000000 + _delta.microseconds
+    buffer += _DATETIME.pack(_epoch_us, _offset_minutes)
+    if _zone_key is not None:
+        _write_str_field(buffer, _zone_key)
+
+
+def _write_list(buffer, value):
+    buffer.append(_TAG_LIST)
+    buffer += _LENGTH.pack(len(value))
+    for item in value:
+        _write_value(buffer, item)
+
+
+def _write_dict(buffer, value):
+    buffer.append(_TAG_DICT)
+    buffer += _LENGTH.pack(len(value))
+    for key, item in value.items():
+        _write_value(buffer, key)
+        _write_value(buffer, item)
+
+
+def _write_watering_program(buffer, program: WateringProgram):
+    buffer.append(_TAG_WATERING_PROGRAM)
+    buffer += _SCHEMA_VERSION.pack(_WATERING_PROGRAM_SCHEMA_VERSION)
+    buffer += _WATERING_PROGRAM_FIELDS.pack(
+        float(program.frequency_days),
+        float(program.quantity_l),
+        float(program.min_moisture),
+        float(program.max_moisture)
+    )
+    _write_str_field(buffer, str(program.id))
+    _write_str_field(buffer, str(program.name))
+    _write_value(buffer, program.starting_date_time)
+    # schema version 2, programs from legacy pickles have no zone
+    _write_str_field(buffer, str(program.zone_id))
+
+
+# bool before int, since bool is a subclass of int
+_WRITERS = {
+    type(None): _write_none,
+    bool: _write_bool,
+    int: _write_int,
+    float: _write_float,
+    str: _write_str,
+    datetime: _write_datetime,
+    list: _write_list,
+    tuple: _write_list,
+    dict: _write_dict,
+    WateringProgram: _write_watering_program,
+}
+
+
+# readers take the record and the offset after the tag and return the value and the offset after it
+
+def _read_header(data) -> int:
+    _magic, _version = _HEADER.unpack_from(data, 0)
+    if _version > FORMAT_VERSION:
+        raise RecordFormatError(f'Record format version {_version} is newer than {FORMAT_VERSION}')
+    return _HEADER.size
+
+
+def _read_value(data, offset):
+    _reader = _READERS[data[offset]] if data[offset] < len(_READERS) else None
+    if _reader is None:
+        raise RecordFormatError(f'Unknown tag {data[offset]} at offset {offset}')
+    return _reader(data, offset + 1)
+
+
+def _read_none(data, offset):
+    return None, offset
+
+
+def _read_false(data, offset):
+    return False, offset
+
+
+def _read_true(data, offset):
+    return True, offset
+
+
+def _read_int(data, offset):
+    return _INT.unpack_from(data, offset)[0], offset + _INT.size
+
+
+def _read_float(data, offset):
+    return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+
+
+def _read_str(data, offset):
+    _length, = _LENGTH.unpack_from(data, offset)
+    _start = offset + _LENGTH.size
+    _end = _start + _length
+    if _end > len(data):
+        raise RecordFormatError('Record is truncated')
+    return str(data[_start:_end], 'utf-8'), _end
+
+
+def _read_datetime(data, offset):
+    _epoch_us, _offset_minutes = _DATETIME.unpack_from(data, offset)
+    if _offset_minutes == _NAIVE_OFFSET:
+        return _NAIVE_EPOCH + timedelta(microseconds=_epoch_us), offset + _DATETIME.size
+
+    _timezone = _TIMEZONES.get(_offset_minutes)
+    if _timezone is None:
+        _timezone = _TIMEZONES.setdefault(_offset_minutes, timezone(timedelta(minutes=_offset_minutes)))
+    _local_value = _NAIVE_EPOCH + timedelta(microseconds=_epoch_us, minutes=_offset_minutes)
+    return _local_value.replace(tzinfo=_timezone), offset + _DATETIME.size
+
+
+def _read_zoned_datetime(data, offset):
+    _epoch_us, _ = _DATETIME.unpack_from(data, offset)
+    _zone_key, _end = _read_str(data, offset + _DATETIME.size)
+
+    _zone = _ZONES.get(_zone_key)
+    if _zone is None:
+        try:
+            _zone = _ZONES.setdefault(_zone_key, ZoneInfo(_zone_key))
+        except Exception:
+            # a zone this system does not know, the recorded offset is the best that can be done
+            return _read_datetime(data, offset)[0], _end
+
+    return (_EPOCH + timedelta(microseconds=_epoch_us)).astimezone(_zone), _end
+
+
+def _read_list(data, offset):
+    _count, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+
+    _value = []
+    for _ in range(_count):
+        _item, offset = _read_value(data, offset)
+        _value.append(_item)
+    return _value, offset
+
+
+def _read_dict(data, offset):
+    _count, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+
+    _value = {}
+    for _ in range(_count):
+        _key, offset = _read_value(data, offset)
+        _value[_key], offset = _read_value(data, offset)
+    return _value, offset
+
+
+def _read_watering_program(data, offset):
+    _schema_version, = _SCHEMA_VERSION.unpack_from(data, offset)
+    if _schema_version > _WATERING_PROGRAM_SCHEMA_VERSION:
+        raise RecordFormatError(f'WateringProgram schema version {_schema_version} is not supported')
+    offset += _SCHEMA_VERSION.size
+
+    _frequency_days, _quantity_l, _min_moisture, _max_moisture = _WATERING_PROGRAM_FIELDS.unpack_from(data, offset)
+    offset += _WATERING_PROGRAM_FIELDS.size
+
+    _id, offset = _read_str(data, offset)
+    _name, offset = _read_str(data, offset)
+    _starting_date_time, offset = _read_value(data, offset)
+
+    _zone_id = WateringZone.DEFAULT_ZONE_ID
+    if _schema_version >= 2:
+        _zone_id, offset = _read_str(data, offset)
+
+    return WateringProgram(
+        id=_id,
+        name=_name,
+        frequency_days=_frequency_days,
+        quantity_l=_quantity_l,
+        starting_date_time=_starting_date_time,
+        min_moisture=_min_moisture,
+        max_moisture=_max_moisture,
+        zone_id=_zone_id
+    ), offset
+
+
+# indexed by tag
+_READERS = (
+    _read_none,
+    _read_false,
+    _read_true,
+    _read_int,
+    _read_float,
+    _read_str,
+    _read_datetime,
+    _read_list,
+    _read_dict,
+    _read_watering_program,
+    _read_zoned_datetime,
+)
+
+
+def _legacy_getattr(obj, name):
+    # zoneinfo timezones are pickled as getattr(ZoneInfo, '_unpickle')(key, from_cache)
+    if obj is ZoneInfo and name == '_unpickle':
+        return ZoneInfo._unpickle
+    raise pickle.UnpicklingError(f'Refusing to resolve {name} from a legacy pickle')
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) == ('builtins', 'getattr'):
+            return _legacy_getattr
+        if (module, name) in _LEGACY_PICKLE_CLASSES:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f'Refusing to load {module}.{name} from a legacy pickle')
+
+
+def _load_legacy_pickle(data):
+    return _LegacyUnpickler(io.BytesIO(data)).load()
@@ -0,0 +1,286 @@
+import random
+import sqlite3
+from collections import deque
+import threading
+import time
+import uuid
+
+from utils import record_codec
+
+
+class RemoteOutbox:
+    """Durable, ordered queue of writes that still have to reach Firestore.
+
+    Every entry is committed to a SQLite database before enqueue returns, so callers never wait
+    on the network. A drainer thread replays the entries oldest first through replay_handler,
+    only while is_online returns True. An entry that fails is retried after an exponential
+    backoff and the entries behind it wait for it, so an older write can never land after a newer
+    one of the same document. An entry is removed once it was replayed; entries that keep failing,
+    or whose error is_permanent_error accepts, are moved to a dead letter table and stop holding
+    up the queue. Each entry has an idempotency key and enqueuing a key that is already pending
+    is a no-op.
+
+    With a batch_handler, consecutive entries are replayed together in one commit of at most
+    max_batch_ops operations (as counted by operation_ops). The drainer waits batch_window_sec
+    after being woken up so writes made close together share a commit. If a batch fails, its
+    entries are replayed one by one, which isolates an entry that cannot be written.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " idempotency_key TEXT NOT NULL UNIQUE,"
+        " operation TEXT NOT NULL,"
+        " payload BLOB NOT NULL,"
+        " created_ms INTEGER NOT NULL,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " last_error TEXT,"
+        " next_attempt_ms INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS outbox_dead_letters ("
+        " seq INTEGER PRIMARY KEY,"
+        " idempotency_key TEXT NOT NULL,"
+        " operation TEXT NOT NULL,"
+        " payload BLOB NOT NULL,"
+        " created_ms INTEGER NOT NULL,"
+        " attempts INTEGER NOT NULL,"
+        " last_error TEXT)",
+    )
+
+    _INSERT_ENTRY = ("INSERT OR IGNORE INTO outbox (idempotency_key, operation, payload, created_ms)"
+                     " VALUES (?, ?, ?, ?)")
+    _SELECT_HEAD = "SELECT seq, operation, payload, attempts, next_attempt_ms FROM outbox ORDER BY seq LIMIT ?"
+    _SELECT_NEXT_ATTEMPT = "SELECT next_attempt_ms FROM outbox ORDER BY seq LIMIT 1"
+    _DELETE_ENTRY = "DELETE FROM outbox WHERE seq = ?"
+    _UPDATE_ATTEMPTS = "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_ms = ? WHERE seq = ?"
+    _TABLE_COLUMNS = "PRAGMA table_info(outbox)"
+    _ADD_NEXT_ATTEMPT_COLUMN = "ALTER TABLE outbox ADD COLUMN next_attempt_ms INTEGER NOT NULL DEFAULT 0"
+    _MOVE_TO_DEAD_LETTERS = ("INSERT OR REPLACE INTO outbox_dead_letters"
+                             " SELECT seq, idempotency_key, operation, payload, created_ms, attempts, last_error"
+                             " FROM outbox WHERE seq = ?")
+    _COUNT_ENTRIES = "SELECT COUNT(*) FROM outbox"
+    _COUNT_OPERATION_ENTRIES = "SELECT COUNT(*) FROM outbox WHERE operation = ?"
+    _DELETE_ENTRIES = "DELETE FROM outbox"
+
+    def __init__(self, database_file, replay_handler, is_online,
+                 initial_backoff_sec=2.0, max_backoff_sec=300.0, max_attempts=100, offline_poll_sec=5.0,
+                 batch_handler=None, operation_ops=None, max_batch_ops=500, batch_window_sec=1.0,
+                 is_permanent_error=None):
+        self._replay_handler = replay_handler
+        self._is_online = is_online
+        self._is_permanent_error = is_permanent_error if is_permanent_error is not None else (lambda error: False)
+        self._batch_handler = batch_handler
+        self._operation_ops = operation_ops if operation_ops is not None else (lambda operation: 1)
+        self._max_batch_ops = max_batch_ops
+        self._batch_window_sec = batch_window_sec
+        self._initial_backoff_sec = initial_backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._max_attempts = max_attempts
+        self._offline_poll_sec = offline_poll_sec
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")
+        with self._connection:
+            for statement in self._SCHEMA:
+                self._connection.execute(statement)
+            # outboxes created before entries had their own backoff
+            _columns = [row[1] for row in self._connection.execute(self._TABLE_COLUMNS).fetchall()]
+            if "next_attempt_ms" not in _columns:
+                self._connection.execute(self._ADD_NEXT_ATTEMPT_COLUMN)
+
+        self._stats_lock = threading.Lock()
+        self._commits = 0
+        self._committed_entries = 0
+        self._committed_ops = 0
+        self._total_latency_sec = 0.0
+        self._max_latency_sec = 0.0
+        self._recent_commits = deque(maxlen=50)
+
+        self._wake_up = threading.Event()
+        self._batch_full = threading.Event()
+        self._enqueued_since_drain = 0
+        # entries up to this seq are replayed one by one, after their batch failed
+        self._single_until_seq = 0
+        self._drainer_thread = threading.Thread(target=self._drainer_worker, daemon=True)
+        self._drainer_thread.start()
+
+    def enqueue(self, operation: str, payload: dict, idempotency_key=None) -> bool:
+        """Durably records a write. Returns False only if it could not be stored locally."""
+        if idempotency_key is None:
+            idempotency_key = uuid.uuid4().hex
+
+        try:
+            _payload = record_codec.encode(payload)
+            with self._lock, self._connection:
+                self._connection.execute(
+                    self._INSERT_ENTRY,
+                    (idempotency_key, operation, _payload, int(time.time() * 1000))
+                )
+        except Exception as e:
+            print(f'Error while adding {operation} to the outbox: {e}')
+            return False
+
+        self._enqueued_since_drain += 1
+        if self._enqueued_since_drain >= self._max_batch_ops:
+            self._batch_full.set()
+        self._wake_up.set()
+        return True
+
+    def get_pending_count(self, operation=None) -> int:
+        with self._lock:
+            if operation is not None:
+                return self._connection.execute(self._COUNT_OPERATION_ENTRIES, (operation,)).fetchone()[0]
+            return self._connection.execute(self._COUNT_ENTRIES).fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute(self._DELETE_ENTRIES)
+
+    def get_batch_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "commits": self._commits,
+                "entries": self._committed_entries,
+                "ops": self._committed_ops,
+                "avg_ops_per_commit": self._committed_ops / self._commits if self._commits > 0 else 0.0,
+                "avg_latency_ms": self._total_latency_sec * 1000 / self._commits if self._commits > 0 else 0.0,
+                "max_latency_ms": self._max_latency_sec * 1000,
+                # (entries, ops, latency_ms) of the latest commits, oldest first
+                "recent": list(self._recent_commits),
+            }
+
+    def reset_batch_stats(self):
+        with self._stats_lock:
+            self._commits = 0
+            self._committed_entries = 0
+            self._committed_ops = 0
+            self._total_latency_sec = 0.0
+            self._max_latency_sec = 0.0
+            self._recent_commits.clear()
+
+    def _record_commit(self, entries, ops, latency_sec):
+        with self._stats_lock:
+            self._commits += 1
+            self._committed_entries += entries
+            self._committed_ops += ops
+            self._total_latency_sec += latency_sec
+            self._max_latency_sec = max(self._max_latency_sec, latency_sec)
+            self._recent_commits.append((entries, ops, round(latency_sec * 1000, 1)))
+
+    def wake_up(self):
+        """Retries immediately, e.g. after logging in."""
+        self._wake_up.set()
+
+    def _drainer_worker(self):
+        while True:
+            if not self._is_online():
+                self._wake_up.wait(self._offline_poll_sec)
+                self._wake_up.clear()
+                continue
+
+            self._drain()
+
+            # sleeps until something is enqueued or the head entry that failed may be retried
+            self._wake_up.wait(self._get_next_attempt_delay_sec())
+            self._wake_up.clear()
+            if self._batch_handler is not None and self._batch_window_sec > 0:
+                self._batch_full.wait(self._batch_window_sec)
+
+    def _get_next_attempt_delay_sec(self):
+        with self._lock:
+            _row = self._connection.execute(self._SELECT_NEXT_ATTEMPT).fetchone()
+        if _row is None:
+            return None
+        _next_attempt_ms = _row[0]
+        return max(0.0, _next_attempt_ms / 1000 - time.time())
+
+    def _drain(self):
+        """Replays the entries oldest first until none is left or the head entry waits for a retry."""
+        while self._is_online():
+            self._enqueued_since_drain = 0
+            self._batch_full.clear()
+
+            _limit = self._max_batch_ops if self._batch_handler is not None else 1
+            with self._lock:
+                _entries = self._connection.execute(self._SELECT_HEAD, (_limit,)).fetchall()
+            if len(_entries) == 0:
+                return
+
+            # the whole queue waits for a head entry that is backing off, nothing may overtake it
+            if _entries[0][4] > int(time.time() * 1000):
+                return
+
+            _entries = [entry[:4] for entry in _entries]
+            if len(_entries) > 1 and _entries[0][0] > self._single_until_seq and self._replay_batch(_entries):
+                continue
+
+            if not self._replay_entry(*_entries[0]):
+                return
+
+    def _replay_entry(self, seq, operation, payload, attempts) -> bool:
+        try:
+            _payload = record_codec.decode(payload)
+        except Exception as e:
+            # retrying can not make a corrupt payload readable
+            self._record_failure(seq, operation, attempts + 1, e, permanent=True)
+            return False
+
+        _started = time.monotonic()
+        try:
+            self._replay_handler(operation, _payload)
+        except Exception as e:
+            self._record_failure(seq, operation, attempts + 1, e)
+            return False
+        self._record_commit(1, self._operation_ops(operation), time.monotonic() - _started)
+
+        with self._lock, self._connection:
+            self._connection.execute(self._DELETE_ENTRY, (seq,))
+        return True
+
+    def _replay_batch(self, entries) -> bool:
+        _batch_entries = []
+        _ops = 0
+        for seq, operation, payload, attempts in entries:
+            _entry_ops = self._operation_ops(operation)
+            if _ops + _entry_ops > self._max_batch_ops:
+                break
+            try:
+                _batch_entries.append((seq, operation, record_codec.decode(payload)))
+            except Exception:
+                # left to the single entry path, which records the failure
+                break
+            _ops += _entry_ops
+
+        if len(_batch_entries) < 2:
+            return False
+
+        _started = time.monotonic()
+        try:
+            self._batch_handler([(operation, payload) for seq, operation, payload in _batch_entries])
+        except Exception as e:
+            print(f'Error while committing {len(_batch_entries)} outbox entries together, replaying them one by one: {e}')
+            self._single_until_seq = _batch_entries[-1][0]
+            return False
+        self._record_commit(len(_batch_entries), _ops, time.monotonic() - _started)
+
+        with self._lock, self._connection:
+            self._connection.executemany(self._DELETE_ENTRY, [(seq,) for seq, operation, payload in _batch_entries])
+        return True
+
+    def _record_failure(self, seq, operation, attempts, error, permanent=False):
+        print(f'Error while replaying {operation} from the outbox (attempt {attempts}): {error}')
+
+        _backoff_sec = min(self._initial_backoff_sec * 2 ** (attempts - 1), self._max_backoff_sec)
+        # jitter, so several devices coming back online do not retry in lockstep
+        _next_attempt_ms = int((time.time() + _backoff_sec * random.uniform(0.5, 1.0)) * 1000)
+        _permanent = permanent or self._is_permanent_error(error)
+
+        with self._lock, self._connection:
+            self._connection.execute(self._UPDATE_ATTEMPTS, (attempts, str(error), _next_attempt_ms, seq))
+            if _permanent or attempts >= self._max_attempts:
+                # the entry is kept for inspection
+                _reason = 'a permanent error' if _permanent else f'{attempts} attempts'
+                print(f'Giving up on {operation} after {_reason}, moved to the dead letters')
+                self._connection.execute(self._MOVE_TO_DEAD_LETTERS, (seq,))
+                self._connection.execute(self._DELETE_ENTRY, (seq,))
@@ -1,13 +1,22 @@
 import threading
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+
+from google.api_core.exceptions import NotFound, PermissionDenied, InvalidArgument, FailedPrecondition
 
 from components.exceptions.FirebaseUninitializedException import FirebaseUninitializedException
 from domain.RaspberryInfo import RaspberryInfo
+from domain.RollupResolution import RollupResolution
 from domain.WateringProgram import WateringProgram
+from domain.logging.LogMessage import LogMessage
 from domain.logging.MessageType import MessageType
+from utils.async_runtime import run_blocking
 from utils.firebase_controller import FirebaseController
 from utils.get_rasp_uuid import getserial
 from utils.local_storage_controller import LocalStorageController
+from utils.remote_outbox import RemoteOutbox
+from utils.sensor_ring_buffer import SensorRingBuffer
+from utils.telemetry_coalescer import TelemetryCoalescer
 
 
 class RemoteRequests:
@@ -30,6 +39,132 @@ class RemoteRequests:
         self._firebase_controller = FirebaseController()
         self._local_storage_controller = LocalStorageController()
 
+        # writes go through the outbox, so they survive being offline and never wait on the network
+        self._outbox = RemoteOutbox(
+            'outbox.db',
+            self._replay_outbox_entry,
+            self._firebase_controller.is_logged_in,
+            batch_handler=self._replay_outbox_batch,
+            operation_ops=self._get_outbox_operation_ops,
+            is_permanent_error=self._is_permanent_outbox_error
+        )
+
+        # watering telemetry is written from the coalescer thread, terminal updates fall back to the outbox
+        self._watering_progress_timeout_sec = 5.0
+        self._telemetry_coalescer = TelemetryCoalescer(self._send_telemetry, interval_sec=1.0)
+
+        # measurements made here are stored locally first, so once the newer remote ones were fetched
+        # in a session, local storage stays complete without asking Firestore again
+        self._moisture_sync_lock = threading.Lock()
+        self._moisture_synced_this_session = False
+        self._moisture_sync_page_size = 500
+
+        # read-through cache of the raspberry_info document, also refreshed by its snapshot listener
+        self._raspberry_info_lock = threading.Lock()
+        self._raspberry_info = None
+        self._raspberry_info_cached_at = 0.0
+        self._raspberry_info_ttl_sec = 10 * 60
+
+        # day shard the next fetch_older_log_messages continues from
+        self._remote_log_cursor = None
+        self._remote_log_exhausted = False
+        self._remote_log_page_days = 7
+
+    def _replay_outbox_entry(self, operation: str, payload: dict, batch=None):
+        if operation == "update_watering_info":
+            self._firebase_controller.update_watering_info(
+                self._raspberry_id, payload["command"], payload["litersSent"], payload["wateringTime"], batch)
+        elif operation == "add_log_message":
+            self._firebase_controller.add_log_message(
+                self._raspberry_id,
+                LogMessage(payload["message"], MessageType(payload["level"]), payload["timestamp"]),
+                batch
+            )
+        elif operation == "add_moisture_percentage_measurement":
+            self._firebase_controller.add_moisture_percentage_measurement(
+                self._raspberry_id, payload["percentage"], payload["timestamp"], batch)
+        elif operation == "update_moisture_info":
+            self._firebase_controller.update_moisture_info(self._raspberry_id, payload["value"], batch)
+        elif operation == "update_water_tank_volume_info":
+            self._firebase_controller.update_water_tank_volume_info(self._raspberry_id, payload["value"], batch)
+        elif operation == "update_next_watering_time":
+            self._firebase_controller.update_next_watering_time(self._raspberry_id, payload["value"], batch)
+        elif operation == "set_active_watering_program_id":
+            self._firebase_controller.set_active_watering_program_id(self._raspberry_id, payload["value"], batch)
+        elif operation == "set_active_watering_program_ids":
+            self._firebase_controller.set_active_watering_program_ids(self._raspberry_id, payload["value"], batch)
+        elif operation == "set_is_watering_programs_active":
+            self._firebase_controller.set_is_watering_programs_active(self._raspberry_id, payload["value"], batch)
+        elif operation == "update_raspberry_notifiable_message":
+            self._firebase_controller.update_raspberry_notifiable_message(
+                self._raspberry_id, MessageType(payload["messageType"]), payload["value"], batch)
+        else:
+            raise ValueError(f"Unknown outbox operation {operation}")
+
+    @staticmethod
+    def _is_permanent_outbox_error(error) -> bool:
+        # the same write will be rejected again however often it is retried
+        return isinstance(error, (NotFound, PermissionDenied, InvalidArgument, FailedPrecondition))
+
+    def _replay_outbox_batch(self, entries: list[tuple]):
+        _batch = self._firebase_controller.create_write_batch()
+        for operation, payload in entries:
+            self._replay_outbox_entry(operation, payload, _batch)
+        self._firebase_controller.commit_write_batch(_batch)
+
+    def _get_outbox_operation_ops(self, operation: str) -> int:
+        # a reading is written together with one rollup per resolution
+        if operation == "add_moisture_percentage_measurement":
+            return 1 + len(RollupResolution)
+        # telemetry is mirrored to the protocol 1 document while older phones are served
+        if operation in ("update_watering_info", "update_moisture_info", "update_water_tank_volume_info",
+                         "update_next_watering_time"):
+            return self._firebase_controller.get_telemetry_document_count()
+        return 1
+
+    def _send_telemetry(self, document: str, fields: dict, terminal: bool) -> bool:
+        if document != "watering_info":
+            raise ValueError(f"Unknown telemetry document {document}")
+
+        # an older terminal update still waiting in the outbox must be written first, so nothing is
+        # written directly until it is gone
+        _online = (self._firebase_controller.is_logged_in()
+                   and self._outbox.get_pending_count("update_watering_info") == 0)
+
+        if not terminal:
+            # progress is only worth its newest value, so it is dropped instead of kept for later
+            if not _online:
+                return False
+            self._firebase_controller.update_watering_info(
+                self._raspberry_id, fields["command"], fields["litersSent"], fields["wateringTime"],
+                timeout=self._watering_progress_timeout_sec)
+            return True
+
+        if _online:
+            try:
+                self._firebase_controller.update_watering_info(
+                    self._raspberry_id, fields["command"], fields["litersSent"], fields["wateringTime"],
+                    timeout=self._watering_progress_timeout_sec)
+                return True
+            except Exception as e:
+                print(f'Error while sending the end of watering, keeping it in the outbox: {e}')
+
+        # written by the outbox once online, behind any older terminal update and ahead of new progress
+        return self._outbox.enqueue("update_watering_info", fields)
+
+    def set_telemetry_interval(self, interval_sec: float):
+        self._telemetry_coalescer.set_interval(interval_sec)
+
+    def get_telemetry_stats(self) -> dict:
+        return self._telemetry_coalescer.get_stats()
+
+    def get_pending_remote_writes_count(self) -> int:
+        return self._outbox.get_pending_count()
+
+    def get_remote_write_stats(self) -> dict:
+        """Op count and latency of the Firestore commits made from the outbox."""
+        return self._outbox.get_batch_stats()
+
     # def try_initial_login(self) -> bool:
     #     return self._login_controller.try_initial_login()
 
@@ -38,40 +173,168 @@ class RemoteRequests:
 
     def register_raspberry(self, raspberry_info: RaspberryInfo) -> bool:
         try:
-            return self._firebase_controller.register_raspberry(raspberry_info)
+            _registered = self._firebase_controller.register_raspberry(raspberry_info)
+            if _registered:
+                self._cache_raspberry_info(raspberry_info)
+            return _registered
         except Exception as e:
             return False
 
     def get_raspberry_info(self) -> RaspberryInfo | None:
+        """Served from the cache while it is younger than the TTL, read from Firestore otherwise."""
+        with self._raspberry_info_lock:
+            _age_sec = time.monotonic() - self._raspberry_info_cached_at
+            if self._raspberry_info is not None and _age_sec < self._raspberry_info_ttl_sec:
+                return self._copy_raspberry_info(self._raspberry_info)
+
         try:
             _result = self._firebase_controller.get_raspberry_info(self._raspberry_id)
             if _result is None:
                 _result = self._local_storage_controller.get_raspberry_info()
             else:
-                self._local_storage_controller.save_raspberry_info(_result)
+                self._cache_raspberry_info(_result)
             return _result
         except Exception as e:
             return self._local_storage_controller.get_raspberry_info()
 
+    async def get_raspberry_info_async(self) -> RaspberryInfo | None:
+        return await run_blocking(self.get_raspberry_info)
+
+    def set_raspberry_info_ttl(self, ttl_sec: float):
+        self._raspberry_info_ttl_sec = ttl_sec
+
+    def invalidate_raspberry_info(self):
+        with self._raspberry_info_lock:
+            self._raspberry_info = None
+
+    def _cache_raspberry_info(self, raspberry_info: RaspberryInfo):
+        with self._raspberry_info_lock:
+            _changed = self._raspberry_info is None or self._raspberry_info.to_dict() != raspberry_info.to_dict()
+            self._raspberry_info = self._copy_raspberry_info(raspberry_info)
+            self._raspberry_info_cached_at = time.monotonic()
+
+        # the local copy is only rewritten when something changed
+        if _changed:
+            self._local_storage_controller.save_raspberry_info(raspberry_info)
+
+    @staticmethod
+    def _copy_raspberry_info(raspberry_info: RaspberryInfo) -> RaspberryInfo:
+        # callers get their own copy, since they modify it
+        _copy = RaspberryInfo().from_dict(raspberry_info.to_dict())
+        _copy.raspberryId = raspberry_info.raspberryId
+        return _copy
+
+    def _on_raspberry_info_snapshot(self, doc_snapshot, changes, read_time):
+        for change in changes:
+            _data = change.document.to_dict()
+            if _data is None:
+                self.invalidate_raspberry_info()
+            else:
+                self._cache_raspberry_info(RaspberryInfo().from_dict(_data))
+
     def add_watering_now_listener(self, callback):
+        """callback receives a dict with only the fields of watering_info changed by someone else."""
         self._firebase_controller.add_watering_now_listener(self._raspberry_id, callback)
 
+    def get_suppressed_watering_echo_count(self) -> int:
+        return self._firebase_controller.get_suppressed_echo_count()
+
+    def get_moisture_samples(self, start_date: datetime, end_date: datetime):
+        """Moisture samples straight from the local sensor history, or None if it does not cover the range."""
+        return self._local_storage_controller.get_sensor_samples(SensorRingBuffer.SENSOR_MOISTURE, start_date, end_date)
+
     def get_moisture_info(self, start_date: datetime, end_date: datetime) -> list[dict]:
+        _samples = self.get_moisture_samples(start_date, end_date)
+        if _samples is not None:
+            _timezone = start_date.tzinfo
+            return [
+                {
+                    "raspberryId": self._raspberry_id,
+                    "measurementTime": datetime.fromtimestamp(_timestamp_ms / 1000, tz=_timezone),
+                    "measurementValuePercent": _value
+                }
+                for _timestamp_ms, _value in zip(_samples['ts'].tolist(), _samples['value'].tolist())
+            ]
+
+        self.sync_moisture_info(start_date)
+        return self._local_storage_controller.get_moisture_info(start_date, end_date)
+
+    async def get_moisture_info_async(self, start_date: datetime, end_date: datetime) -> list[dict]:
+        return await run_blocking(self.get_moisture_info, start_date, end_date)
+
+    def sync_moisture_info(self, start_date: datetime) -> bool:
+        """Fetches the remote measurements since start_date that are not stored locally yet.
+
+        The synced range is kept in local storage: ranges starting before it are backfilled once,
+        newer measurements are fetched once per session. Returns False if Firestore could not be read.
+        """
+        with self._moisture_sync_lock:
+            _now = datetime.now(start_date.tzinfo)
+            _synced_from, _synced_until = self._local_storage_controller.get_moisture_sync_range()
+
+            try:
+                if _synced_from is None:
+                    self._fetch_moisture_info(start_date - timedelta(milliseconds=1), _now)
+                    self._local_storage_controller.set_moisture_sync_range(start_date, _now)
+                    self._moisture_synced_this_session = True
+                    return True
+
+                if start_date < _synced_from:
+                    self._fetch_moisture_info(start_date - timedelta(milliseconds=1), _synced_from)
+                    _synced_from = start_date
+                    self._local_storage_controller.set_moisture_sync_range(_synced_from, _synced_until)
+
+                if not self._moisture_synced_this_session:
+                    self._fetch_moisture_info(_synced_until, _now)
+                    self._local_storage_controller.set_moisture_sync_range(_synced_from, _now)
+                    self._moisture_synced_this_session = True
+
+                return True
+            except Exception as e:
+                print(f"Exception when syncing moisture info: {e}")
+                return False
+
+    def _fetch_moisture_info(self, after_date: datetime, end_date: datetime):
+        _cursor = None
+        while True:
+            _page, _cursor = self._firebase_controller.get_moisture_info_page_for_rasp_id(
+                self._raspberry_id, after_date, end_date, self._moisture_sync_page_size, _cursor)
+            if len(_page) > 0 and not self._local_storage_controller.update_moisture_info_list(_page):
+                raise Exception("Could not store the fetched measurements")
+
+            if len(_page) < self._moisture_sync_page_size:
+                return
+
+    def get_moisture_rollups(self, start_date: datetime, end_date: datetime, min_points=24) -> list[dict] | None:
+        """Hourly or daily aggregates over the range, or None when it is short enough to show raw measurements."""
+        _resolution = RollupResolution.choose(start_date.timestamp() * 1000, end_date.timestamp() * 1000, min_points)
+        if _resolution is None:
+            return None
+
+        # the local rollups are complete once the range is synced
+        if self.sync_moisture_info(start_date):
+            return self._local_storage_controller.get_moisture_rollups(_resolution, start_date, end_date)
+
         try:
-            _result = self._firebase_controller.get_moisture_info_for_rasp_id(self._raspberry_id, start_date, end_date)
+            _result = self._firebase_controller.get_moisture_rollups_for_rasp_id(self._raspberry_id, _resolution, start_date, end_date)
             if _result is None or len(_result) == 0:
-                _result = self._local_storage_controller.get_moisture_info(start_date, end_date)
-            else:
-                self._local_storage_controller.update_moisture_info_list(_result)
+                _result = self._local_storage_controller.get_moisture_rollups(_resolution, start_date, end_date)
             return _result
         except Exception as e:
-            return self._local_storage_controller.get_moisture_info(start_date, end_date)
+            return self._local_storage_controller.get_moisture_rollups(_resolution, start_date, end_date)
+
+    async def get_moisture_rollups_async(self, start_date: datetime, end_date: datetime,
+                                         min_points=24) -> list[dict] | None:
+        return await run_blocking(self.get_moisture_rollups, start_date, end_date, min_points)
 
     def update_watering_info(self, command: str, liters_sent: float, watering_time: int) -> bool:
-        try:
-            return self._firebase_controller.update_watering_info(self._raspberry_id, command, liters_sent, watering_time)
-        except Exception as e:
-            return False
+        # anything but a progress update is a state change (e.g. stop_watering) and always goes out
+        self._telemetry_coalescer.update("watering_info", {
+            "command": command,
+            "litersSent": liters_sent,
+            "wateringTime": watering_time
+        }, terminal=command != 'processing')
+        return True
 
     def get_watering_programs(self) -> list[WateringProgram]:
         try:
@@ -82,6 +345,9 @@ class RemoteRequests:
             print(f"Exception when getting watering programs: {e}")
             return self._local_storage_controller.get_watering_programs()
 
+    async def get_watering_programs_async(self) -> list[WateringProgram]:
+        return await run_blocking(self.get_watering_programs)
+
     def get_active_watering_program_id(self) -> str | None:
         try:
             _result = self._firebase_controller.get_active_watering_program_id(self._raspberry_id)
@@ -91,12 +357,20 @@ class RemoteRequests:
             return self._local_storage_controller.get_active_watering_program_id()
 
     def set_active_watering_program_id(self, program_id: str):
+        self._local_storage_controller.save_active_watering_program_id(program_id)
+        self._outbox.enqueue("set_active_watering_program_id", {"value": program_id})
+
+    def get_active_watering_program_ids(self) -> list[str]:
         try:
-            _result = self._firebase_controller.set_active_watering_program_id(self._raspberry_id, program_id)
+            _result = self._firebase_controller.get_active_watering_program_ids(self._raspberry_id)
+            self._local_storage_controller.save_active_watering_program_ids(_result)
+            return _result
         except Exception as e:
-            pass
+            return self._local_storage_controller.get_active_watering_program_ids()
 
-        self._local_storage_controller.save_active_watering_program_id(program_id)
+    def set_active_watering_program_ids(self, program_ids: list[str]):
+        self._local_storage_controller.save_active_watering_program_ids(program_ids)
+        self._outbox.enqueue("set_active_watering_program_ids", {"value": list(program_ids)})
 
     def get_is_watering_programs_active(self) -> bool:
         try:
@@ -107,12 +381,8 @@ class RemoteRequests:
             return self._local_storage_controller.get_is_watering_programs_active()
 
     def set_is_watering_programs_active(self, is_active: bool):
-        try:
-            _result = self._firebase_controller.set_is_watering_programs_active(self._raspberry_id, is_active)
-        except Exception as e:
-            print(f"Exception when setting is watering programs active: {e}")
-
         self._local_storage_controller.save_is_watering_programs_active(is_active)
+        self._outbox.enqueue("set_is_watering_programs_active", {"value": is_active})
 
     def add_listener_for_watering_programs_changes(self, callback) -> bool:
         try:
@@ -130,8 +400,12 @@ class RemoteRequests:
             return False
 
     def add_listener_for_notification_changes(self, callback) -> bool:
+        def _on_snapshot(doc_snapshot, changes, read_time):
+            self._on_raspberry_info_snapshot(doc_snapshot, changes, read_time)
+            callback(doc_snapshot, changes, read_time)
+
         try:
-            self._firebase_controller.add_listener_for_notification_changes(self._raspberry_id, callback)
+            self._firebase_controller.add_listener_for_notification_changes(self._raspberry_id, _on_snapshot)
             return True
         except Exception as e:
             return False
@@ -156,23 +430,65 @@ class RemoteRequests:
         except Exception as e:
             return self._local_storage_controller.get_log_messages()
 
-    def add_log_message(self, log_message: str) -> bool:
+    def get_log_messages_page(self, limit=50, message_type: MessageType = None, start_date: datetime = None,
+                              end_date: datetime = None, cursor=None, newer=False) -> tuple[list, tuple | None]:
+        # served from the local log, which the log messages listener keeps in sync
+        return self._local_storage_controller.get_log_messages_page(limit, message_type, start_date, end_date, cursor, newer)
+
+    async def get_log_messages_page_async(self, limit=50, cursor=None) -> tuple[list, tuple | None]:
+        return await run_blocking(self.get_log_messages_page, limit, cursor=cursor)
+
+    def migrate_log_messages(self) -> bool:
+        """Moves a log kept in the single messages map into day shards; a no-op once done."""
         try:
-            _result = self._firebase_controller.add_log_message(self._raspberry_id, log_message)
-            self._local_storage_controller.add_log_message(log_message)
+            self._firebase_controller.migrate_log_messages_to_shards(self._raspberry_id)
             return True
         except Exception as e:
-            print(f"Exception when adding log message: {e}")
+            print(f"Exception when migrating log messages: {e}")
+            return False
+
+    def fetch_older_log_messages(self) -> bool:
+        """Merges the next week of remote log shards into the local log. Returns False when there were none."""
+        if self._remote_log_exhausted:
             return False
 
-    def update_raspberry_notifiable_message(self, message_type: MessageType, value: bool) -> bool:
         try:
-            _result = self._firebase_controller.update_raspberry_notifiable_message(self._raspberry_id, message_type, value)
-            self._local_storage_controller.update_raspberry_notifiable_message(message_type, value)
-            return _result
+            _log_messages, _cursor = self._firebase_controller.get_log_messages_page(
+                self._raspberry_id, self._remote_log_page_days, self._remote_log_cursor)
         except Exception as e:
+            print(f"Exception when fetching older log messages: {e}")
             return False
 
+        self._remote_log_cursor = _cursor
+        self._remote_log_exhausted = _cursor is None
+        if len(_log_messages) == 0:
+            return False
+
+        self._local_storage_controller.save_log_messages(_log_messages)
+        return True
+
+    def merge_log_messages(self, log_messages: dict):
+        self._local_storage_controller.save_log_messages(log_messages)
+
+    def add_log_message(self, log_message: LogMessage) -> bool:
+        self._local_storage_controller.add_log_message(log_message)
+        # the key is the message's key in the Firestore messages map
+        return self._outbox.enqueue("add_log_message", {
+            "timestamp": log_message.get_timestamp(),
+            "message": log_message.get_message(),
+            "level": log_message.get_level().value
+        }, idempotency_key=f"log:{log_message.get_timestamp()}")
+
+    def update_raspberry_notifiable_message(self, message_type: MessageType, value: bool) -> bool:
+        self._local_storage_controller.update_raspberry_notifiable_message(message_type, value)
+        with self._raspberry_info_lock:
+            if self._raspberry_info is not None:
+                self._raspberry_info.set_notifiable_message(message_type, value)
+        return self._outbox.enqueue("update_raspberry_notifiable_message", {
+            "messageType": message_type.value,
+            "value": value
+        })
+
     def get_notifiable_messages(self) -> [dict, bool]:
         try:
             _result = self._firebase_controller.get_notifiable_messages(self._raspberry_id)
@@ -181,36 +497,31 @@ class RemoteRequests:
         except Exception as e:
             return self._local_storage_controller.get_notifiable_messages()
 
-    def add_moisture_percentage_measurement(self, percentage: float, timestamp: datetime) -> bool:
-        try:
-            _result, _measurement = self._firebase_controller.add_moisture_percentage_measurement(self._raspberry_id, percentage, timestamp)
-            self._local_storage_controller.add_moisture_percentage_measurement(_measurement)
-            return _result
-        except Exception as e:
-            try:
-                data = {
-                    "raspberryId": self._raspberry_id,
-                    "measurementTime": timestamp,
-                    "measurementValuePercent": percentage
-                }
-                self._local_storage_controller.add_moisture_percentage_measurement(data)
+    async def get_notifiable_messages_async(self) -> [dict, bool]:
+        return await run_blocking(self.get_notifiable_messages)
 
-            except Exception as e:
-                pass
-
-            return False
+    def add_moisture_percentage_measurement(self, percentage: float, timestamp: datetime) -> bool:
+        self._local_storage_controller.add_moisture_percentage_measurement({
+            "raspberryId": self._raspberry_id,
+            "measurementTime": timestamp,
+            "measurementValuePercent": percentage
+        })
+        return self._outbox.enqueue("add_moisture_percentage_measurement", {
+            "percentage": percentage,
+            "timestamp": timestamp
+        }, idempotency_key=f"moisture:{self._raspberry_id}:{int(timestamp.timestamp() * 1000)}")
 
     def unsubscribe_watering_now_listener(self):
         self._firebase_controller.unsubscribe_watering_now_listener()
 
     def update_moisture_info(self, param) -> bool:
-        try:
-            return self._firebase_controller.update_moisture_info(self._raspberry_id, param)
-        except Exception as e:
-            return False
+        return self._outbox.enqueue("update_moisture_info", {"value": param})
 
     def reset_data(self):
         self._local_storage_controller.clear_all()
+        self.invalidate_raspberry_info()
+        self._firebase_controller.forget_stored_refresh_token()
+        self._outbox.clear()
 
         try:
             self._firebase_controller.unlink_raspberry(self._raspberry_id)
@@ -221,13 +532,7 @@ class RemoteRequests:
             print("Error resetting data from remote")
 
     def update_water_tank_volume_info(self, param):
-        try:
-            return self._firebase_controller.update_water_tank_volume_info(self._raspberry_id, param)
-        except Exception as e:
-            return False
+        return self._outbox.enqueue("update_water_tank_volume_info", {"value": param})
 
     def update_next_watering_time(self, next_watering_time):
-        try:
-            return self._firebase_controller.update_next_watering_time(self._raspberry_id, next_watering_time)
-        except Exception as e:
-            return False
+        return self._outbox.enqueue("update_next_watering_time", {"value": next_watering_time})
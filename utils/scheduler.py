@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ScheduledJob:
+    """Handle of a job added to the Scheduler, used to cancel it or to read when it runs next."""
+
+    FIXED_RATE = "fixed_rate"
+    FIXED_DELAY = "fixed_delay"
+    ONCE = "once"
+
+    def __init__(self, scheduler, function, args, kind, interval_sec, name):
+        self._scheduler = scheduler
+        self._function = function
+        self._args = args
+        self._kind = kind
+        self._interval_sec = interval_sec
+        self._name = name if name is not None else getattr(function, "__name__", "job")
+
+        self._due = 0.0
+        self._cancelled = False
+        self._running_thread_id = None
+        # set while the job is not running, so cancel(wait=True) can wait for the current run
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def get_name(self) -> str:
+        return self._name
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    def get_next_run_in_sec(self):
+        if self._cancelled:
+            return None
+        return max(0.0, self._due - time.monotonic())
+
+    def cancel(self, wait=False):
+        """Stops future runs. With wait, also waits for a run in progress, unless called from that run."""
+        self._scheduler._cancel(self)
+        if wait and self._running_thread_id != threading.get_ident():
+            self._idle.wait()
+
+
+class Scheduler:
+    """Runs one-shot and periodic jobs from a single dispatcher thread and a small worker pool.
+
+    Jobs are kept in a min-heap ordered by due time; the dispatcher sleeps until the earliest one
+    and hands every job that is due within the coalescing window to the pool in the same wake-up.
+    Fixed-rate jobs keep their schedule and skip the runs they missed, fixed-delay jobs wait the
+    interval after each run ends. A periodic job is never run twice at the same time.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if not cls._instance:
+                cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, '_initialized', None):
+            return
+        self._initialized = True
+
+        self._coalesce_window_sec = 0.05
+        self._max_workers = 4
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._running_jobs = 0
+
+        self._stats = {
+            "wake_ups": 0,
+            "runs": 0,
+            "coalesced_runs": 0,
+            "skipped_runs": 0,
+            "failed_runs": 0,
+            "total_lateness_ms": 0.0,
+            "max_lateness_ms": 0.0,
+        }
+
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="scheduler")
+        self._dispatcher_thread = threading.Thread(target=self._dispatcher_worker, daemon=True)
+        self._dispatcher_thread.start()
+
+    def schedule_once(self, function, delay_sec, *args, name=None) -> ScheduledJob:
+        _job = ScheduledJob(self, function, args, ScheduledJob.ONCE, 0, name)
+        self._push(_job, time.monotonic() + max(0.0, delay_sec))
+        return _job
+
+    def schedule_fixed_rate(self, function, interval_sec, *args, initial_delay_sec=0.0, name=None) -> ScheduledJob:
+        _job = ScheduledJob(self, function, args, ScheduledJob.FIXED_RATE, interval_sec, name)
+        self._push(_job, time.monotonic() + max(0.0, initial_delay_sec))
+        return _job
+
+    def schedule_fixed_delay(self, function, delay_sec, *args, initial_delay_sec=0.0, name=None) -> ScheduledJob:
+        _job = ScheduledJob(self, function, args, ScheduledJob.FIXED_DELAY, delay_sec, name)
+        self._push(_job, time.monotonic() + max(0.0, initial_delay_sec))
+        return _job
+
+    def get_stats(self) -> dict:
+        """Queue depth, running jobs and how late the runs started compared to their due time."""
+        with self._condition:
+            _stats = dict(self._stats)
+            _stats["queue_depth"] = sum(1 for _, _, _job in self._heap if not _job.is_cancelled())
+            _stats["running"] = self._running_jobs
+        _stats["avg_lateness_ms"] = _stats["total_lateness_ms"] / _stats["runs"] if _stats["runs"] > 0 else 0.0
+        return _stats
+
+    def _push(self, job, due):
+        with self._condition:
+            if job.is_cancelled():
+                return
+            job._due = due
+            heapq.heappush(self._heap, (due, next(self._sequence), job))
+            if self._heap[0][2] is job:
+                self._condition.notify()
+
+    def _cancel(self, job):
+        with self._condition:
+            # the heap entry is left in place and skipped when it comes up
+            job._cancelled = True
+
+    def _dispatcher_worker(self):
+        while True:
+            with self._condition:
+                while True:
+                    while len(self._heap) > 0 and self._heap[0][2].is_cancelled():
+                        heapq.heappop(self._heap)
+
+                    if len(self._heap) == 0:
+                        self._condition.wait()
+                        continue
+
+                    _wait_sec = self._heap[0][0] - time.monotonic()
+                    if _wait_sec <= 0:
+                        break
+                    self._condition.wait(_wait_sec)
+
+                self._stats["wake_ups"] += 1
+                _now = time.monotonic()
+                _due_jobs = []
+                while len(self._heap) > 0 and self._heap[0][0] <= _now + self._coalesce_window_sec:
+                    _due, _, _job = heapq.heappop(self._heap)
+                    if not _job.is_cancelled():
+                        _due_jobs.append((_due, _job))
+
+                self._stats["coalesced_runs"] += max(0, len(_due_jobs) - 1)
+                self._running_jobs += len(_due_jobs)
+
+            for _due, _job in _due_jobs:
+                self._executor.submit(self._run_job, _job, _due)
+
+    def _run_job(self, job, due):
+        _started = time.monotonic()
+        _lateness_ms = max(0.0, _started - due) * 1000
+
+        job._idle.clear()
+        job._running_thread_id = threading.get_ident()
+        _failed = False
+        try:
+            if not job.is_cancelled():
+                job._function(*job._args)
+        except Exception as e:
+            print(f"Error in scheduled job {job.get_name()}: {e}")
+            _failed = True
+        finally:
+            job._running_thread_id = None
+            job._idle.set()
+
+        _skipped = 0
+        with self._condition:
+            self._running_jobs -= 1
+            self._stats["runs"] += 1
+            self._stats["total_lateness_ms"] += _lateness_ms
+            self._stats["max_lateness_ms"] = max(self._stats["max_lateness_ms"], _lateness_ms)
+            if _failed:
+                self._stats["failed_runs"] += 1
+
+            if job._kind == ScheduledJob.FIXED_RATE:
+                _next_due = due + job._interval_sec
+                _now = time.monotonic()
+                if _next_due <= _now and job._interval_sec > 0:
+                    # runs missed while this one was late or running are skipped, not run back to back
+                    _skipped = int((_now - _next_due) // job._interval_sec) + 1
+                    _next_due += _skipped * job._interval_sec
+                self._stats["skipped_runs"] += _skipped
+            elif job._kind == ScheduledJob.FIXED_DELAY:
+                _next_due = time.monotonic() + job._interval_sec
+            else:
+                job._cancelled = True
+                return
+
+        self._push(job, _next_due)
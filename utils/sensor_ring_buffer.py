@@ -0,0 +1,155 @@
+import os
+import threading
+
+import numpy as np
+
+
+class SensorRingBuffer:
+    """Fixed-capacity history of sensor samples backed by a memory-mapped file.
+
+    Samples are stored in a structured array (epoch-ms timestamp, float32 value, uint8 sensor id)
+    that survives restarts without being loaded. Once full, the oldest samples are overwritten.
+    Samples must be appended in timestamp order, so every contiguous part of the ring is sorted
+    and time ranges are found by binary search and returned as views into the mapped file.
+    """
+
+    SENSOR_MOISTURE = 0
+    SENSOR_WATER_TANK = 1
+
+    SAMPLE_DTYPE = np.dtype([('ts', '<i8'), ('value', '<f4'), ('sensor', 'u1')])
+
+    _MAGIC = 0x31474E4952425050  # "PPBRING1"
+    _HEADER_FIELDS = 8
+    _HEADER_BYTES = _HEADER_FIELDS * 8
+
+    # header slots
+    _H_MAGIC = 0
+    _H_CAPACITY = 1
+    _H_HEAD = 2
+    _H_COUNT = 3
+    _H_ORIGIN_MS = 4
+    _H_LAST_MS = 5
+
+    def __init__(self, file_name, capacity=262144, origin_ms=0):
+        self._file_name = file_name
+        self._lock = threading.Lock()
+
+        if not self._is_valid_file(capacity):
+            self._create_file(capacity, origin_ms)
+
+        self._header = np.memmap(self._file_name, dtype='<i8', mode='r+', offset=0, shape=(self._HEADER_FIELDS,))
+        self._samples = np.memmap(self._file_name, dtype=self.SAMPLE_DTYPE, mode='r+',
+                                  offset=self._HEADER_BYTES, shape=(capacity,))
+        self._capacity = capacity
+
+    def _is_valid_file(self, capacity) -> bool:
+        if not os.path.exists(self._file_name):
+            return False
+
+        if os.path.getsize(self._file_name) != self._HEADER_BYTES + capacity * self.SAMPLE_DTYPE.itemsize:
+            print(f'Sensor history file {self._file_name} has a different capacity, recreating it')
+            return False
+
+        _header = np.fromfile(self._file_name, dtype='<i8', count=self._HEADER_FIELDS)
+        return int(_header[self._H_MAGIC]) == self._MAGIC and int(_header[self._H_CAPACITY]) == capacity
+
+    def _create_file(self, capacity, origin_ms):
+        with open(self._file_name, 'wb') as file:
+            file.truncate(self._HEADER_BYTES + capacity * self.SAMPLE_DTYPE.itemsize)
+
+        _header = np.memmap(self._file_name, dtype='<i8', mode='r+', offset=0, shape=(self._HEADER_FIELDS,))
+        _header[:] = 0
+        _header[self._H_MAGIC] = self._MAGIC
+        _header[self._H_CAPACITY] = capacity
+        _header[self._H_ORIGIN_MS] = origin_ms
+        _header[self._H_LAST_MS] = np.iinfo(np.int64).min
+        _header.flush()
+        del _header
+
+    def __len__(self):
+        return int(self._header[self._H_COUNT])
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def append(self, sensor_id, value, timestamp_ms) -> bool:
+        """Stores one sample. Returns False for samples older than the newest stored one."""
+        with self._lock:
+            if timestamp_ms < self._header[self._H_LAST_MS]:
+                return False
+
+            _head = int(self._header[self._H_HEAD])
+            self._samples[_head] = (timestamp_ms, value, sensor_id)
+
+            self._header[self._H_HEAD] = (_head + 1) % self._capacity
+            self._header[self._H_COUNT] = min(int(self._header[self._H_COUNT]) + 1, self._capacity)
+            self._header[self._H_LAST_MS] = timestamp_ms
+            return True
+
+    def get_coverage_start_ms(self) -> int:
+        """Samples newer than this are all in the buffer: the creation time until the ring wraps."""
+        with self._lock:
+            if int(self._header[self._H_COUNT]) < self._capacity:
+                return int(self._header[self._H_ORIGIN_MS])
+            return int(self._samples[int(self._header[self._H_HEAD])]['ts'])
+
+    def covers(self, start_ms) -> bool:
+        return start_ms >= self.get_coverage_start_ms()
+
+    def _sorted_parts(self):
+        _head = int(self._header[self._H_HEAD])
+        if int(self._header[self._H_COUNT]) < self._capacity:
+            return [self._samples[:_head]]
+        return [self._samples[_head:], self._samples[:_head]]
+
+    @staticmethod
+    def _bisect(timestamps, value, right) -> int:
+        # manual bisection so only O(log n) elements of the strided column are touched
+        _low, _high = 0, len(timestamps)
+        while _low < _high:
+            _mid = (_low + _high) // 2
+            if timestamps[_mid] < value or (right and timestamps[_mid] == value):
+                _low = _mid + 1
+            else:
+                _high = _mid
+        return _low
+
+    def get_range_views(self, start_ms, end_ms) -> list[np.ndarray]:
+        """Zero-copy views (oldest first) of the samples with start_ms <= ts <= end_ms, for all sensors.
+
+        The views point into the mapped file and will change once the ring wraps over them.
+        """
+        with self._lock:
+            _views = []
+            for part in self._sorted_parts():
+                _timestamps = part['ts']
+                _low = self._bisect(_timestamps, start_ms, right=False)
+                _high = self._bisect(_timestamps, end_ms, right=True)
+                if _low < _high:
+                    _views.append(part[_low:_high])
+            return _views
+
+    def get_range(self, start_ms, end_ms, sensor_id=None) -> np.ndarray:
+        """Samples in the range as one array; only copies when the range wraps or is filtered."""
+        _views = self.get_range_views(start_ms, end_ms)
+
+        if len(_views) == 0:
+            return np.empty(0, dtype=self.SAMPLE_DTYPE)
+
+        _samples = _views[0] if len(_views) == 1 else np.concatenate(_views)
+        if sensor_id is not None:
+            _samples = _samples[_samples['sensor'] == sensor_id]
+        return _samples
+
+    def clear(self, origin_ms=0):
+        with self._lock:
+            self._header[self._H_HEAD] = 0
+            self._header[self._H_COUNT] = 0
+            self._header[self._H_ORIGIN_MS] = origin_ms
+            self._header[self._H_LAST_MS] = np.iinfo(np.int64).min
+            self._header.flush()
+
+    def flush(self):
+        with self._lock:
+            self._header.flush()
+            self._samples.flush()
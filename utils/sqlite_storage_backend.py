@@ -0,0 +1,240 @@
+import sqlite3
+import threading
+
+from domain.RollupResolution import RollupResolution
+from utils import record_codec
+from utils.storage_backend import StorageBackend
+
+
+class SqliteStorageBackend(StorageBackend):
+    """Single SQLite database in WAL mode.
+
+    Settings live in a key/value table, measurements and log messages in their own tables
+    indexed by timestamp, so range reads are answered by the index instead of by loading every
+    row. Log messages are additionally indexed by level and read in pages, using the
+    (timestamp_ms, key) of the last row seen as the cursor. Hourly and daily min/max/sum/count
+    rollups are updated in the same transaction as every new measurement. All SQL strings are
+    constants, so the connection's statement cache keeps them prepared between calls. Setting
+    values are stored as record_codec records; values still pickled by an older version are
+    rewritten as records the first time they are read.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS settings ("
+        " key TEXT PRIMARY KEY,"
+        " value BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS measurements ("
+        " timestamp_ms INTEGER NOT NULL,"
+        " value REAL NOT NULL,"
+        " raspberry_id TEXT NOT NULL DEFAULT '',"
+        " PRIMARY KEY (timestamp_ms, raspberry_id))",
+        "CREATE TABLE IF NOT EXISTS log_messages ("
+        " key TEXT PRIMARY KEY,"
+        " timestamp_ms INTEGER NOT NULL,"
+        " message TEXT NOT NULL,"
+        " level TEXT NOT NULL DEFAULT 'ANY')",
+        "CREATE TABLE IF NOT EXISTS measurement_rollups ("
+        " resolution TEXT NOT NULL,"
+        " bucket_start_ms INTEGER NOT NULL,"
+        " min_value REAL NOT NULL,"
+        " max_value REAL NOT NULL,"
+        " sum_value REAL NOT NULL,"
+        " count INTEGER NOT NULL,"
+        " PRIMARY KEY (resolution, bucket_start_ms))",
+    )
+
+    # created after older databases got the level column added
+    _INDEXES = (
+        "DROP INDEX IF EXISTS log_messages_timestamp_idx",
+        "CREATE INDEX IF NOT EXISTS log_messages_timestamp_key_idx ON log_messages (timestamp_ms, key)",
+        "CREATE INDEX IF NOT EXISTS log_messages_level_timestamp_key_idx ON log_messages (level, timestamp_ms, key)",
+    )
+
+    _GET_VALUE = "SELECT value FROM settings WHERE key = ?"
+    _SET_VALUE = "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)"
+    _DELETE_VALUE = "DELETE FROM settings WHERE key = ?"
+
+    _INSERT_MEASUREMENT = "INSERT OR IGNORE INTO measurements (timestamp_ms, value, raspberry_id) VALUES (?, ?, ?)"
+    _SELECT_MEASUREMENTS = ("SELECT timestamp_ms, value, raspberry_id FROM measurements"
+                            " WHERE timestamp_ms BETWEEN ? AND ? ORDER BY timestamp_ms")
+    _DELETE_MEASUREMENTS = "DELETE FROM measurements"
+
+    _UPSERT_ROLLUP = ("INSERT INTO measurement_rollups"
+                      " (resolution, bucket_start_ms, min_value, max_value, sum_value, count)"
+                      " VALUES (?, ?, ?, ?, ?, 1)"
+                      " ON CONFLICT (resolution, bucket_start_ms) DO UPDATE SET"
+                      " min_value = min(min_value, excluded.min_value),"
+                      " max_value = max(max_value, excluded.max_value),"
+                      " sum_value = sum_value + excluded.sum_value,"
+                      " count = count + 1")
+    _REBUILD_ROLLUPS = ("INSERT INTO measurement_rollups"
+                        " (resolution, bucket_start_ms, min_value, max_value, sum_value, count)"
+                        " SELECT ?, timestamp_ms - timestamp_ms % ?, MIN(value), MAX(value), SUM(value), COUNT(*)"
+                        " FROM measurements GROUP BY 2")
+    _HAS_ROLLUPS = "SELECT EXISTS (SELECT 1 FROM measurement_rollups)"
+    _HAS_MEASUREMENTS = "SELECT EXISTS (SELECT 1 FROM measurements)"
+    _SELECT_ROLLUPS = ("SELECT bucket_start_ms, min_value, max_value, sum_value, count FROM measurement_rollups"
+                       " WHERE resolution = ? AND bucket_start_ms BETWEEN ? AND ? ORDER BY bucket_start_ms")
+    _DELETE_ROLLUPS = "DELETE FROM measurement_rollups"
+
+    _LOG_MESSAGES_COLUMNS = "SELECT name FROM pragma_table_info('log_messages')"
+    _ADD_LOG_LEVEL_COLUMN = "ALTER TABLE log_messages ADD COLUMN level TEXT NOT NULL DEFAULT 'ANY'"
+    # messages synced back from Firestore carry no level, so they keep the one stored locally
+    _INSERT_LOG_MESSAGE = ("INSERT INTO log_messages (key, timestamp_ms, message, level) VALUES (?, ?, ?, ?)"
+                           " ON CONFLICT (key) DO UPDATE SET"
+                           " timestamp_ms = excluded.timestamp_ms,"
+                           " message = excluded.message,"
+                           " level = CASE WHEN excluded.level = 'ANY' THEN level ELSE excluded.level END")
+    _SELECT_LOG_MESSAGES = "SELECT key, message FROM log_messages ORDER BY timestamp_ms"
+    _SELECT_OLDER_LOG_MESSAGES = ("SELECT key, timestamp_ms, message, level FROM log_messages"
+                                  " WHERE timestamp_ms BETWEEN ? AND ? AND (timestamp_ms, key) < (?, ?)"
+                                  " ORDER BY timestamp_ms DESC, key DESC LIMIT ?")
+    _SELECT_OLDER_LOG_MESSAGES_BY_LEVEL = ("SELECT key, timestamp_ms, message, level FROM log_messages"
+                                           " WHERE level = ? AND timestamp_ms BETWEEN ? AND ? AND (timestamp_ms, key) < (?, ?)"
+                                           " ORDER BY timestamp_ms DESC, key DESC LIMIT ?")
+    _SELECT_NEWER_LOG_MESSAGES = ("SELECT key, timestamp_ms, message, level FROM log_messages"
+                                  " WHERE timestamp_ms BETWEEN ? AND ? AND (timestamp_ms, key) > (?, ?)"
+                                  " ORDER BY timestamp_ms, key LIMIT ?")
+    _SELECT_NEWER_LOG_MESSAGES_BY_LEVEL = ("SELECT key, timestamp_ms, message, level FROM log_messages"
+                                           " WHERE level = ? AND timestamp_ms BETWEEN ? AND ? AND (timestamp_ms, key) > (?, ?)"
+                                           " ORDER BY timestamp_ms, key LIMIT ?")
+    _DELETE_EXPIRED_LOG_MESSAGES = "DELETE FROM log_messages WHERE timestamp_ms < ?"
+    _DELETE_EXCESS_LOG_MESSAGES = ("DELETE FROM log_messages WHERE (timestamp_ms, key) <="
+                                   " (SELECT timestamp_ms, key FROM log_messages"
+                                   " ORDER BY timestamp_ms DESC, key DESC LIMIT 1 OFFSET ?)")
+    _DELETE_LOG_MESSAGES = "DELETE FROM log_messages"
+
+    _MIN_TIMESTAMP_MS = -(2 ** 63)
+    _MAX_TIMESTAMP_MS = 2 ** 63 - 1
+
+    def __init__(self, database_file='plant_buddy.db'):
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(database_file, check_same_thread=False, cached_statements=64)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # with WAL, FULL costs a single fsync of the log per commit
+        self._connection.execute("PRAGMA synchronous=FULL")
+
+        with self._connection:
+            for statement in self._SCHEMA:
+                self._connection.execute(statement)
+
+            _log_columns = [row[0] for row in self._connection.execute(self._LOG_MESSAGES_COLUMNS)]
+            if 'level' not in _log_columns:
+                self._connection.execute(self._ADD_LOG_LEVEL_COLUMN)
+
+            for statement in self._INDEXES:
+                self._connection.execute(statement)
+
+            # databases created before rollups existed get them computed once from the raw rows
+            if (not self._connection.execute(self._HAS_ROLLUPS).fetchone()[0]
+                    and self._connection.execute(self._HAS_MEASUREMENTS).fetchone()[0]):
+                for resolution in RollupResolution:
+                    self._connection.execute(self._REBUILD_ROLLUPS, (resolution.value, resolution.get_duration_ms()))
+
+    def get_value(self, key, default=None):
+        with self._lock:
+            _row = self._connection.execute(self._GET_VALUE, (key,)).fetchone()
+
+        if _row is None:
+            return default
+
+        _value = record_codec.decode(_row[0])
+        if not record_codec.is_record(_row[0]):
+            self.set_value(key, _value)
+        return _value
+
+    def set_value(self, key, value) -> None:
+        _blob = record_codec.encode(value)
+        with self._lock, self._connection:
+            self._connection.execute(self._SET_VALUE, (key, _blob))
+
+    def write_batch(self, values: dict, deleted_keys: list, log_entries: list[tuple]) -> None:
+        # one transaction, so the whole batch costs a single WAL fsync
+        _rows = [(key, record_codec.encode(value)) for key, value in values.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(self._SET_VALUE, _rows)
+            self._connection.executemany(self._DELETE_VALUE, [(key,) for key in deleted_keys])
+            self._connection.executemany(self._INSERT_LOG_MESSAGE, log_entries)
+
+    def delete_value(self, key) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(self._DELETE_VALUE, (key,))
+
+    def _insert_measurement(self, timestamp_ms, value, raspberry_id) -> bool:
+        _cursor = self._connection.execute(self._INSERT_MEASUREMENT, (int(timestamp_ms), float(value), raspberry_id))
+        if _cursor.rowcount == 0:
+            # already stored, so it is already counted in the rollups
+            return False
+
+        for resolution in RollupResolution:
+            _bucket_start_ms = resolution.get_bucket_start_ms(timestamp_ms)
+            self._connection.execute(self._UPSERT_ROLLUP, (resolution.value, _bucket_start_ms, value, value, value))
+        return True
+
+    def append_measurement(self, timestamp_ms, value, raspberry_id) -> bool:
+        with self._lock, self._connection:
+            return self._insert_measurement(timestamp_ms, value, raspberry_id)
+
+    def append_measurements(self, measurements: list[tuple]) -> None:
+        with self._lock, self._connection:
+            for timestamp_ms, value, raspberry_id in measurements:
+                self._insert_measurement(timestamp_ms, value, raspberry_id)
+
+    def get_measurements(self, start_ms=None, end_ms=None) -> list[tuple]:
+        _start_ms = start_ms if start_ms is not None else self._MIN_TIMESTAMP_MS
+        _end_ms = end_ms if end_ms is not None else self._MAX_TIMESTAMP_MS
+
+        with self._lock:
+            return self._connection.execute(self._SELECT_MEASUREMENTS, (_start_ms, _end_ms)).fetchall()
+
+    def clear_measurements(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(self._DELETE_MEASUREMENTS)
+            self._connection.execute(self._DELETE_ROLLUPS)
+
+    def get_rollups(self, resolution: RollupResolution, start_ms=None, end_ms=None) -> list[tuple]:
+        _start_ms = resolution.get_bucket_start_ms(start_ms) if start_ms is not None else self._MIN_TIMESTAMP_MS
+        _end_ms = end_ms if end_ms is not None else self._MAX_TIMESTAMP_MS
+
+        with self._lock:
+            return self._connection.execute(self._SELECT_ROLLUPS, (resolution.value, _start_ms, _end_ms)).fetchall()
+
+    def add_log_messages(self, entries: list[tuple]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(self._INSERT_LOG_MESSAGE, entries)
+
+    def replace_log_messages(self, entries: list[tuple]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(self._DELETE_LOG_MESSAGES)
+            self._connection.executemany(self._INSERT_LOG_MESSAGE, entries)
+
+    def get_log_messages(self) -> dict:
+        with self._lock:
+            return dict(self._connection.execute(self._SELECT_LOG_MESSAGES).fetchall())
+
+    def get_log_page(self, limit, level=None, start_ms=None, end_ms=None, cursor=None, newer=False) -> list[tuple]:
+        _start_ms = start_ms if start_ms is not None else self._MIN_TIMESTAMP_MS
+        _end_ms = end_ms if end_ms is not None else self._MAX_TIMESTAMP_MS
+        if cursor is None:
+            cursor = (self._MIN_TIMESTAMP_MS, '') if newer else (self._MAX_TIMESTAMP_MS, '')
+
+        if level is None:
+            _statement = self._SELECT_NEWER_LOG_MESSAGES if newer else self._SELECT_OLDER_LOG_MESSAGES
+            _parameters = (_start_ms, _end_ms, cursor[0], cursor[1], limit)
+        else:
+            _statement = self._SELECT_NEWER_LOG_MESSAGES_BY_LEVEL if newer else self._SELECT_OLDER_LOG_MESSAGES_BY_LEVEL
+            _parameters = (level, _start_ms, _end_ms, cursor[0], cursor[1], limit)
+
+        with self._lock:
+            return self._connection.execute(_statement, _parameters).fetchall()
+
+    def prune_log_messages(self, max_entries, min_timestamp_ms) -> int:
+        with self._lock, self._connection:
+            _deleted = self._connection.execute(self._DELETE_EXPIRED_LOG_MESSAGES, (min_timestamp_ms,)).rowcount
+            _deleted += self._connection.execute(self._DELETE_EXCESS_LOG_MESSAGES, (max_entries,)).rowcount
+            return _deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,95 @@
+from abc import ABC, abstractmethod
+
+from domain.RollupResolution import RollupResolution
+
+
+class StorageBackend(ABC):
+    """Persistence used by LocalStorageController.
+
+    Scalar settings are stored as key/value pairs, measurements as (timestamp_ms, value, raspberry_id)
+    rows and log messages as (key, timestamp_ms, message, level) rows, where key is the string timestamp
+    also used as the Firestore map key and level is a MessageType value.
+    """
+
+    @abstractmethod
+    def get_value(self, key, default=None):
+        pass
+
+    @abstractmethod
+    def set_value(self, key, value) -> None:
+        pass
+
+    @abstractmethod
+    def delete_value(self, key) -> None:
+        pass
+
+    @abstractmethod
+    def write_batch(self, values: dict, deleted_keys: list, log_entries: list[tuple]) -> None:
+        """Commits several settings and log messages together."""
+        pass
+
+    @abstractmethod
+    def append_measurement(self, timestamp_ms, value, raspberry_id) -> bool:
+        pass
+
+    def append_measurements(self, measurements: list[tuple]) -> None:
+        for timestamp_ms, value, raspberry_id in measurements:
+            self.append_measurement(timestamp_ms, value, raspberry_id)
+
+    @abstractmethod
+    def get_measurements(self, start_ms=None, end_ms=None) -> list[tuple]:
+        pass
+
+    @abstractmethod
+    def clear_measurements(self) -> None:
+        pass
+
+    def get_rollups(self, resolution: RollupResolution, start_ms=None, end_ms=None) -> list[tuple]:
+        """(bucket_start_ms, min, max, sum, count) of the buckets starting in the range, oldest first.
+
+        Aggregates the raw measurements on every call; backends keeping incremental rollups override it.
+        """
+        _start_ms = resolution.get_bucket_start_ms(start_ms) if start_ms is not None else None
+
+        _buckets = {}
+        for timestamp_ms, value, raspberry_id in self.get_measurements(_start_ms, end_ms):
+            _bucket_start_ms = resolution.get_bucket_start_ms(timestamp_ms)
+            _bucket = _buckets.get(_bucket_start_ms)
+            if _bucket is None:
+                _buckets[_bucket_start_ms] = [value, value, value, 1]
+            else:
+                _bucket[0] = min(_bucket[0], value)
+                _bucket[1] = max(_bucket[1], value)
+                _bucket[2] += value
+                _bucket[3] += 1
+
+        return [(bucket_start_ms, *_buckets[bucket_start_ms]) for bucket_start_ms in sorted(_buckets)]
+
+    @abstractmethod
+    def add_log_messages(self, entries: list[tuple]) -> None:
+        pass
+
+    @abstractmethod
+    def replace_log_messages(self, entries: list[tuple]) -> None:
+        pass
+
+    @abstractmethod
+    def get_log_messages(self) -> dict:
+        pass
+
+    @abstractmethod
+    def get_log_page(self, limit, level=None, start_ms=None, end_ms=None, cursor=None, newer=False) -> list[tuple]:
+        """Up to limit (key, timestamp_ms, message, level) rows, optionally of one level and time range.
+
+        cursor is the (timestamp_ms, key) of the last row of the previous page. Rows are returned newest
+        first and older than the cursor, or, with newer, oldest first and newer than the cursor.
+        """
+        pass
+
+    @abstractmethod
+    def prune_log_messages(self, max_entries, min_timestamp_ms) -> int:
+        """Deletes messages older than min_timestamp_ms and all but the newest max_entries."""
+        pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,104 @@
+import threading
+import time
+
+
+class TelemetryCoalescer:
+    """Sends the newest value of every field of a document, from a single background thread.
+
+    Progress updates overwrite each other's pending fields and are sent at most once per interval,
+    so a slow write delays the next one instead of piling more writes up behind it. Terminal
+    updates are sent as soon as the sender is free, ahead of progress updates, and absorb any
+    progress of the same document that was not sent yet, so nothing older can follow them.
+    send_function(document, fields, terminal) does the actual write and returns False when it
+    dropped the update instead.
+    """
+
+    def __init__(self, send_function, interval_sec=1.0):
+        self._send_function = send_function
+        self._interval_sec = interval_sec
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_terminal = {}
+        self._next_progress_send = 0.0
+
+        self._sent_updates = 0
+        self._coalesced_updates = 0
+        self._dropped_updates = 0
+        self._failed_updates = 0
+
+        self._wake_up = threading.Event()
+        self._sender_thread = threading.Thread(target=self._sender_worker, daemon=True)
+        self._sender_thread.start()
+
+    def set_interval(self, interval_sec: float):
+        self._interval_sec = max(0.0, interval_sec)
+        self._wake_up.set()
+
+    def get_interval(self) -> float:
+        return self._interval_sec
+
+    def update(self, document: str, fields: dict, terminal=False):
+        with self._lock:
+            if terminal:
+                _fields = self._pending.pop(document, {})
+                _fields.update(self._pending_terminal.get(document, {}))
+                _fields.update(fields)
+                self._pending_terminal[document] = _fields
+            else:
+                _fields = self._pending.setdefault(document, {})
+                if len(_fields) > 0:
+                    self._coalesced_updates += 1
+                _fields.update(fields)
+
+        if terminal or self._interval_sec == 0:
+            self._wake_up.set()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "sent": self._sent_updates,
+                "coalesced": self._coalesced_updates,
+                "dropped": self._dropped_updates,
+                "failed": self._failed_updates,
+                "pending": len(self._pending) + len(self._pending_terminal),
+            }
+
+    def _sender_worker(self):
+        while True:
+            self._wake_up.wait(self._interval_sec if self._interval_sec > 0 else None)
+            self._wake_up.clear()
+            self._send_pending()
+
+    def _send_pending(self):
+        _send_progress = time.monotonic() >= self._next_progress_send
+        if _send_progress:
+            self._next_progress_send = time.monotonic() + self._interval_sec
+
+        while True:
+            # taken one document at a time, so a terminal update that came in during the previous
+            # write goes next and absorbs that document's progress before it could be sent
+            with self._lock:
+                if len(self._pending_terminal) > 0:
+                    _pending, _terminal = self._pending_terminal, True
+                elif _send_progress and len(self._pending) > 0:
+                    _pending, _terminal = self._pending, False
+                else:
+                    return
+                _document = next(iter(_pending))
+                _fields = _pending.pop(_document)
+
+            try:
+                _sent = self._send_function(_document, _fields, _terminal) is not False
+                _failed = False
+            except Exception as e:
+                print(f'Error while sending {_document} telemetry: {e}')
+                _sent, _failed = False, True
+
+            with self._lock:
+                if _sent:
+                    self._sent_updates += 1
+                elif _failed:
+                    self._failed_updates += 1
+                else:
+                    self._dropped_updates += 1
@@ -1,6 +1,7 @@
 import threading
 import time
 
+from utils.async_runtime import run_blocking
 from utils.depth_sensor_controller import DepthSensorController
 from utils.local_storage_controller import LocalStorageController
 
@@ -47,6 +48,9 @@ class WaterDepthMeasurementController:
     def measure_water_depth_cm(self):
         return self._depth_sensor_controller.measure_water_depth_cm()
 
+    async def measure_water_depth_cm_async(self):
+        return await run_blocking(self.measure_water_depth_cm)
+
     def set_tank_volume_ratio(self, min_value, max_value, tank_volume):
         self._tank_volume_ratio = tank_volume / (max_value - min_value)
         self._max_height = max_value
@@ -74,6 +78,9 @@ class WaterDepthMeasurementController:
         print("Volume: ", _volume)
         return round(max(0.0, _volume), 2)
 
+    async def get_current_water_volume_async(self):
+        return await run_blocking(self.get_current_water_volume)
+
     def is_water_tank_empty(self) -> bool:
         return self.get_current_water_volume() < self._empty_tank_threshold
 
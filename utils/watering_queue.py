@@ -0,0 +1,240 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.local_storage_controller import LocalStorageController
+
+
+class WateringJob:
+    """Handle of a watering submitted to the WateringQueue, used to wait for it or read its timings."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    EXPIRED = "expired"
+    CANCELLED = "cancelled"
+
+    def __init__(self, zone_controller, liters, program_id, priority, deadline):
+        self.zone_controller = zone_controller
+        self.liters = liters
+        self.program_id = program_id
+        self.priority = priority
+        # time.monotonic() after which the job is dropped instead of started, None for no deadline
+        self.deadline = deadline
+
+        self.state = WateringJob.QUEUED
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = threading.Event()
+
+    def get_flow(self) -> float:
+        """Liters per second the job draws while it runs."""
+        return self.zone_controller.pump_controller.pump_capacity
+
+    def get_pump_pin(self):
+        return self.zone_controller.zone.pump_pin
+
+    def wait(self, timeout=None) -> bool:
+        """Waits until the job ran, failed or expired. Returns True if it watered."""
+        self._finished.wait(timeout)
+        return self.state == WateringJob.DONE
+
+    def get_queue_wait_sec(self):
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    def get_completion_latency_sec(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+    def to_dict(self) -> dict:
+        return {
+            "zoneId": self.zone_controller.zone.id,
+            "programId": self.program_id,
+            "liters": self.liters,
+            "priority": self.priority,
+            "state": self.state,
+            "queueWaitSec": self.get_queue_wait_sec(),
+            "completionLatencySec": self.get_completion_latency_sec(),
+        }
+
+
+class WateringQueue:
+    """Runs waterings so that together they stay within the capacity of the pumps and the water supply.
+
+    Jobs wait in a queue ordered by priority (higher first) and then by deadline. Whenever a job is
+    submitted or one ends, the queue starts every waiting job that fits: its pump is free and the
+    flow of the running jobs plus its own stays within the supply capacity. A job that does not fit
+    is passed over, so smaller ones from other zones can run next to the ones already running.
+    A job that could not start before its deadline expires. submit() returns at once.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    # liters per second the supply feeds when none was calibrated, about three of the default pumps
+    _DEFAULT_SUPPLY_CAPACITY_LPS = 0.05
+
+    def __new__(cls):
+        with cls._lock:
+            if not cls._instance:
+                cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, '_initialized', None):
+            return
+        self._initialized = True
+
+        _supply_capacity = LocalStorageController().get_supply_capacity()
+        self._supply_capacity_lps = (_supply_capacity if _supply_capacity is not None
+                                     else self._DEFAULT_SUPPLY_CAPACITY_LPS)
+        self._max_parallel_jobs = 4
+
+        self._queue_lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running_jobs = []
+        self._finished_jobs = deque(maxlen=100)
+
+        self._completed_jobs = 0
+        self._failed_jobs = 0
+        self._expired_jobs = 0
+        self._total_queue_wait_sec = 0.0
+        self._total_completion_latency_sec = 0.0
+
+        self._executor = ThreadPoolExecutor(max_workers=self._max_parallel_jobs, thread_name_prefix="watering")
+
+    def set_supply_capacity(self, liters_per_second: float):
+        LocalStorageController().set_supply_capacity(float(liters_per_second))
+        with self._queue_lock:
+            self._supply_capacity_lps = float(liters_per_second)
+        self._start_fitting_jobs()
+
+    def get_supply_capacity(self) -> float:
+        return self._supply_capacity_lps
+
+    def submit(self, zone_controller, liters, program_id=None, priority=0.0, deadline_sec=None) -> WateringJob:
+        """Queues a watering. deadline_sec is how long it may wait to start, None to wait as long as it takes."""
+        _deadline = time.monotonic() + deadline_sec if deadline_sec is not None else None
+        _job = WateringJob(zone_controller, liters, program_id, priority, _deadline)
+
+        with self._queue_lock:
+            heapq.heappush(self._queue, (self._get_order(_job), next(self._sequence), _job))
+
+        self._start_fitting_jobs()
+        return _job
+
+    def cancel_queued_jobs(self, program_ids) -> int:
+        """Drops the waiting jobs of the programs, the running ones finish. Returns how many were dropped."""
+        _program_ids = set(program_ids)
+        with self._queue_lock:
+            _cancelled = [entry[2] for entry in self._queue if entry[2].program_id in _program_ids]
+            self._queue = [entry for entry in self._queue if entry[2].program_id not in _program_ids]
+            heapq.heapify(self._queue)
+
+        for _job in _cancelled:
+            self._finish_job(_job, WateringJob.CANCELLED)
+        return len(_cancelled)
+
+    @staticmethod
+    def _get_order(job):
+        return -job.priority, job.deadline if job.deadline is not None else float('inf')
+
+    def _fits(self, job) -> bool:
+        if len(self._running_jobs) >= self._max_parallel_jobs:
+            return False
+
+        # a pump feeds one zone at a time, also when several zones share it through valves
+        if any(running_job.get_pump_pin() == job.get_pump_pin() for running_job in self._running_jobs):
+            return False
+
+        # a job that is alone may use a pump stronger than the supply, otherwise it would never run
+        if len(self._running_jobs) == 0:
+            return True
+        _current_flow = sum(running_job.get_flow() for running_job in self._running_jobs)
+        return _current_flow + job.get_flow() <= self._supply_capacity_lps
+
+    def _start_fitting_jobs(self):
+        _expired = []
+        with self._queue_lock:
+            _now = time.monotonic()
+            _waiting = []
+            while len(self._queue) > 0:
+                _entry = heapq.heappop(self._queue)
+                _job = _entry[2]
+
+                if _job.deadline is not None and _now > _job.deadline:
+                    _expired.append(_job)
+                elif self._fits(_job):
+                    _job.state = WateringJob.RUNNING
+                    _job.started_at = _now
+                    self._running_jobs.append(_job)
+                    self._executor.submit(self._run_job, _job)
+                else:
+                    _waiting.append(_entry)
+
+            for _entry in _waiting:
+                heapq.heappush(self._queue, _entry)
+
+        for _job in _expired:
+            print(f"Watering of program {_job.program_id} expired before it could start")
+            self._finish_job(_job, WateringJob.EXPIRED)
+
+    def _run_job(self, job):
+        try:
+            _watered = job.zone_controller.water_for_liters(job.liters, job.program_id)
+        except Exception as e:
+            print(f"Error while watering zone {job.zone_controller.zone}: {e}")
+            _watered = False
+
+        with self._queue_lock:
+            self._running_jobs.remove(job)
+        self._finish_job(job, WateringJob.DONE if _watered else WateringJob.FAILED)
+
+        self._start_fitting_jobs()
+
+    def _finish_job(self, job, state):
+        job.finished_at = time.monotonic()
+        job.state = state
+
+        with self._queue_lock:
+            self._finished_jobs.append(job)
+            if state == WateringJob.DONE:
+                self._completed_jobs += 1
+                self._total_queue_wait_sec += job.get_queue_wait_sec()
+                self._total_completion_latency_sec += job.get_completion_latency_sec()
+            elif state == WateringJob.FAILED:
+                self._failed_jobs += 1
+            elif state == WateringJob.EXPIRED:
+                self._expired_jobs += 1
+
+        job._finished.set()
+
+    def get_stats(self) -> dict:
+        with self._queue_lock:
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running_jobs),
+                "completed": self._completed_jobs,
+                "failed": self._failed_jobs,
+                "expired": self._expired_jobs,
+                "current_flow_lps": sum(job.get_flow() for job in self._running_jobs),
+                "supply_capacity_lps": self._supply_capacity_lps,
+                "avg_queue_wait_sec": (self._total_queue_wait_sec / self._completed_jobs
+                                       if self._completed_jobs > 0 else 0.0),
+                "avg_completion_latency_sec": (self._total_completion_latency_sec / self._completed_jobs
+                                               if self._completed_jobs > 0 else 0.0),
+            }
+
+    def get_job_stats(self) -> list[dict]:
+        """Queue wait and completion latency of the last finished jobs, newest last."""
+        with self._queue_lock:
+            return [job.to_dict() for job in self._finished_jobs]
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from domain.WateringZone import WateringZone
+from utils.datetime_utils import get_current_datetime_tz
+from utils.event_logger import EventLogger
+from utils.local_storage_controller import LocalStorageController
+from utils.moisture_controller import MoistureController
+from utils.pump_controller import PumpController
+from utils.raspberry_controller import RaspberryController
+from utils.water_depth_measurement_controller import WaterDepthMeasurementController
+
+
+class WateringZoneController:
+    """The pump, the moisture sensor and the watering state of one zone."""
+
+    def __init__(self, zone: WateringZone):
+        self.zone = zone
+
+        if zone.id == WateringZone.DEFAULT_ZONE_ID:
+            # the default zone is the pump and sensor that manual watering and calibration use
+            self.pump_controller = RaspberryController().pump_controller
+            self.moisture_controller = RaspberryController().moisture_controller
+        else:
+            self.pump_controller = PumpController(
+                pin=zone.pump_pin,
+                liters_per_second=LocalStorageController().get_pump_capacity()
+            )
+            self.moisture_controller = MoistureController(channel=zone.moisture_channel)
+
+        self._watering_lock = threading.Lock()
+        self._last_watering_start_time = None
+        self._last_watering_liters = 0.0
+
+    def is_default_zone(self) -> bool:
+        return self.zone.id == WateringZone.DEFAULT_ZONE_ID
+
+    def is_watering(self) -> bool:
+        return self._watering_lock.locked()
+
+    def get_last_watering(self):
+        return self._last_watering_start_time, self._last_watering_liters
+
+    def get_moisture_percentage(self):
+        return self.moisture_controller.get_moisture_percentage()
+
+    def water_for_liters(self, liters, program_id) -> bool:
+        """Waters the zone unless it is already watering for another program."""
+        if not self._watering_lock.acquire(blocking=False):
+            print(f"Zone {self.zone} is already watering, skipping program {program_id}")
+            return False
+
+        try:
+            _start_time = get_current_datetime_tz()
+            if self.is_default_zone():
+                _watered = RaspberryController().water_for_liters(liters)
+            else:
+                _watered = self._water_for_liters(liters, _start_time)
+
+            if _watered:
+                self._last_watering_start_time = _start_time
+                self._last_watering_liters = liters
+                LocalStorageController().set_last_watering_time(_start_time, program_id)
+            return _watered
+        finally:
+            self._watering_lock.release()
+
+    def _water_for_liters(self, liters, start_time) -> bool:
+        if self.pump_controller.is_watering:
+            return False
+
+        if WaterDepthMeasurementController().is_water_tank_empty():
+            EventLogger().add_no_water_in_tank_message(start_time)
+            return False
+
+        _started = time.time()
+        self.pump_controller.start_watering_for_liters(liters)
+        _watering_time = time.time() - _started
+
+        EventLogger().add_auto_watering_cycle_message(
+            start_time,
+            _watering_time,
+            _watering_time * self.pump_controller.pump_capacity
+        )
+        return True